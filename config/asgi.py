@@ -2,6 +2,8 @@
 ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Besides Django's HTTP views it serves the WebSocket endpoints routed in
+``core.asgi``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready.
+from core import live, telemetry  # noqa: E402
+from core.asgi import ProtocolRouter  # noqa: E402
+
+application = ProtocolRouter(
+    django_application,
+    websockets={
+        telemetry.WEBSOCKET_PATH: telemetry.device_socket,
+        live.WEBSOCKET_PATH: live.booking_socket,
+    },
+    on_shutdown=[telemetry.shutdown],
+)
@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -16,6 +17,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = ['*']
 
+# `manage.py test` runs in one process against a throwaway database.
+TESTING = sys.argv[1:2] == ['test']
+
 
 # Application definition
 
@@ -37,8 +41,20 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.QueryInstrumentationMiddleware',
 ]
 
+# Per-request query/latency instrumentation (core.middleware), off unless
+# REQUEST_STATS_ENABLED=1 is set and never during tests. Inspect the collected
+# histograms with `python manage.py request_stats`.
+REQUEST_STATS_ENABLED = os.environ.get('REQUEST_STATS_ENABLED') == '1' and not TESTING
+REQUEST_STATS_DIR = BASE_DIR / 'var' / 'request_stats'
+REQUEST_STATS_FLUSH_SECONDS = 10
+
+# How long a worker serves its in-memory autocomplete index (core.autocomplete)
+# before rebuilding it; its own writes are applied as they happen.
+AUTOCOMPLETE_REFRESH_SECONDS = 600
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -51,6 +67,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.unread_notifications',
             ],
         },
     },
@@ -58,6 +75,30 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
+# Live GPS telemetry (core.telemetry), served by config.asgi.application.
+TELEMETRY_FLUSH_SECONDS = 1.0
+TELEMETRY_POSITION_SECONDS = 30
+TELEMETRY_MAX_BUFFERED = 200000
+TELEMETRY_TOKEN_MAX_AGE = 12 * 60 * 60
+# How often live job hours and worked area (core.jobs) are saved while fixes arrive.
+TELEMETRY_ANALYSIS_SECONDS = 60
+
+# Fan-out of live booking updates to watching farmers (core.live); the local
+# broker only reaches subscribers connected to the same process.
+LIVE_BROKER = {'BACKEND': 'core.live.LocalBroker'}
+
+AUTH_USER_MODEL = 'core.User'
+
+# Shared secret mobile-money gateways send in the X-Callback-Token header;
+# the callback endpoint refuses every request while it is unset.
+PAYMENT_CALLBACK_TOKEN = os.environ.get('PAYMENT_CALLBACK_TOKEN', '')
+
+# Delivery clients used by dispatch_notifications; swap in real gateways in production.
+NOTIFICATION_GATEWAYS = {
+    'sms': {'BACKEND': 'core.notifications.FakeGateway'},
+    'push': {'BACKEND': 'core.notifications.FakeGateway'},
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -69,6 +110,62 @@ DATABASES = {
     }
 }
 
+# "Production SQLite" for single-server county deployments (SQLITE_PRODUCTION=1):
+# WAL lets readers run alongside the writer, busy_timeout makes writers queue
+# instead of failing with "database is locked", and BEGIN IMMEDIATE takes the
+# write lock up front so two read-then-write transactions cannot deadlock.
+SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION', '') == '1'
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 20000))
+SQLITE_PRODUCTION_OPTIONS = {
+    'init_command': ';'.join([
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))}",
+        f"PRAGMA cache_size=-{int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))}",
+        'PRAGMA temp_store=MEMORY',
+    ]),
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+}
+if SQLITE_PRODUCTION:
+    DATABASES['default'].update(
+        OPTIONS=SQLITE_PRODUCTION_OPTIONS,
+        CONN_MAX_AGE=int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        CONN_HEALTH_CHECKS=True,
+    )
+
+# Optional read replica for discovery and analytics reads (core.routers). Any
+# up-to-date copy of the primary will do; locally, point this at a second
+# SQLite file and refresh it with `python manage.py sync_replica`.
+REPLICA_DATABASE_NAME = os.environ.get('REPLICA_DATABASE_NAME', '')
+REPLICA_PIN_SECONDS = 10
+if REPLICA_DATABASE_NAME:
+    DATABASES['replica'] = {**DATABASES['default'], 'NAME': REPLICA_DATABASE_NAME, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.contrib.sessions.middleware.SessionMiddleware'),
+                      'core.routers.PrimaryPinningMiddleware')
+elif TESTING:
+    # A real second SQLite file for the routing tests. Nothing is routed to
+    # it unless a test installs the router.
+    DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'NAME': BASE_DIR / 'test_replica.sqlite3'}}
+
+
+# Quotes (core.pricing), facet counts (core.facets) and unread badges
+# (core.unread) are cached and invalidated by whichever worker makes the
+# write, so every worker must read the same cache: Redis when CACHE_REDIS_URL
+# is set, otherwise a directory shared by the processes on this server. The
+# per-process default, LocMemCache, would leave other workers serving stale
+# values until they expire; tests run in one process and keep it.
+if os.environ.get('CACHE_REDIS_URL'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                          'LOCATION': os.environ['CACHE_REDIS_URL']}}
+elif TESTING:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                          'LOCATION': BASE_DIR / 'var' / 'cache', 'OPTIONS': {'MAX_ENTRIES': 100000}}}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -110,3 +207,15 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.instrumentation': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
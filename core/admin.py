@@ -1,3 +1,206 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
-# Register your models here.
+from . import availability, transitions
+from .models import (
+    BookingReview, Equipment, EquipmentCategory, EquipmentImage, FarmerProfile, MaintenanceLog,
+    Notification, OperatorPayout, OperatorProfile, Payment, RentalBooking, ServiceArea, SupportTicket, User,
+)
+
+
+class RelatedQuerySetMixin:
+    """
+    Joins the relations ``__str__`` and the list columns walk, for every
+    admin queryset (changelists, autocomplete results, object pages), so a
+    page costs the same number of queries whatever its size.
+    """
+    select_related = ()
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(*self.select_related)
+
+
+@admin.register(User)
+class UserAdmin(BaseUserAdmin):
+    list_display = ('username', 'get_full_name', 'role', 'phone_number', 'id_verified', 'is_active')
+    list_filter = ('role', 'id_verified', 'is_staff', 'is_active')
+    search_fields = ('username', 'first_name', 'last_name', 'email', 'phone_number', 'national_id')
+    fieldsets = BaseUserAdmin.fieldsets + (
+        ('Platform', {'fields': ('role', 'phone_number', 'profile_photo', 'national_id', 'id_verified')}),
+    )
+
+
+@admin.register(FarmerProfile)
+class FarmerProfileAdmin(RelatedQuerySetMixin, admin.ModelAdmin):
+    select_related = ('user',)
+    list_display = ('farmer_name', 'farm_name', 'county', 'village', 'primary_crop', 'total_land_acres')
+    list_filter = ('has_smartphone',)
+    search_fields = ('user__first_name', 'user__last_name', 'user__phone_number', 'farm_name', 'county', 'village')
+    autocomplete_fields = ('user',)
+
+    @admin.display(description='Farmer', ordering='user__first_name')
+    def farmer_name(self, obj):
+        return obj.user.get_full_name()
+
+
+class ServiceAreaInline(admin.TabularInline):
+    model = ServiceArea
+    extra = 0
+
+
+@admin.register(OperatorProfile)
+class OperatorProfileAdmin(RelatedQuerySetMixin, admin.ModelAdmin):
+    select_related = ('user',)
+    list_display = ('operator_name', 'business_name', 'county', 'average_rating', 'total_jobs_completed',
+                    'is_available')
+    list_filter = ('is_available',)
+    search_fields = ('user__first_name', 'user__last_name', 'user__phone_number', 'business_name', 'county')
+    autocomplete_fields = ('user',)
+    inlines = (ServiceAreaInline,)
+
+    @admin.display(description='Operator', ordering='user__first_name')
+    def operator_name(self, obj):
+        return obj.user.get_full_name()
+
+
+@admin.register(EquipmentCategory)
+class EquipmentCategoryAdmin(admin.ModelAdmin):
+    list_display = ('name', 'icon')
+    search_fields = ('name',)
+
+
+class EquipmentImageInline(admin.TabularInline):
+    model = EquipmentImage
+    extra = 0
+
+
+@admin.register(Equipment)
+class EquipmentAdmin(RelatedQuerySetMixin, admin.ModelAdmin):
+    select_related = ('owner__user', 'category')
+    list_display = ('name', 'brand', 'model', 'category_name', 'owner_name', 'current_county', 'daily_rate',
+                    'status')
+    list_filter = ('status', 'fuel_type', 'price_includes_operator', 'price_includes_fuel')
+    search_fields = ('name', 'brand', 'model', 'serial_number', 'current_county')
+    autocomplete_fields = ('owner', 'category')
+    readonly_fields = ('geohash',)
+    inlines = (EquipmentImageInline,)
+
+    @admin.display(description='Category', ordering='category__name')
+    def category_name(self, obj):
+        return obj.category.name
+
+    @admin.display(description='Owner', ordering='owner__user__first_name')
+    def owner_name(self, obj):
+        return obj.owner.user.get_full_name()
+
+
+def transition_action(target):
+    """Admin action moving the selected bookings to ``target`` through ``transitions.transition()``."""
+    def action(modeladmin, request, queryset):
+        moved, refused = 0, []
+        for booking in queryset:
+            try:
+                transitions.transition(booking, target, by=request.user)
+            except (transitions.TransitionError, availability.BookingConflict) as exc:
+                refused.append(str(exc))
+            else:
+                moved += 1
+        if moved:
+            modeladmin.message_user(request, f"Moved {moved} booking(s) to {target.label}.", messages.SUCCESS)
+        for reason in refused:
+            modeladmin.message_user(request, reason, messages.WARNING)
+    action.__name__ = f'mark_{target.value}'
+    return admin.action(description=f"Mark selected bookings as {target.label.lower()}")(action)
+
+
+@admin.register(RentalBooking)
+class RentalBookingAdmin(RelatedQuerySetMixin, admin.ModelAdmin):
+    select_related = ('farmer__user', 'equipment', 'operator__user')
+    list_display = ('id', 'farmer_name', 'equipment_name', 'requested_start_date', 'requested_end_date',
+                    'total_amount', 'status', 'payment_status')
+    list_filter = ('status', 'payment_status')
+    search_fields = ('=id', 'farmer__user__first_name', 'farmer__user__last_name', 'equipment__name',
+                     'farm_location_county')
+    autocomplete_fields = ('farmer', 'equipment', 'operator')
+    show_full_result_count = False
+    # Status only moves through transitions.transition(), which keeps the unit, job counts,
+    # payouts and notifications in step; these actions are the admin's way to use it.
+    readonly_fields = ('status', 'payment_status')
+    actions = [transition_action(target) for target in (
+        RentalBooking.Status.CONFIRMED, RentalBooking.Status.IN_PROGRESS, RentalBooking.Status.COMPLETED,
+        RentalBooking.Status.DISPUTED, RentalBooking.Status.CANCELLED_FARMER,
+        RentalBooking.Status.CANCELLED_OPERATOR,
+    )]
+
+    @admin.display(description='Farmer', ordering='farmer__user__first_name')
+    def farmer_name(self, obj):
+        return obj.farmer.user.get_full_name()
+
+    @admin.display(description='Equipment', ordering='equipment__name')
+    def equipment_name(self, obj):
+        return obj.equipment.name
+
+
+@admin.register(Payment)
+class PaymentAdmin(admin.ModelAdmin):
+    list_display = ('transaction_id', 'booking_id', 'amount', 'method', 'payment_type', 'is_confirmed', 'paid_at')
+    list_filter = ('is_confirmed', 'method', 'payment_type')
+    search_fields = ('=transaction_id', '=booking__id')
+    autocomplete_fields = ('booking',)
+    show_full_result_count = False
+
+
+@admin.register(OperatorPayout)
+class OperatorPayoutAdmin(RelatedQuerySetMixin, admin.ModelAdmin):
+    select_related = ('operator__user',)
+    list_display = ('id', 'operator_name', 'booking_id', 'gross_amount', 'platform_fee_amount', 'net_amount',
+                    'status', 'completed_at')
+    list_filter = ('status',)
+    search_fields = ('=booking__id', 'payout_reference', 'operator__user__first_name', 'operator__user__last_name')
+    autocomplete_fields = ('operator', 'booking')
+
+    @admin.display(description='Operator', ordering='operator__user__first_name')
+    def operator_name(self, obj):
+        return obj.operator.user.get_full_name()
+
+
+@admin.register(BookingReview)
+class BookingReviewAdmin(RelatedQuerySetMixin, admin.ModelAdmin):
+    select_related = ('reviewer', 'reviewee')
+    list_display = ('booking_id', 'reviewer', 'reviewee', 'rating', 'punctuality_rating', 'quality_rating',
+                    'created_at')
+    list_filter = ('rating',)
+    search_fields = ('=booking__id', 'reviewer__username', 'reviewee__username')
+    autocomplete_fields = ('booking', 'reviewer', 'reviewee')
+
+
+@admin.register(MaintenanceLog)
+class MaintenanceLogAdmin(RelatedQuerySetMixin, admin.ModelAdmin):
+    select_related = ('equipment',)
+    list_display = ('equipment_name', 'service_date', 'service_type', 'cost', 'next_service_date')
+    search_fields = ('equipment__name', 'service_type', 'performed_by')
+    autocomplete_fields = ('equipment',)
+
+    @admin.display(description='Equipment', ordering='equipment__name')
+    def equipment_name(self, obj):
+        return obj.equipment.name
+
+
+@admin.register(SupportTicket)
+class SupportTicketAdmin(RelatedQuerySetMixin, admin.ModelAdmin):
+    select_related = ('submitter', 'assigned_to')
+    list_display = ('id', 'subject', 'submitter', 'booking_id', 'status', 'priority', 'assigned_to', 'created_at')
+    list_filter = ('status', 'priority')
+    search_fields = ('=id', 'subject', 'submitter__username')
+    autocomplete_fields = ('submitter', 'booking', 'assigned_to')
+
+
+@admin.register(Notification)
+class NotificationAdmin(RelatedQuerySetMixin, admin.ModelAdmin):
+    select_related = ('user',)
+    list_display = ('title', 'user', 'channel', 'is_read', 'delivery_status', 'attempts', 'related_booking_id',
+                    'sent_at')
+    list_filter = ('channel', 'delivery_status', 'is_read')
+    search_fields = ('title', 'user__username')
+    autocomplete_fields = ('user', 'related_booking')
+    show_full_result_count = False
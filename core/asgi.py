@@ -0,0 +1,62 @@
+"""
+ASGI entry point shared by Django's HTTP views and the WebSocket endpoints.
+
+Django's ASGI handler only speaks HTTP, so ``ProtocolRouter`` sends
+WebSocket connections to plain ASGI callables by path and answers the
+server's lifespan events, running shutdown hooks (such as the final
+telemetry flush) before the process exits.
+"""
+import logging
+from importlib import import_module
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib import auth
+from django.http import parse_cookie
+
+logger = logging.getLogger('core.asgi')
+
+
+def session_user(scope):
+    """The user logged in with the connection's session cookie, or ``AnonymousUser``; queries the database."""
+    cookies = {}
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookies.update(parse_cookie(value.decode('latin-1')))
+    store = import_module(settings.SESSION_ENGINE).SessionStore
+    session = store(cookies.get(settings.SESSION_COOKIE_NAME))
+    return auth.get_user(SimpleNamespace(session=session))
+
+
+class ProtocolRouter:
+    def __init__(self, http, websockets, on_shutdown=()):
+        self.http = http
+        self.websockets = websockets
+        self.on_shutdown = list(on_shutdown)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            return await self.http(scope, receive, send)
+        if scope['type'] == 'websocket':
+            handler = self.websockets.get(scope['path'])
+            if handler is None:
+                await receive()
+                return await send({'type': 'websocket.close', 'code': 4404})
+            return await handler(scope, receive, send)
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+    async def lifespan(self, receive, send):
+        while True:
+            event = await receive()
+            if event['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif event['type'] == 'lifespan.shutdown':
+                for hook in self.on_shutdown:
+                    try:
+                        await hook()
+                    except Exception:
+                        logger.exception("Shutdown hook %r failed", hook)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,255 @@
+"""
+Typeahead for the marketplace's free-text fields: counties, villages, crops
+and equipment brands.
+
+Each kind is served from an in-process ``Index``: the distinct normalised
+values in a sorted list, each with how many rows use it. A prefix is a
+``bisect`` range over that list and the answer is its most frequent values;
+answers for prefixes of up to ``CACHED_PREFIX`` characters are memoised, so
+the first keystrokes, whose ranges are widest, cost a dict lookup.
+
+Values are normalised before they are counted: case, accents, apostrophes
+and punctuation are folded, a trailing " County" is dropped and known
+aliases ("corn", "mahindi") map to one key ("maize"). Each key is shown in
+its most common spelling, and ``variants()`` lists every stored spelling so
+filters match all of them.
+
+An index is built with one ``GROUP BY`` per source column and rebuilt after
+``AUTOCOMPLETE_REFRESH_SECONDS``; in between, rows created, changed or
+deleted in this process are applied to it as they commit: an edit moves a
+row's count from the value it was loaded with to its new one. Other
+processes see them at their next rebuild. Readers and writers of an index
+share its lock.
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Equipment, FarmerProfile, OperatorProfile, RentalBooking, ServiceArea
+
+SOURCES = {
+    'county': [(FarmerProfile, 'county'), (OperatorProfile, 'county'), (Equipment, 'current_county'),
+               (ServiceArea, 'county'), (RentalBooking, 'farm_location_county')],
+    'village': [(FarmerProfile, 'village')],
+    'crop': [(RentalBooking, 'crop_type'), (FarmerProfile, 'primary_crop')],
+    'brand': [(Equipment, 'brand')],
+}
+
+# Normalised spelling -> normalised canonical value.
+ALIASES = {
+    'county': {'nairobi city': 'nairobi', 'tharaka': 'tharaka nithi', 'elgeyo': 'elgeyo marakwet'},
+    'crop': {
+        'corn': 'maize', 'mahindi': 'maize', 'maharagwe': 'beans', 'bean': 'beans', 'ngano': 'wheat',
+        'potato': 'potatoes', 'irish potatoes': 'potatoes', 'viazi': 'potatoes', 'mtama': 'sorghum',
+        'mchele': 'rice', 'mpunga': 'rice', 'miwa': 'sugarcane', 'sugar cane': 'sugarcane',
+        'wimbi': 'millet', 'muhogo': 'cassava', 'mihogo': 'cassava',
+    },
+    'brand': {
+        'jd': 'john deere', 'johndeere': 'john deere', 'deere': 'john deere', 'mf': 'massey ferguson',
+        'massey': 'massey ferguson', 'nh': 'new holland', 'case': 'case ih',
+    },
+}
+SUFFIXES = {'county': ' county'}
+
+CACHED_PREFIX = 3
+MAX_LIMIT = 20
+
+_WORD = re.compile(r'[^\W_]+')
+
+
+def fold(text):
+    """Lower-case ``text`` without accents, apostrophes or punctuation."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    return ' '.join(_WORD.findall(text.replace("'", '').replace('’', '')))
+
+
+def normalize(kind, text):
+    key = fold(text)
+    suffix = SUFFIXES.get(kind)
+    if suffix and key.endswith(suffix):
+        key = key[:-len(suffix)]
+    return ALIASES.get(kind, {}).get(key, key)
+
+
+@dataclass(frozen=True)
+class Suggestion:
+    value: str
+    count: int
+
+
+class Index:
+    """Distinct values of one kind with their row counts, searchable by prefix."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.counts = Counter()
+        self.spellings = {}
+        self.terms = []
+        self.targets = {}
+        self.built_at = time.monotonic()
+        self._top = {}
+        self._lock = threading.RLock()
+
+    def _aliases(self, key):
+        return [alias for alias, target in ALIASES.get(self.kind, {}).items() if target == key]
+
+    def add(self, value, n=1):
+        """Count ``n`` more (or, negative, fewer) rows holding ``value``."""
+        key = normalize(self.kind, value)
+        if not key or not n:
+            return
+        with self._lock:
+            is_new = key not in self.counts
+            if is_new and n < 0:
+                return
+            self.counts[key] += n
+            spellings = self.spellings.setdefault(key, Counter())
+            spellings[value.strip()] += n
+            if spellings[value.strip()] <= 0:
+                del spellings[value.strip()]
+            terms = [key, *self._aliases(key)]
+            if is_new:
+                for term in terms:
+                    self.targets[term] = key
+                    bisect.insort(self.terms, term)
+            elif self.counts[key] <= 0:
+                del self.counts[key], self.spellings[key]
+                for term in terms:
+                    del self.targets[term]
+                    self.terms.pop(bisect.bisect_left(self.terms, term))
+            for term in terms:
+                for length in range(1, CACHED_PREFIX + 1):
+                    self._top.pop(term[:length], None)
+
+    def include(self, value):
+        """Make ``value`` suggestible without changing the count of a value already known."""
+        with self._lock:
+            if normalize(self.kind, value) not in self.counts:
+                self.add(value)
+
+    def suggest(self, prefix, limit=10):
+        """The ``limit`` most used values starting with ``prefix``, most used first."""
+        prefix = fold(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            top = self._top.get(prefix)
+            if top is None:
+                lo = bisect.bisect_left(self.terms, prefix)
+                hi = bisect.bisect_left(self.terms, prefix + '\uffff', lo)
+                keys = {self.targets[term] for term in self.terms[lo:hi]}
+                top = heapq.nsmallest(MAX_LIMIT, keys, key=lambda key: (-self.counts[key], key))
+                if len(prefix) <= CACHED_PREFIX:
+                    self._top[prefix] = top
+            return [Suggestion(self.display(key), self.counts[key]) for key in top[:limit]]
+
+    def display(self, key):
+        return self.spellings[key].most_common(1)[0][0]
+
+    def canonical(self, value):
+        """The usual spelling of ``value``, or ``value`` itself if it is unknown."""
+        key = normalize(self.kind, value)
+        with self._lock:
+            return self.display(key) if self.spellings.get(key) else value.strip()
+
+    def variants(self, value):
+        """Every stored spelling that normalises like ``value``."""
+        with self._lock:
+            return sorted(self.spellings.get(normalize(self.kind, value), ())) or [value.strip()]
+
+
+_indexes = {}
+_build_lock = threading.Lock()
+
+
+def build(kind):
+    """A fresh index of ``kind`` from one ``GROUP BY`` query per source column."""
+    built = Index(kind)
+    for model, field in SOURCES[kind]:
+        rows = model.objects.order_by().exclude(**{field: ''}).values_list(field).annotate(n=Count('pk'))
+        for value, n in rows:
+            built.add(value, n)
+    return built
+
+
+def index(kind):
+    """
+    The current index of ``kind``. A stale index keeps serving while one
+    request rebuilds it; only the very first build makes callers wait.
+    """
+    if kind not in SOURCES:
+        raise KeyError(kind)
+    current = _indexes.get(kind)
+    refresh = getattr(settings, 'AUTOCOMPLETE_REFRESH_SECONDS', 600)
+    if current is not None and time.monotonic() - current.built_at < refresh:
+        return current
+    if _build_lock.acquire(blocking=current is None):
+        try:
+            latest = _indexes.get(kind)
+            if latest is current:
+                _indexes[kind] = build(kind)
+        finally:
+            _build_lock.release()
+    return _indexes[kind]
+
+
+def suggest(kind, prefix, limit=10):
+    return index(kind).suggest(prefix, max(1, min(limit, MAX_LIMIT)))
+
+
+def canonical(kind, value):
+    return index(kind).canonical(value)
+
+
+def variants(kind, value):
+    return index(kind).variants(value)
+
+
+def reset():
+    _indexes.clear()
+
+
+def _apply(instance, change):
+    """Run ``change(index, field, value)`` on commit for each index ``instance``'s model feeds."""
+    for kind, sources in SOURCES.items():
+        built = _indexes.get(kind)
+        if built is None:
+            continue
+        for source, field in sources:
+            if source is type(instance):
+                value = getattr(instance, field)
+                transaction.on_commit(lambda built=built, field=field, value=value: change(built, field, value))
+
+
+def row_saved(instance, created, previous):
+    """
+    Count a new row's values; move an edited row's count from the values it
+    was loaded with (``previous``) to its new ones. A value missing from
+    ``previous`` is only made suggestible, as its old count is unknown.
+    """
+    previous = dict(previous)
+
+    def change(built, field, value):
+        if created:
+            built.add(value)
+        elif field not in previous:
+            built.include(value)
+        elif previous[field] != value:
+            built.add(previous[field], -1)
+            built.add(value)
+    _apply(instance, change)
+
+
+def row_deleted(instance):
+    loaded = getattr(instance, '_loaded_values', {})
+    _apply(instance, lambda built, field, value: built.add(loaded.get(field, value), -1))
@@ -0,0 +1,160 @@
+"""
+Equipment availability.
+
+A unit is busy over the date span of every booking in a blocking status.
+``reserve()`` never lets two blocking bookings for the same unit overlap, so
+sorted by start date they are also sorted by end date: the only booking that
+can collide with ``[start, end]`` is the one with the latest start on or
+before ``end``. That is a single index seek on
+(equipment, status, requested_start_date), both in SQL and in the in-memory
+``AvailabilityCalendar``.
+"""
+import bisect
+from datetime import timedelta
+
+from .models import Equipment, RentalBooking
+
+BLOCKING_STATUSES = (RentalBooking.Status.CONFIRMED, RentalBooking.Status.IN_PROGRESS)
+# Stay well below SQLite's bound-parameter limit on large id lists.
+ID_BATCH_SIZE = 500
+
+
+class BookingConflict(Exception):
+    """The requested dates collide with an existing reservation."""
+
+
+def _check_span(start, end):
+    if end < start:
+        raise ValueError(f"End date {end} is before start date {start}")
+
+
+def _batches(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), ID_BATCH_SIZE):
+        yield ids[i:i + ID_BATCH_SIZE]
+
+
+class AvailabilityCalendar:
+    """Sorted, non-overlapping busy intervals (inclusive dates) for one unit."""
+
+    def __init__(self, intervals=()):
+        self._starts = []
+        self._ends = []
+        for start, end in sorted(intervals):
+            self.add(start, end)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        return zip(self._starts, self._ends)
+
+    def is_free(self, start, end):
+        _check_span(start, end)
+        i = bisect.bisect_right(self._starts, end) - 1
+        return i < 0 or self._ends[i] < start
+
+    def add(self, start, end):
+        """Mark ``[start, end]`` busy, merging with touching or overlapping intervals."""
+        _check_span(start, end)
+        lo = bisect.bisect_left(self._ends, start - timedelta(days=1))
+        hi = bisect.bisect_right(self._starts, end + timedelta(days=1))
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+        self._starts[lo:hi] = [start]
+        self._ends[lo:hi] = [end]
+
+    def free_windows(self, start, end):
+        """Yield the free ``(start, end)`` spans inside ``[start, end]``."""
+        _check_span(start, end)
+        day = timedelta(days=1)
+        cursor = start
+        i = max(0, bisect.bisect_right(self._starts, start) - 1)
+        for busy_start, busy_end in zip(self._starts[i:], self._ends[i:]):
+            if busy_start > end:
+                break
+            if busy_start > cursor:
+                yield cursor, busy_start - day
+            cursor = max(cursor, busy_end + day)
+        if cursor <= end:
+            yield cursor, end
+
+
+def blocking_bookings(equipment_ids, start, end):
+    """Blocking bookings for the given units that overlap ``[start, end]``."""
+    _check_span(start, end)
+    return RentalBooking.objects.filter(
+        equipment_id__in=equipment_ids,
+        status__in=BLOCKING_STATUSES,
+        requested_start_date__lte=end,
+        requested_end_date__gte=start,
+    )
+
+
+def is_available(equipment_id, start, end, exclude_booking=None):
+    """True if the unit has no blocking booking overlapping ``[start, end]``."""
+    _check_span(start, end)
+    bookings = RentalBooking.objects.filter(
+        equipment_id=equipment_id,
+        status__in=BLOCKING_STATUSES,
+        requested_start_date__lte=end,
+    )
+    if exclude_booking is not None:
+        bookings = bookings.exclude(pk=exclude_booking)
+    latest = bookings.order_by('-requested_start_date').values_list('requested_end_date', flat=True).first()
+    return latest is None or latest < start
+
+
+def find_available(equipment_ids, start, end):
+    """The subset of ``equipment_ids`` free for the whole span, in input order."""
+    equipment_ids = list(equipment_ids)
+    busy = set()
+    for batch in _batches(equipment_ids):
+        busy.update(blocking_bookings(batch, start, end).values_list('equipment_id', flat=True).distinct())
+    return [pk for pk in equipment_ids if pk not in busy]
+
+
+def load_calendars(equipment_ids, start, end):
+    """``{equipment_id: AvailabilityCalendar}`` of busy spans touching ``[start, end]``."""
+    calendars = {pk: AvailabilityCalendar() for pk in equipment_ids}
+    for batch in _batches(calendars):
+        rows = blocking_bookings(batch, start, end).values_list(
+            'equipment_id', 'requested_start_date', 'requested_end_date')
+        for equipment_id, busy_start, busy_end in rows:
+            calendars[equipment_id].add(busy_start, busy_end)
+    return calendars
+
+
+def claim(booking):
+    """
+    Lock the booking's unit for the rest of the transaction and raise
+    ``BookingConflict`` if another blocking booking holds any of its days.
+    Only the equipment row is locked, so bookings for different units
+    proceed in parallel. SQLite has no row locks and ignores
+    ``select_for_update()``; there the whole database is write-locked by
+    the BEGIN IMMEDIATE that ``SQLITE_PRODUCTION_OPTIONS`` starts every
+    transaction with, which serialises claims just as well.
+    """
+    list(Equipment.objects.select_for_update().filter(pk=booking.equipment_id).values_list('pk'))
+    if not is_available(booking.equipment_id, booking.requested_start_date,
+                        booking.requested_end_date, exclude_booking=booking.pk):
+        raise BookingConflict(
+            f"Equipment #{booking.equipment_id} is already booked between "
+            f"{booking.requested_start_date} and {booking.requested_end_date}")
+
+
+def reserve(booking, by=None):
+    """
+    Confirm a pending booking, raising ``BookingConflict`` if its unit is
+    already taken for any of the requested days or the booking is no longer
+    pending.
+    """
+    # Imported here: transitions builds on this module.
+    from . import transitions
+    if booking.status != RentalBooking.Status.PENDING:
+        raise BookingConflict(f"Booking #{booking.pk} is no longer pending")
+    try:
+        return transitions.transition(booking, RentalBooking.Status.CONFIRMED, by=by)
+    except transitions.TransitionError as exc:
+        raise BookingConflict(str(exc)) from exc
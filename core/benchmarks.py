@@ -0,0 +1,161 @@
+"""
+Benchmark suite for the marketplace's hot paths.
+
+Benchmarks register themselves with ``@benchmark``. Each receives a
+``BenchmarkContext`` of ids sampled once from the current database (fill it
+with ``generate_marketplace_data`` first) and runs inside a transaction that
+is rolled back afterwards, so repeated runs see the same dataset. The
+``run_benchmarks`` command times them, appends the results to
+``BENCHMARK_RESULTS_FILE`` and compares them with the previous run.
+"""
+import io
+import random
+import statistics
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import autocomplete, availability, facets, fulltext, occupancy, payments, payouts, pricing
+from .models import Equipment, EquipmentCategory, FarmerProfile, Payment, RentalBooking
+from .search import search_available_equipment
+
+BENCHMARKS = {}
+SAMPLE_SIZE = 2000
+FULLTEXT_QUERIES = ['tractor', 'john deere tractor', '3-row planter kubota', '5-ton trailer', 'disc plough', 'mahi']
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+@dataclass
+class BenchmarkContext:
+    rng: random.Random
+    today: object
+    equipment_ids: list = field(default_factory=list)
+    farmer_ids: list = field(default_factory=list)
+    category_ids: list = field(default_factory=list)
+    counties: list = field(default_factory=list)
+
+    @classmethod
+    def sample(cls, seed=0):
+        ctx = cls(rng=random.Random(seed), today=timezone.localdate())
+        ctx.equipment_ids = list(Equipment.objects.order_by('?').values_list('pk', flat=True)[:SAMPLE_SIZE])
+        ctx.farmer_ids = list(FarmerProfile.objects.order_by('?').values_list('pk', flat=True)[:SAMPLE_SIZE])
+        ctx.category_ids = list(EquipmentCategory.objects.values_list('pk', flat=True))
+        ctx.counties = list(Equipment.objects.order_by().values_list('current_county', flat=True).distinct())
+        return ctx
+
+    def window(self, max_days=5):
+        start = self.today + timedelta(days=self.rng.randrange(1, 120))
+        return start, start + timedelta(days=self.rng.randrange(0, max_days))
+
+
+def run(name, ctx, repeat=20):
+    """Time ``repeat`` rolled-back calls of one benchmark."""
+    func = BENCHMARKS[name]
+    timings, queries = [], []
+    for _ in range(repeat):
+        with transaction.atomic(), CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            func(ctx)
+            timings.append((time.perf_counter() - start) * 1000)
+            transaction.set_rollback(True)
+        queries.append(len(captured))
+    timings.sort()
+    return {
+        'repeat': repeat,
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'max_ms': round(timings[-1], 3),
+        'queries': max(queries),
+    }
+
+
+@benchmark('search')
+def search(ctx):
+    start, end = ctx.window()
+    search_available_equipment(start, end, category=ctx.rng.choice(ctx.category_ids),
+                               county=ctx.rng.choice(ctx.counties), acres=Decimal('3.5'))
+
+
+@benchmark('fulltext')
+def fulltext_search(ctx):
+    fulltext.search(ctx.rng.choice(FULLTEXT_QUERIES), county=ctx.rng.choice(ctx.counties))
+
+
+@benchmark('autocomplete')
+def autocomplete_prefix(ctx):
+    county = ctx.rng.choice(ctx.counties)
+    autocomplete.suggest('county', county[:ctx.rng.randrange(1, len(county) + 1)])
+    autocomplete.suggest('crop', ctx.rng.choice('bcmprsw'))
+
+
+@benchmark('facets')
+def facet_counts(ctx):
+    facets.counts({'county': {ctx.rng.choice(ctx.counties)}, 'category': {ctx.rng.choice(ctx.category_ids)}})
+
+
+@benchmark('availability')
+def find_available(ctx):
+    availability.find_available(ctx.equipment_ids, *ctx.window())
+
+
+@benchmark('occupancy_free_run')
+def occupancy_free_run(ctx):
+    start, _ = ctx.window()
+    end = min(start + timedelta(days=30), start.replace(month=12, day=31))
+    bitmaps = occupancy.load(ctx.equipment_ids, start.year)
+    occupancy.units_with_free_run(bitmaps, start, end, 3)
+
+
+@benchmark('quote_page')
+def quote_page(ctx):
+    page = list(Equipment.objects.filter(pk__in=ctx.rng.sample(ctx.equipment_ids, 20)))
+    pricing.quote_many(page, ctx.rng.choice(ctx.counties), *ctx.window(), acres=Decimal('2'))
+
+
+@benchmark('booking_creation')
+def booking_creation(ctx):
+    equipment = Equipment.objects.get(pk=ctx.rng.choice(ctx.equipment_ids))
+    farmer = FarmerProfile.objects.get(pk=ctx.rng.choice(ctx.farmer_ids))
+    start, end = ctx.window()
+    booking = RentalBooking(
+        farmer=farmer, equipment=equipment, operator_id=equipment.owner_id, job_description="Benchmark job",
+        land_size_acres=Decimal('4'), farm_location_county=farmer.county,
+        requested_start_date=start, requested_end_date=end, quoted_rate=0,
+    )
+    pricing.apply_quote(booking)
+    booking.save()
+    try:
+        availability.reserve(booking)
+    except availability.BookingConflict:
+        pass
+
+
+@benchmark('payment_confirmation')
+def payment_confirmation(ctx):
+    """A 200-callback burst, a third of it gateway retries."""
+    bookings = list(RentalBooking.objects.exclude(payment_status=RentalBooking.PaymentStatus.FULLY_PAID)
+                    .values_list('pk', 'total_amount')[:200])
+    callbacks = [
+        {'transaction_id': f"BENCH{ctx.rng.getrandbits(48):X}", 'booking': pk, 'amount': total,
+         'method': Payment.Method.MPESA, 'payment_type': Payment.Type.FINAL, 'paid_at': None}
+        for pk, total in bookings
+    ]
+    payments.apply_callbacks(callbacks + ctx.rng.sample(callbacks, len(callbacks) // 3))
+
+
+@benchmark('payout_batch')
+def payout_batch(ctx):
+    payouts.create_payouts('PO-BENCH', batch_size=500)
+    payouts.settle('PO-BENCH', io.StringIO())
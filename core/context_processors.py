@@ -0,0 +1,9 @@
+from . import unread
+
+
+def unread_notifications(request):
+    """``unread_notifications`` for the header badge, looked up only if a template uses it."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'unread_notifications': lambda: unread.count(user.pk)}
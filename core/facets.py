@@ -0,0 +1,176 @@
+"""
+Facet counts for the equipment browse page.
+
+Every facet — category, fuel type, county, horsepower band and what the
+price includes — is counted from one ``GROUP BY`` over all six columns.
+That "cube" has a row per combination that occurs, a few thousand at most,
+and each facet's counts are rolled up from it in Python. The counts are
+disjunctive, as shoppers expect: a facet is counted with every other
+selection applied but not its own, so picking "Diesel" still shows how
+many petrol units there are.
+
+Cubes are cached per status filter under a version that is moved whenever
+a saved or deleted unit changed one of the faceted columns or its status;
+code that changes those with ``queryset.update()`` calls ``invalidate()``.
+The version lives in the shared cache (see ``CACHES``), so a write in one
+worker retires the cubes every worker serves.
+"""
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, CharField, Count, Q, Value, When
+
+from .models import Equipment, EquipmentCategory
+
+CUBE_TIMEOUT = 10 * 60
+VERSION_KEY = 'facets-version'
+
+# (value, label, lowest horsepower, highest horsepower); '' counts units without a rating.
+HORSEPOWER_BANDS = [
+    ('under-35', 'Under 35 hp', None, Decimal('35')),
+    ('35-75', '35–75 hp', Decimal('35'), Decimal('75')),
+    ('75-120', '75–120 hp', Decimal('75'), Decimal('120')),
+    ('120-plus', '120 hp and over', Decimal('120'), None),
+]
+
+
+def _band_condition(low, high):
+    condition = Q(horsepower__isnull=False)
+    if low is not None:
+        condition &= Q(horsepower__gte=low)
+    if high is not None:
+        condition &= Q(horsepower__lt=high)
+    return condition
+
+
+HORSEPOWER = Case(
+    *[When(_band_condition(low, high), then=Value(band)) for band, _, low, high in HORSEPOWER_BANDS],
+    default=Value(''), output_field=CharField(),
+)
+
+FACETS = {
+    'category': 'category_id',
+    'fuel_type': 'fuel_type',
+    'county': 'current_county',
+    'horsepower': 'horsepower_band',
+    'operator_included': 'price_includes_operator',
+    'fuel_included': 'price_includes_fuel',
+}
+TRACKED_FIELDS = ('status', 'category_id', 'fuel_type', 'current_county', 'horsepower',
+                  'price_includes_operator', 'price_includes_fuel')
+
+_BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+
+def parse_selection(params):
+    """``{facet: set of values}`` from query parameters such as ``?fuel_type=diesel&county=Nakuru``."""
+    selected = {}
+    for facet in FACETS:
+        values = params.getlist(facet) if hasattr(params, 'getlist') else params.get(facet, [])
+        if not values:
+            continue
+        if facet == 'category':
+            values = {int(value) for value in values}
+        elif facet in ('operator_included', 'fuel_included'):
+            try:
+                values = {_BOOLEANS[value.lower()] for value in values}
+            except KeyError as exc:
+                raise ValueError(f"{facet} must be true or false, not {exc.args[0]!r}") from None
+        elif facet == 'horsepower':
+            bands = {band for band, _, _, _ in HORSEPOWER_BANDS} | {''}
+            if not bands.issuperset(values):
+                raise ValueError(f"Unknown horsepower band; expected one of {sorted(bands)}")
+        selected[facet] = set(values)
+    return selected
+
+
+def filter_queryset(queryset, selected):
+    """``queryset`` narrowed to the selection, values of one facet OR-ed together."""
+    for facet, values in selected.items():
+        if facet != 'horsepower':
+            queryset = queryset.filter(**{f'{FACETS[facet]}__in': values})
+            continue
+        condition = Q(pk__in=[])
+        for band, _, low, high in HORSEPOWER_BANDS:
+            if band in values:
+                condition |= _band_condition(low, high)
+        if '' in values:
+            condition |= Q(horsepower__isnull=True)
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        cache.add(VERSION_KEY, version, None)
+        version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def invalidate():
+    """Retire every cached cube once the current transaction commits."""
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, time.time_ns(), None))
+
+
+def cube(status=Equipment.Status.AVAILABLE):
+    """``[(facet values, unit count)]`` for every combination of facet values present."""
+    key = f'facets:{status or "any"}:{_version()}'
+    cells = cache.get(key)
+    if cells is None:
+        equipment = Equipment.objects.order_by()
+        if status:
+            equipment = equipment.filter(status=status)
+        cells = [
+            (row[:-1], row[-1])
+            for row in equipment.annotate(horsepower_band=HORSEPOWER)
+                                .values_list(*FACETS.values()).annotate(units=Count('pk'))
+        ]
+        cache.set(key, cells, CUBE_TIMEOUT)
+    return cells
+
+
+def counts(selected=None, status=Equipment.Status.AVAILABLE):
+    """
+    ``(total, {facet: {value: count}})`` for the units matching ``selected``.
+    Each facet's counts ignore that facet's own selection.
+    """
+    selected = selected or {}
+    names = list(FACETS)
+    wanted = [selected.get(name) for name in names]
+    total = 0
+    facets = {name: {} for name in names}
+    for values, units in cube(status):
+        misses = [i for i, value in enumerate(values) if wanted[i] is not None and value not in wanted[i]]
+        if len(misses) > 1:
+            continue
+        if misses:
+            facet = facets[names[misses[0]]]
+            facet[values[misses[0]]] = facet.get(values[misses[0]], 0) + units
+            continue
+        total += units
+        for name, value in zip(names, values):
+            facets[name][value] = facets[name].get(value, 0) + units
+    return total, facets
+
+
+def labels():
+    """Display names for facet values that are ids or codes."""
+    return {
+        'category': dict(EquipmentCategory.objects.values_list('pk', 'name')),
+        'fuel_type': dict(Equipment.FuelType.choices),
+        'horsepower': {band: label for band, label, _, _ in HORSEPOWER_BANDS} | {'': 'Not stated'},
+    }
+
+
+def equipment_saved(instance, created, previous):
+    if created or any(field not in previous or previous[field] != getattr(instance, field)
+                      for field in TRACKED_FIELDS):
+        invalidate()
+
+
+def equipment_deleted(instance):
+    invalidate()
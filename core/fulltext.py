@@ -0,0 +1,124 @@
+"""
+Full-text equipment search.
+
+On SQLite the ``core_equipment_fts`` FTS5 table (migration 0003) indexes
+``name``, ``brand``, ``model``, ``description`` and ``capacity_info``, and
+matches are ranked with BM25, weighting name and brand above the long
+description. "3-row planter Kubota" becomes ``"3" "row" "planter" "kubota"*``:
+every word must match, the last as a prefix so results follow the farmer's
+typing. Elsewhere the same words are matched with ``icontains`` and results
+come newest first.
+"""
+import functools
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+
+from .models import Equipment
+
+FTS_TABLE = 'core_equipment_fts'
+COLUMNS = ('name', 'brand', 'model', 'description', 'capacity_info')
+# BM25 column weights, in COLUMNS order.
+WEIGHTS = (10.0, 6.0, 6.0, 1.0, 3.0)
+
+_WORD = re.compile(r'\w+')
+# (alias, database name) pairs known to have the FTS table. A miss is not
+# remembered, so the index is picked up as soon as its migration runs.
+_indexed = set()
+
+
+def terms(text):
+    return [word.lower() for word in _WORD.findall(text or '')][:16]
+
+
+def match_expression(words):
+    """FTS5 query for ``words``: all required, the last one as a prefix."""
+    quoted = [f'"{word}"' for word in words]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _has_index(alias, name):
+    if (alias, name) in _indexed:
+        return True
+    with connections[alias].cursor() as cursor:
+        found = FTS_TABLE in connections[alias].introspection.table_names(cursor)
+    if found:
+        _indexed.add((alias, name))
+    return found
+
+
+def index_available(alias):
+    connection = connections[alias]
+    return connection.vendor == 'sqlite' and _has_index(alias, str(connection.settings_dict['NAME']))
+
+
+def search(text, category=None, status=Equipment.Status.AVAILABLE, county=None, limit=20, offset=0):
+    """
+    One page of equipment matching ``text``, best first, each with a
+    ``search_rank`` (lower is better; ``None`` without the FTS index).
+    ``county`` keeps units located in it or whose owner serves it.
+    """
+    words = terms(text)
+    if not words:
+        return []
+    alias = router.db_for_read(Equipment)
+    if not index_available(alias):
+        return _search_icontains(alias, words, category, status, county, limit, offset)
+
+    conditions, params = [f'{FTS_TABLE} MATCH %s'], [match_expression(words)]
+    if category is not None:
+        conditions.append('e.category_id = %s')
+        params.append(getattr(category, 'pk', category))
+    if status:
+        conditions.append('e.status = %s')
+        params.append(status)
+    if county:
+        conditions.append('(e.current_county = %s OR EXISTS (SELECT 1 FROM core_servicearea s '
+                          'WHERE s.operator_id = e.owner_id AND s.county = %s))')
+        params += [county, county]
+    sql = (
+        f"SELECT e.id, bm25({FTS_TABLE}, {', '.join(map(str, WEIGHTS))}) AS rank "
+        f"FROM {FTS_TABLE} JOIN core_equipment e ON e.id = {FTS_TABLE}.rowid "
+        f"WHERE {' AND '.join(conditions)} ORDER BY rank, e.id LIMIT %s OFFSET %s"
+    )
+    with connections[alias].cursor() as cursor:
+        cursor.execute(sql, params + [limit, offset])
+        ranked = cursor.fetchall()
+    units = Equipment.objects.using(alias).select_related('category', 'owner__user').in_bulk(
+        [pk for pk, _ in ranked])
+    results = []
+    for pk, rank in ranked:
+        if pk in units:
+            units[pk].search_rank = rank
+            results.append(units[pk])
+    return results
+
+
+def _search_icontains(alias, words, category, status, county, limit, offset):
+    equipment = Equipment.objects.using(alias).select_related('category', 'owner__user')
+    for word in words:
+        equipment = equipment.filter(functools.reduce(
+            Q.__or__, (Q(**{f'{column}__icontains': word}) for column in COLUMNS)))
+    if category is not None:
+        equipment = equipment.filter(category=category)
+    if status:
+        equipment = equipment.filter(status=status)
+    if county:
+        equipment = equipment.filter(Q(current_county=county) | Q(owner__service_areas__county=county)).distinct()
+    results = list(equipment[offset:offset + limit])
+    for unit in results:
+        unit.search_rank = None
+    return results
+
+
+def rebuild(alias='default', optimize=False):
+    """Re-index every unit from ``core_equipment`` (and optionally merge index segments)."""
+    if not index_available(alias):
+        return False
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        if optimize:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    return True
@@ -0,0 +1,153 @@
+"""
+Geohash grid index and proximity queries.
+
+PostGIS is not available on the SQLite backend, so listings carry a geohash
+cell that is maintained on save. Radius queries are answered in two steps:
+an indexed SQL prefilter (geohash prefix ranges covering the search box plus
+a lat/lon bounding box), then exact haversine ranking of the few candidates.
+"""
+import math
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import Q
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9          # ~5m cells, plenty for a farm gate
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+MAX_COVERING_CELLS = 9
+# Sorts after every base32 character, so [prefix, prefix + END) is a prefix range.
+_PREFIX_END = '~'
+
+
+def encode(lat, lon, precision=GEOHASH_PRECISION):
+    """Geohash of a point, interleaving lon/lat bits starting with longitude."""
+    lat, lon = float(lat), float(lon)
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bit = value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                value = (value << 1) | 1
+                lon_lo = mid
+            else:
+                value <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_lo = mid
+            else:
+                value <<= 1
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(BASE32[value])
+            bit = value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(lat_degrees, lon_degrees) spanned by one cell at ``precision``."""
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lon, radius_km):
+    """(min_lat, min_lon, max_lat, max_lon) enclosing the radius around a point."""
+    lat, lon = float(lat), float(lon)
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(lat))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, radius_km / (KM_PER_DEGREE_LAT * cos_lat))
+    return (max(-90.0, lat - dlat), max(-180.0, lon - dlon),
+            min(90.0, lat + dlat), min(180.0, lon + dlon))
+
+
+def covering_cells(min_lat, min_lon, max_lat, max_lon, max_cells=MAX_COVERING_CELLS):
+    """
+    Geohash prefixes at the finest precision whose cells cover the box using
+    at most ``max_cells`` cells.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_h, lon_w = cell_size(precision)
+        row0 = int((min_lat + 90.0) // lat_h)
+        row1 = int(min((max_lat + 90.0) // lat_h, 180.0 / lat_h - 1))
+        col0 = int((min_lon + 180.0) // lon_w)
+        col1 = int(min((max_lon + 180.0) // lon_w, 360.0 / lon_w - 1))
+        if (row1 - row0 + 1) * (col1 - col0 + 1) > max_cells:
+            continue
+        return sorted({
+            encode(-90.0 + (row + 0.5) * lat_h, -180.0 + (col + 0.5) * lon_w, precision)
+            for row in range(row0, row1 + 1)
+            for col in range(col0, col1 + 1)
+        })
+    return ['']
+
+
+def radius_filter(lat, lon, radius_km):
+    """Index-friendly Q selecting every row that may lie within the radius."""
+    min_lat, min_lon, max_lat, max_lon = bounding_box(lat, lon, radius_km)
+    cells = Q()
+    for prefix in covering_cells(min_lat, min_lon, max_lat, max_lon):
+        if prefix:
+            cells |= Q(geohash__gte=prefix, geohash__lt=prefix + _PREFIX_END)
+    return cells & Q(
+        gps_latitude__gte=_coord(min_lat), gps_latitude__lte=_coord(max_lat),
+        gps_longitude__gte=_coord(min_lon), gps_longitude__lte=_coord(max_lon),
+    )
+
+
+def _coord(value):
+    return Decimal(str(round(value, 6)))
+
+
+class GeoQuerySet(models.QuerySet):
+    """QuerySet for models carrying ``gps_latitude``/``gps_longitude``/``geohash``."""
+
+    def within_radius(self, lat, lon, radius_km):
+        """Rows that may be within ``radius_km``; a cheap SQL prefilter, not exact."""
+        return self.filter(radius_filter(lat, lon, radius_km))
+
+    def nearest(self, lat, lon, radius_km, limit=None):
+        """
+        Rows within ``radius_km`` ranked by exact distance, each annotated with
+        ``distance_km``. Returns a list.
+        """
+        results = []
+        for obj in self.within_radius(lat, lon, radius_km):
+            obj.distance_km = haversine_km(lat, lon, obj.gps_latitude, obj.gps_longitude)
+            if obj.distance_km <= radius_km:
+                results.append(obj)
+        results.sort(key=lambda obj: (obj.distance_km, obj.pk))
+        return results[:limit] if limit is not None else results
+
+
+class GeohashMixin:
+    """Keeps ``geohash`` in step with ``gps_latitude``/``gps_longitude`` on save."""
+
+    def save(self, *args, **kwargs):
+        if self.gps_latitude is not None and self.gps_longitude is not None:
+            self.geohash = encode(self.gps_latitude, self.gps_longitude)
+        else:
+            self.geohash = ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'gps_latitude', 'gps_longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
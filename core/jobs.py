@@ -0,0 +1,275 @@
+"""
+Job hours and worked area derived from a booking's GPS track.
+
+``TrackAnalyzer`` reads fixes once, in time order, and keeps only what it
+needs to carry on: the first and last fix, the stop detector's anchor and
+the fixes it has not placed yet, and the set of grid cells swept. It splits
+the track into
+
+* engine time: every interval between fixes up to ``tracks.MAX_GAP_SECONDS``
+  apart, the same as ``Track.working_hours()``;
+* moving time: intervals spent travelling. A unit that stays within
+  ``STOP_RADIUS_METRES`` of where it was for longer than ``STOP_SECONDS``
+  is idling (GPS jitter alone moves a parked tractor a few metres); one
+  that leaves sooner was moving all along, however slowly;
+* worked area: ``CELL_METRES`` squares crossed while moving, to set beside
+  the farmer's ``land_size_acres``.
+
+Its state round-trips through ``TrackAnalysis.state``, so the telemetry
+ingestor feeds each flush to ``LiveAnalyses`` and saves every booking's
+progress now and then instead of rereading the track, and
+``analyze_tracks`` replays whole tracks of finished jobs through the same
+code. Saving writes the booking's ``actual_hours``, ``actual_start_date``
+and ``actual_end_date``.
+"""
+import math
+import struct
+import time
+from array import array
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import tracks
+from .models import RentalBooking, TrackAnalysis
+
+CELL_METRES = 10
+STOP_RADIUS_METRES = 15
+STOP_SECONDS = 2 * 60
+METRES_PER_E6 = 0.11132
+SQUARE_METRES_PER_ACRE = 4046.8564224
+MAX_HOURS = Decimal('9999.99')
+# First, last and anchor fixes, stopped flag, pending and cell counts.
+STATE = struct.Struct('<qiiqiiqii?xxxII')
+
+
+def _column(typecode, values):
+    column = array(typecode, values)
+    if not tracks.NATIVE_LITTLE_ENDIAN:
+        column.byteswap()
+    return column
+
+
+def _read_column(typecode, data, offset, count):
+    column = array(typecode)
+    column.frombytes(data[offset:offset + count * column.itemsize])
+    if not tracks.NATIVE_LITTLE_ENDIAN:
+        column.byteswap()
+    return column, offset + count * column.itemsize
+
+
+class TrackAnalyzer:
+    """Engine hours, moving hours, distance and worked area of a track fed in time order."""
+
+    def __init__(self):
+        self.first = self.last = self.anchor = None
+        self.stopped = False
+        self.pending = []
+        self.cells = set()
+        self.fix_count = self.late_fixes = 0
+        self.moving_ms = self.idle_ms = 0
+        self.distance_m = 0.0
+        self._grid = None
+        self._lon_scale = 1.0
+
+    def feed(self, points):
+        """Take ``(t_ms, lat_e6, lon_e6)`` fixes; any not after the last one fed is counted late and ignored."""
+        for point in points:
+            if self.last is not None and point[0] <= self.last[0]:
+                self.late_fixes += 1
+                continue
+            self.fix_count += 1
+            if self.first is None:
+                self._start(point)
+            else:
+                self._step(point)
+            self.last = point
+        return self
+
+    def _start(self, point):
+        self.first = self.anchor = point
+        self._grid = tracks.Grid(point[1], CELL_METRES)
+        self._lon_scale = math.cos(math.radians(point[1] / 1e6))
+
+    def _metres(self, a, b):
+        return math.hypot(b[1] - a[1], (b[2] - a[2]) * self._lon_scale) * METRES_PER_E6
+
+    def _moved(self, path):
+        self.moving_ms += path[-1][0] - path[0][0]
+        self.cells.add(self._grid.cell(path[0]))
+        for a, b in zip(path, path[1:]):
+            self.distance_m += self._metres(a, b)
+            self.cells.update(self._grid.crossed(a, b))
+
+    def _step(self, point):
+        last = self.last
+        if point[0] - last[0] > tracks.MAX_GAP_SECONDS * 1000:
+            # Switched off or out of signal: the gap is not worked, and a
+            # wait too short to call a stop is idling all the same.
+            if self.pending:
+                self.idle_ms += self.pending[-1][0] - self.anchor[0]
+            self.anchor, self.pending, self.stopped = point, [], False
+            return
+        if self._metres(self.anchor, point) > STOP_RADIUS_METRES:
+            self._moved([last, point] if self.stopped else [self.anchor, *self.pending, point])
+            self.anchor, self.pending, self.stopped = point, [], False
+        elif self.stopped:
+            self.idle_ms += point[0] - last[0]
+        elif point[0] - self.anchor[0] > STOP_SECONDS * 1000:
+            self.idle_ms += point[0] - self.anchor[0]
+            self.pending, self.stopped = [], True
+        else:
+            self.pending.append(point)
+
+    @property
+    def engine_seconds(self):
+        pending = self.pending[-1][0] - self.anchor[0] if self.pending else 0
+        return (self.moving_ms + self.idle_ms + pending) / 1000
+
+    @property
+    def moving_seconds(self):
+        return self.moving_ms / 1000
+
+    @property
+    def worked_acres(self):
+        return len(self.cells) * CELL_METRES * CELL_METRES / SQUARE_METRES_PER_ACRE
+
+    def to_state(self):
+        if self.first is None:
+            return b''
+        cells = sorted(self.cells)
+        return b''.join([
+            STATE.pack(*self.first, *self.last, *self.anchor, self.stopped, len(self.pending), len(cells)),
+            _column('q', [p[0] for p in self.pending]).tobytes(),
+            _column('i', [p[1] for p in self.pending]).tobytes(),
+            _column('i', [p[2] for p in self.pending]).tobytes(),
+            _column('i', [row for row, _ in cells]).tobytes(),
+            _column('i', [col for _, col in cells]).tobytes(),
+        ])
+
+    @classmethod
+    def from_analysis(cls, analysis):
+        """Carry on from a saved ``TrackAnalysis``."""
+        analyzer = cls()
+        data = bytes(analysis.state)
+        if not data:
+            return analyzer
+        *fixes, stopped, pending, cells = STATE.unpack_from(data)
+        analyzer._start(tuple(fixes[0:3]))
+        analyzer.last, analyzer.anchor, analyzer.stopped = tuple(fixes[3:6]), tuple(fixes[6:9]), stopped
+        offset = STATE.size
+        t, offset = _read_column('q', data, offset, pending)
+        lat, offset = _read_column('i', data, offset, pending)
+        lon, offset = _read_column('i', data, offset, pending)
+        rows, offset = _read_column('i', data, offset, cells)
+        cols, offset = _read_column('i', data, offset, cells)
+        analyzer.pending = list(zip(t, lat, lon))
+        analyzer.cells = set(zip(rows, cols))
+        analyzer.fix_count, analyzer.late_fixes = analysis.fix_count, analysis.late_fixes
+        analyzer.moving_ms = round(analysis.moving_seconds * 1000)
+        analyzer.idle_ms = round(analysis.engine_seconds * 1000) - analyzer.moving_ms - (
+            analyzer.pending[-1][0] - analyzer.anchor[0] if analyzer.pending else 0)
+        analyzer.distance_m = analysis.distance_km * 1000
+        return analyzer
+
+    def to_analysis(self, booking_id):
+        return TrackAnalysis(
+            booking_id=booking_id, fix_count=self.fix_count, late_fixes=self.late_fixes,
+            started_at=self.first and tracks.from_ms(self.first[0]),
+            ended_at=self.last and tracks.from_ms(self.last[0]),
+            engine_seconds=self.engine_seconds, moving_seconds=self.moving_seconds,
+            distance_km=self.distance_m / 1000, worked_acres=Decimal(self.worked_acres).quantize(Decimal('0.01')),
+            state=self.to_state(),
+        )
+
+
+def analyze(booking_id):
+    """A ``TrackAnalyzer`` that has read the booking's whole stored track."""
+    return TrackAnalyzer().feed(tracks.load(booking_id))
+
+
+def store(analyzers):
+    """
+    Save ``{booking_id: TrackAnalyzer}`` and copy the hours and dates worked
+    onto the bookings, replacing any entered by hand.
+    """
+    rows = [analyzer.to_analysis(pk) for pk, analyzer in analyzers.items()]
+    bookings = [
+        RentalBooking(pk=pk, actual_hours=min(Decimal(analyzer.engine_seconds / 3600).quantize(Decimal('0.01')),
+                                              MAX_HOURS),
+                      actual_start_date=timezone.localdate(tracks.from_ms(analyzer.first[0])),
+                      actual_end_date=timezone.localdate(tracks.from_ms(analyzer.last[0])))
+        for pk, analyzer in analyzers.items() if analyzer.first is not None
+    ]
+    with transaction.atomic():
+        TrackAnalysis.objects.bulk_create(
+            rows, batch_size=500, update_conflicts=True, unique_fields=['booking'],
+            update_fields=[f.name for f in TrackAnalysis._meta.concrete_fields if not f.primary_key])
+        RentalBooking.objects.bulk_update(bookings, ['actual_hours', 'actual_start_date', 'actual_end_date'],
+                                          batch_size=500)
+
+
+class LiveAnalyses:
+    """
+    The analyzers of bookings whose fixes the telemetry ingestor is
+    writing. Each is loaded once, fed every flush, and saved at most every
+    ``TELEMETRY_ANALYSIS_SECONDS``, when its booking ends, or when its
+    device has been quiet long enough that the next fix starts a new
+    stretch anyway, after which it is let go.
+
+    Two processes can hold analyzers for the same booking, each fed only
+    the fixes it received. Before saving, the stored ``fix_count`` is
+    compared with the one this process last loaded or saved; if another
+    process saved in between, the booking is re-analysed from its whole
+    stored track, which holds both processes' fixes, instead of
+    overwriting theirs.
+    """
+
+    def __init__(self, save_seconds=None):
+        self.save_seconds = save_seconds or getattr(settings, 'TELEMETRY_ANALYSIS_SECONDS', 60)
+        self.analyzers = {}
+        self.saved_at = {}
+        self.fed_at = {}
+        self.stored_counts = {}
+
+    def feed(self, batch):
+        """Take a flush's ``(booking_id, t, latitude_e6, longitude_e6, ...)`` fixes, ``t`` in Unix seconds."""
+        points = defaultdict(list)
+        for booking_id, t, lat, lon, *_ in batch:
+            points[booking_id].append((round(t * 1000), lat, lon))
+        missing = [pk for pk in points if pk not in self.analyzers]
+        if missing:
+            now = time.monotonic()
+            saved = {a.booking_id: a for a in TrackAnalysis.objects.filter(booking__in=missing)}
+            for pk in missing:
+                self.analyzers[pk] = (TrackAnalyzer.from_analysis(saved[pk]) if pk in saved
+                                      else TrackAnalyzer())
+                self.stored_counts[pk] = saved[pk].fix_count if pk in saved else None
+                self.saved_at[pk] = now
+        now = time.monotonic()
+        for pk, fixes in points.items():
+            self.analyzers[pk].feed(sorted(fixes))
+            self.fed_at[pk] = now
+
+    def save(self, ended=(), everything=False):
+        now = time.monotonic()
+        quiet = {pk for pk, at in self.fed_at.items() if now - at > tracks.MAX_GAP_SECONDS}
+        done = quiet | (set(ended) & self.analyzers.keys())
+        due = {pk for pk, at in self.saved_at.items() if everything or now - at >= self.save_seconds} | done
+        if due:
+            with transaction.atomic():
+                stored = dict(TrackAnalysis.objects.select_for_update().filter(booking__in=due)
+                              .values_list('booking_id', 'fix_count'))
+                for pk in due:
+                    if stored.get(pk) != self.stored_counts[pk]:
+                        self.analyzers[pk] = analyze(pk)
+                store({pk: self.analyzers[pk] for pk in due})
+        for pk in due:
+            self.saved_at[pk] = now
+            self.stored_counts[pk] = self.analyzers[pk].fix_count
+        for pk in done:
+            del self.analyzers[pk], self.saved_at[pk], self.fed_at[pk], self.stored_counts[pk]
+        return len(due)
@@ -0,0 +1,238 @@
+"""
+Live booking updates for farmers watching their job.
+
+Publishers — the telemetry ingestor for positions, the booking save hook
+for status changes — call ``broker().publish(channel(booking_id), kind,
+payload)``. Each WebSocket on ``WEBSOCKET_PATH`` holds a ``Subscriber``
+for its booking's channel, and a publish only stores the payload in that
+subscriber's slot for ``kind``, replacing any update not sent yet. A
+client that reads slowly therefore skips straight to the newest position
+instead of working through a backlog, and a subscriber never holds more
+than one update per kind, however busy its channel.
+
+``LocalBroker`` fans out within one process, which is all a single ASGI
+server needs. ``LIVE_BROKER`` selects another ``Broker`` implementation,
+for instance one relaying through Redis pub/sub when several server
+processes share the load; it would deliver into the same ``Subscriber``
+slots.
+"""
+import asyncio
+import functools
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .asgi import session_user
+from .models import RentalBooking
+
+WEBSOCKET_PATH = '/ws/bookings/'
+POSITION = 'position'
+STATUS = 'status'
+
+CLOSE_BAD_REQUEST = 4400
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+
+
+def channel(booking_id):
+    return f'booking:{booking_id}'
+
+
+class Subscriber:
+    """One client's mailbox: the newest unsent update of each kind, not a queue."""
+    __slots__ = ('channel', 'pending', 'coalesced', 'closed', '_waiter')
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.pending = None
+        self.coalesced = 0
+        self.closed = False
+        self._waiter = None
+
+    def offer(self, kind, message):
+        if self.pending is None:
+            self.pending = {}
+        elif kind in self.pending:
+            self.coalesced += 1
+        self.pending[kind] = message
+        self._wake()
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def updates(self):
+        """Wait for ``{kind: message}`` of everything offered since the last call; ``None`` once closed."""
+        while not self.pending and not self.closed:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        if self.closed:
+            return None
+        pending, self.pending = self.pending, None
+        return pending
+
+
+class Broker:
+    """
+    Fan-out of ``(kind, payload)`` updates to the subscribers of a channel,
+    which receive them as ``encode()``-d text.
+    ``subscribe`` and ``unsubscribe`` run on the event loop; ``publish`` may
+    be called from any thread.
+    """
+
+    def subscribe(self, channel):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscriber):
+        raise NotImplementedError
+
+    def publish(self, channel, kind, payload):
+        raise NotImplementedError
+
+
+class LocalBroker(Broker):
+    """Delivers to subscribers in this process."""
+
+    def __init__(self):
+        self.channels = {}
+        self.loop = None
+
+    def subscribe(self, channel):
+        self.loop = asyncio.get_running_loop()
+        subscriber = Subscriber(channel)
+        self.channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscribers = self.channels.get(subscriber.channel)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.channels[subscriber.channel]
+        subscriber.close()
+
+    def publish(self, channel, kind, payload):
+        if channel not in self.channels:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self.deliver(channel, kind, payload)
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.deliver, channel, kind, payload)
+
+    def deliver(self, channel, kind, payload):
+        subscribers = tuple(self.channels.get(channel, ()))
+        if subscribers:
+            # Encoded once however many are watching.
+            message = encode(kind, payload)
+            for subscriber in subscribers:
+                subscriber.offer(kind, message)
+
+
+@functools.cache
+def broker():
+    config = getattr(settings, 'LIVE_BROKER', {'BACKEND': 'core.live.LocalBroker'})
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+def encode(kind, payload):
+    return json.dumps({'type': kind, **payload})
+
+
+def position_payload(t, latitude_e6, longitude_e6, speed_kmh=None, heading=None, accuracy_m=None):
+    return {'lat': latitude_e6 / 1e6, 'lon': longitude_e6 / 1e6, 't': t, 'speed': speed_kmh, 'heading': heading,
+            'accuracy': accuracy_m}
+
+
+def booking_changed(booking, previous):
+    """Tell the booking's watchers about a status change once it commits."""
+    if previous.get('status') == booking.status:
+        return
+    payload = {'status': booking.status, 'label': booking.get_status_display()}
+    transaction.on_commit(lambda: broker().publish(channel(booking.pk), STATUS, payload))
+
+
+def _snapshot(scope, booking_id):
+    """The booking's current state if the connection's user is its farmer or operator, else the close code."""
+    try:
+        user = session_user(scope)
+        if not user.is_authenticated:
+            return CLOSE_UNAUTHORIZED
+        snapshot = (RentalBooking.objects.filter(Q(farmer__user=user) | Q(operator__user=user), pk=booking_id)
+                    .values('status', 'equipment__name', 'equipment__gps_latitude', 'equipment__gps_longitude')
+                    .first())
+        return CLOSE_FORBIDDEN if snapshot is None else snapshot
+    finally:
+        close_old_connections()
+
+
+async def _open(scope, receive, send, hub):
+    """
+    Check the connection and subscribe it, sending the accept and the
+    current state; returns the ``Subscriber``, or ``None`` once closed.
+    Kept apart from the streaming loop so an idle connection holds on to
+    nothing from the handshake.
+    """
+    if (await receive())['type'] != 'websocket.connect':
+        return None
+    try:
+        booking_id = int(parse_qs(scope.get('query_string', b'').decode())['booking'][0])
+    except (KeyError, ValueError):
+        await send({'type': 'websocket.close', 'code': CLOSE_BAD_REQUEST})
+        return None
+    # Subscribe before reading the snapshot so nothing published in between is missed.
+    subscriber = hub.subscribe(channel(booking_id))
+    try:
+        snapshot = await sync_to_async(_snapshot)(scope, booking_id)
+        if not isinstance(snapshot, dict):
+            await send({'type': 'websocket.close', 'code': snapshot})
+            hub.unsubscribe(subscriber)
+            return None
+        await send({'type': 'websocket.accept'})
+        await send({'type': 'websocket.send', 'text': encode('snapshot', {
+            'status': snapshot['status'], 'equipment': snapshot['equipment__name'],
+            'lat': snapshot['equipment__gps_latitude'] and float(snapshot['equipment__gps_latitude']),
+            'lon': snapshot['equipment__gps_longitude'] and float(snapshot['equipment__gps_longitude']),
+        })})
+    except BaseException:
+        hub.unsubscribe(subscriber)
+        raise
+    return subscriber
+
+
+async def booking_socket(scope, receive, send):
+    """ASGI WebSocket endpoint streaming one booking's position and status to its farmer or operator."""
+    hub = broker()
+    subscriber = await _open(scope, receive, send, hub)
+    if subscriber is None:
+        return
+    watcher = asyncio.ensure_future(_until_disconnect(receive, subscriber))
+    try:
+        while (updates := await subscriber.updates()) is not None:
+            for message in updates.values():
+                await send({'type': 'websocket.send', 'text': message})
+    finally:
+        hub.unsubscribe(subscriber)
+        watcher.cancel()
+
+
+async def _until_disconnect(receive, subscriber):
+    # Clients only listen; anything they send is ignored.
+    while (await receive())['type'] != 'websocket.disconnect':
+        pass
+    subscriber.close()
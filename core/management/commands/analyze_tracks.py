@@ -0,0 +1,87 @@
+import multiprocessing
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from core import jobs
+from core.models import RentalBooking, TelemetryFix, TrackChunk
+
+
+def _analyze(booking_id):
+    return booking_id, jobs.analyze(booking_id)
+
+
+def _count(queryset, total):
+    # One row per booking; the default ordering would split the group.
+    return Coalesce(Subquery(queryset.filter(booking=OuterRef('pk')).order_by().values('booking')
+                             .annotate(n=total).values('n'), output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = ("Work out hours, dates and area worked from the GPS tracks of completed bookings, in a pool of "
+            "processes, and fill in their actual_hours, actual_start_date and actual_end_date.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Processes reading tracks; 1 reads them in this process.")
+        parser.add_argument('--booking', type=int, action='append', dest='bookings',
+                            help="Booking to analyse whatever its status; repeatable.")
+        parser.add_argument('--all', action='store_true',
+                            help="Redo bookings whose saved analysis already covers every stored fix.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['bookings']:
+            bookings = RentalBooking.objects.filter(pk__in=options['bookings'])
+        else:
+            stale = (RentalBooking.objects.filter(status=RentalBooking.Status.COMPLETED)
+                     .annotate(stored=_count(TrackChunk.objects, Sum('fix_count'))
+                               + _count(TelemetryFix.objects, Count('*')))
+                     .filter(stored__gt=0).order_by('pk'))
+            if not options['all']:
+                analysed = F('track_analysis__fix_count') + F('track_analysis__late_fixes')
+                stale = stale.exclude(stored=Coalesce(analysed, Value(-1)))
+            bookings = stale
+        acres = dict(bookings.values_list('pk', 'land_size_acres'))
+
+        start = time.perf_counter()
+        done = 0
+        pending = {}
+        ratios = []
+        if options['workers'] > 1:
+            # Children open their own connections; the inherited ones must not be shared.
+            connections.close_all()
+            pool = ProcessPoolExecutor(options['workers'], mp_context=multiprocessing.get_context('fork'))
+            results = pool.map(_analyze, acres, chunksize=max(1, min(64, len(acres) // options['workers'] // 4)))
+        else:
+            pool, results = None, map(_analyze, acres)
+        try:
+            for booking_id, analyzer in results:
+                pending[booking_id] = analyzer
+                if acres[booking_id]:
+                    ratios.append(analyzer.worked_acres / float(acres[booking_id]))
+                if len(pending) >= options['batch_size']:
+                    jobs.store(pending)
+                    done += len(pending)
+                    pending = {}
+            if pending:
+                jobs.store(pending)
+                done += len(pending)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Analysed {done} tracks in {elapsed:.1f}s ({done / elapsed if elapsed else 0:,.0f}/s) "
+            f"with {max(1, options['workers'])} worker(s)"))
+        if ratios:
+            short = sum(ratio < 0.8 for ratio in ratios)
+            self.stdout.write(f"worked area / booked area: median {statistics.median(ratios):.2f}; "
+                              f"{short} jobs covered less than 80% of the booked acres")
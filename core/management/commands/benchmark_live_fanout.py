@@ -0,0 +1,185 @@
+import asyncio
+import gc
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+
+from core import live
+from core.models import RentalBooking
+
+
+class Command(BaseCommand):
+    help = ("Subscribe simulated farmers to live booking updates in-process, measure memory per idle "
+            "subscriber, then publish positions and report delivery, coalescing and latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=5000)
+        parser.add_argument('--bookings', type=int, default=500)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--rate', type=float, default=2.0, help="Positions per booking per second.")
+        parser.add_argument('--slow-fraction', type=float, default=0.1,
+                            help="Share of clients that take a second to read each message.")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        bookings = list(RentalBooking.objects.filter(status=RentalBooking.Status.IN_PROGRESS)
+                        .values_list('pk', 'farmer__user')[:options['bookings']])
+        if not bookings:
+            raise CommandError("No bookings in progress; run generate_marketplace_data first")
+        sessions = {}
+        for _, user_id in bookings:
+            if user_id not in sessions:
+                sessions[user_id] = self.login(user_id)
+        try:
+            report = asyncio.run(self.run(bookings, sessions, random.Random(options['seed']), options))
+        finally:
+            SessionStore().model.objects.filter(session_key__in=sessions.values()).delete()
+
+        self.stdout.write(f"{report['connected']}/{options['subscribers']} subscribers on {len(bookings)} bookings "
+                          f"connected in {report['connect_s']:.2f}s")
+        self.stdout.write(f"memory per idle subscriber: {report['bare_bytes']:.0f} B for the Subscriber, "
+                          f"{report['idle_bytes']:.0f} B for the whole connection")
+        if settings.DEBUG:
+            self.stdout.write(self.style.WARNING("DEBUG is on: connections' logged queries are counted as well"))
+        self.stdout.write(f"{report['published']} positions published in {options['seconds']:.0f}s; "
+                          f"fast clients received {report['fast_received']} "
+                          f"({report['fast_per_client']:.1f} each), slow clients {report['slow_received']} "
+                          f"({report['slow_per_client']:.1f} each); {report['coalesced']} updates coalesced")
+        self.stdout.write(f"publish-to-send latency (fast clients): p50 {report['latency_p50_ms']:.1f} ms, "
+                          f"p99 {report['latency_p99_ms']:.1f} ms")
+        self.stdout.write(self.style.SUCCESS(f"peak pending updates per subscriber: {report['max_pending']}"))
+
+    def login(self, user_id):
+        user = get_user_model().objects.get(pk=user_id)
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    async def run(self, bookings, sessions, rng, options):
+        from config.asgi import application
+
+        hub = live.broker()
+        count = options['subscribers']
+        slow = set(rng.sample(range(count), round(count * options['slow_fraction'])))
+        received = [0] * count
+        latencies = []
+
+        async def client(i, app, ready, inboxes):
+            booking_id, user_id = bookings[i % len(bookings)]
+            inbox = asyncio.Queue()
+            inboxes.append(inbox)
+            accepted = False
+
+            async def send(message):
+                nonlocal accepted
+                if message['type'] == 'websocket.close' and not accepted:
+                    ready.put_nowait(False)
+                elif message['type'] == 'websocket.send':
+                    data = json.loads(message['text'])
+                    if data['type'] == 'snapshot':
+                        accepted = True
+                        ready.put_nowait(True)
+                        return
+                    received[i] += 1
+                    if i in slow:
+                        await asyncio.sleep(1)
+                    else:
+                        latencies.append((time.time() - data['sent']) * 1000)
+
+            scope = {'type': 'websocket', 'path': live.WEBSOCKET_PATH,
+                     'query_string': f'booking={booking_id}'.encode(),
+                     'headers': [(b'cookie', f'{settings.SESSION_COOKIE_NAME}={sessions[user_id]}'.encode())]}
+            await inbox.put({'type': 'websocket.connect'})
+            await app(scope, inbox.get, send)
+
+        async def connect(app):
+            """Open ``count`` connections to ``app``; returns their tasks, inboxes, number accepted and bytes each."""
+            ready, inboxes = asyncio.Queue(), []
+            gc.collect()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tasks = [asyncio.create_task(client(i, app, ready, inboxes)) for i in range(count)]
+            connected = 0
+            for _ in range(count):
+                connected += await ready.get()
+            await asyncio.sleep(0.5)
+            gc.collect()
+            return tasks, inboxes, connected, (tracemalloc.get_traced_memory()[0] - baseline) / max(connected, 1)
+
+        async def disconnect(tasks, inboxes):
+            for inbox in inboxes:
+                inbox.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+            await asyncio.gather(*tasks)
+
+        async def bare_app(scope, receive, send):
+            # What the simulated clients cost on their own, to subtract from the real connections.
+            await receive()
+            await send({'type': 'websocket.accept'})
+            await send({'type': 'websocket.send', 'text': '{"type": "snapshot"}'})
+            await receive()
+
+        tracemalloc.start()
+        gc.collect()
+        before = tracemalloc.get_traced_memory()[0]
+        subscribers = [live.Subscriber(live.channel(i)) for i in range(count)]
+        bare = (tracemalloc.get_traced_memory()[0] - before) / count
+        del subscribers
+        tasks, inboxes, _, harness = await connect(bare_app)
+        await disconnect(tasks, inboxes)
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        tasks, inboxes, connected, _ = await connect(application)
+        connect_s = time.perf_counter() - start
+        await disconnect(tasks, inboxes)
+        # Connect again under tracemalloc, which slows the handshakes down too much to time them.
+        tracemalloc.start()
+        tasks, inboxes, connected, idle = await connect(application)
+        idle -= harness
+        tracemalloc.stop()
+
+        published = 0
+        max_pending = 0
+        deadline = time.monotonic() + options['seconds']
+        interval = 1 / options['rate']
+        while time.monotonic() < deadline:
+            tick = time.monotonic()
+            for booking_id, _ in bookings:
+                hub.publish(live.channel(booking_id), live.POSITION,
+                            {'lat': rng.uniform(-1.5, 0.5), 'lon': rng.uniform(34.5, 38.0), 'sent': time.time()})
+                published += 1
+            await asyncio.sleep(0)
+            for subscribers in hub.channels.values():
+                for subscriber in subscribers:
+                    max_pending = max(max_pending, len(subscriber.pending or ()))
+            await asyncio.sleep(max(0, interval - (time.monotonic() - tick)))
+        coalesced = sum(s.coalesced for subscribers in hub.channels.values() for s in subscribers)
+        await disconnect(tasks, inboxes)
+
+        fast = [received[i] for i in range(count) if i not in slow]
+        slow_counts = [received[i] for i in slow]
+        latencies.sort()
+        return {
+            'connected': connected,
+            'connect_s': connect_s,
+            'bare_bytes': bare,
+            'idle_bytes': idle,
+            'published': published,
+            'fast_received': sum(fast),
+            'fast_per_client': statistics.mean(fast) if fast else 0,
+            'slow_received': sum(slow_counts),
+            'slow_per_client': statistics.mean(slow_counts) if slow_counts else 0,
+            'coalesced': coalesced,
+            'max_pending': max_pending,
+            'latency_p50_ms': latencies[len(latencies) // 2] if latencies else 0,
+            'latency_p99_ms': latencies[int(len(latencies) * 0.99)] if latencies else 0,
+        }
@@ -0,0 +1,96 @@
+import multiprocessing
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+
+from core.benchmarks import BenchmarkContext, booking_creation
+from core.models import Equipment
+
+MODES = ('default', 'production')
+
+
+def _worker(slot, db_path, options, ctx, seconds, results):
+    """One simulated WSGI worker creating and reserving bookings until the deadline."""
+    connections['default'].settings_dict.update(NAME=db_path, OPTIONS=options)
+    ctx.rng = random.Random(slot)
+    stats = {'written': 0, 'locked': 0, 'errors': 0, 'latencies': []}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            booking_creation(ctx)
+        except OperationalError as exc:
+            stats['locked' if 'locked' in str(exc) else 'errors'] += 1
+            continue
+        except Exception:
+            stats['errors'] += 1
+            continue
+        stats['written'] += 1
+        stats['latencies'].append((time.perf_counter() - start) * 1000)
+    connection.close()
+    results.put(stats)
+
+
+class Command(BaseCommand):
+    help = ("Run concurrent booking writers as separate processes against a copy of the database, with "
+            "Django's default SQLite settings and with SQLITE_PRODUCTION_OPTIONS, and report lock failures.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--mode', choices=[*MODES, 'both'], default='both')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("This benchmark only applies to SQLite")
+        if not Equipment.objects.exists():
+            raise CommandError("The database is empty; run generate_marketplace_data first")
+        ctx = BenchmarkContext.sample()
+        modes = list(MODES) if options['mode'] == 'both' else [options['mode']]
+
+        self.stdout.write(f"{'mode':12} {'workers':>7} {'written':>8} {'writes/s':>9} {'locked':>7} "
+                          f"{'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+        with tempfile.TemporaryDirectory() as scratch:
+            for mode in modes:
+                db_path = str(Path(scratch) / f'{mode}.sqlite3')
+                with connection.cursor() as cursor:
+                    cursor.execute('VACUUM INTO %s', [db_path])
+                connections.close_all()
+                if mode == 'default':
+                    # The copy keeps the source's journal mode; the baseline needs the stock one.
+                    with sqlite3.connect(db_path) as baseline:
+                        baseline.execute('PRAGMA journal_mode=DELETE')
+                # "default" is Django's stock connection: rollback journal, deferred transactions, 5s timeout.
+                db_options = settings.SQLITE_PRODUCTION_OPTIONS if mode == 'production' else {}
+                stats = self.run_mode(db_path, db_options, ctx, options)
+                latencies = sorted(stats['latencies']) or [0]
+                self.stdout.write(
+                    f"{mode:12} {options['workers']:7} {stats['written']:8} "
+                    f"{stats['written'] / options['seconds']:9.1f} {stats['locked']:7} {stats['errors']:7} "
+                    f"{statistics.median(latencies):8.1f} {latencies[int(len(latencies) * 0.95)]:8.1f} "
+                    f"{latencies[-1]:8.1f}")
+
+    def run_mode(self, db_path, db_options, ctx, options):
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        processes = [
+            context.Process(target=_worker, args=(slot, db_path, db_options, ctx, options['seconds'], results))
+            for slot in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        combined = {'written': 0, 'locked': 0, 'errors': 0, 'latencies': []}
+        for _ in processes:
+            stats = results.get()
+            for key, value in stats.items():
+                combined[key] += value
+        for process in processes:
+            process.join()
+        return combined
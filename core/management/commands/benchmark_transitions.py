@@ -0,0 +1,216 @@
+import multiprocessing
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.utils import timezone
+
+from core import availability, transitions
+from core.models import Equipment, FarmerProfile, Notification, OperatorProfile, RentalBooking, User
+
+Status = RentalBooking.Status
+MODES = ('naive', 'guarded')
+
+
+def _click(role, seen, rng):
+    """What a farmer or operator looking at a booking in status ``seen`` clicks, if anything."""
+    if role == transitions.FARMER:
+        if seen in (Status.PENDING, Status.CONFIRMED) and rng.random() < 0.3:
+            return Status.CANCELLED_FARMER
+        if seen == Status.COMPLETED and rng.random() < 0.1:
+            return Status.DISPUTED
+        return None
+    return {Status.PENDING: Status.CONFIRMED, Status.CONFIRMED: Status.IN_PROGRESS,
+            Status.IN_PROGRESS: Status.COMPLETED}.get(seen)
+
+
+def _naive(booking, target):
+    """Read-modify-write: check the page's copy of the booking, then save it."""
+    if (booking.status, target) not in transitions.EDGES:
+        raise transitions.InvalidTransition(f"{booking.status} -> {target}")
+    if target == Status.CONFIRMED and not availability.is_available(
+            booking.equipment_id, booking.requested_start_date, booking.requested_end_date,
+            exclude_booking=booking.pk):
+        raise availability.BookingConflict(f"Equipment #{booking.equipment_id} is taken")
+    source, booking.status = booking.status, target
+    booking.save()
+    if Status.IN_PROGRESS in (source, target):
+        equipment = Equipment.objects.get(pk=booking.equipment_id)
+        equipment.status = Equipment.Status.RENTED if target == Status.IN_PROGRESS else Equipment.Status.AVAILABLE
+        equipment.save()
+
+
+def _worker(slot, db_path, options, bookings, users, settings_, results):
+    """One simulated browser tab after another: load a booking, think, click."""
+    connections['default'].settings_dict.update(NAME=db_path, OPTIONS=options)
+    rng = random.Random(slot)
+    stats = {'attempts': 0, 'won': [], 'rejected': 0, 'locked': 0, 'errors': 0, 'latencies': []}
+    deadline = time.monotonic() + settings_['seconds']
+    while time.monotonic() < deadline:
+        pk = rng.choice(bookings)
+        role = rng.choice((transitions.FARMER, transitions.OPERATOR))
+        try:
+            booking = RentalBooking.objects.get(pk=pk)
+        except OperationalError:
+            stats['locked'] += 1
+            continue
+        seen = booking.status
+        target = _click(role, seen, rng)
+        if target is None:
+            continue
+        time.sleep(rng.uniform(0, settings_['think_ms']) / 1000)
+        stats['attempts'] += 1
+        start = time.perf_counter()
+        try:
+            if settings_['mode'] == 'naive':
+                _naive(booking, target)
+            else:
+                transitions.transition(booking, target, by=users[pk][role])
+        except (transitions.TransitionError, availability.BookingConflict):
+            stats['rejected'] += 1
+            continue
+        except OperationalError as exc:
+            stats['locked' if 'locked' in str(exc) else 'errors'] += 1
+            continue
+        except Exception:
+            stats['errors'] += 1
+            continue
+        stats['latencies'].append((time.perf_counter() - start) * 1000)
+        recipients = transitions.MESSAGES[target][0]
+        stats['won'].append((pk, seen, len([r for r in recipients if r != role])))
+    connection.close()
+    results.put(stats)
+
+
+class Command(BaseCommand):
+    help = ("Race simulated farmers and operators confirming, cancelling, starting and completing the same "
+            "bookings from separate processes, with read-modify-write saves and with transitions.transition(), "
+            "and check the booking, equipment, job-count and notification invariants afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--units', type=int, default=20)
+        parser.add_argument('--per-unit', type=int, default=3,
+                            help="Pending bookings asking for the same days on each unit.")
+        parser.add_argument('--think-ms', type=float, default=20,
+                            help="Longest pause between loading a booking and clicking.")
+        parser.add_argument('--mode', choices=[*MODES, 'both'], default='both')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("This benchmark only applies to SQLite")
+        if not Equipment.objects.filter(status=Equipment.Status.AVAILABLE).exists():
+            raise CommandError("No available equipment; run generate_marketplace_data first")
+        modes = list(MODES) if options['mode'] == 'both' else [options['mode']]
+        original = dict(connections['default'].settings_dict)
+
+        self.stdout.write(f"{'mode':8} {'clicks':>7} {'won':>6} {'rejected':>8} {'locked':>6} {'p50 ms':>7} "
+                          f"{'double wins':>11} {'overlaps':>8} {'unit status':>11} {'job counts':>10} "
+                          f"{'notifications':>13}")
+        with tempfile.TemporaryDirectory() as scratch:
+            for mode in modes:
+                db_path = str(Path(scratch) / f'{mode}.sqlite3')
+                with connection.cursor() as cursor:
+                    cursor.execute('VACUUM INTO %s', [db_path])
+                connections.close_all()
+                connections['default'].settings_dict.update(NAME=db_path, OPTIONS=settings.SQLITE_PRODUCTION_OPTIONS)
+                try:
+                    bookings, users, jobs_before = self.setup(options)
+                    connections.close_all()
+                    stats = self.run_mode(mode, db_path, bookings, users, options)
+                    checks = self.check(bookings, jobs_before, stats)
+                finally:
+                    connections.close_all()
+                    connections['default'].settings_dict.update(original)
+                latencies = sorted(stats['latencies']) or [0]
+                self.stdout.write(
+                    f"{mode:8} {stats['attempts']:7} {len(stats['won']):6} {stats['rejected']:8} "
+                    f"{stats['locked']:6} {statistics.median(latencies):7.1f} {checks['double_wins']:11} "
+                    f"{checks['overlaps']:8} {checks['unit_status']:11} {checks['job_counts']:10} "
+                    f"{checks['notifications'] if mode == 'guarded' else '-':>13}")
+        self.stdout.write(self.style.SUCCESS(
+            "double wins: bookings where two clicks from the same status both succeeded; overlaps: units "
+            "confirmed to two bookings for the same days; unit status: units whose RENTED flag disagrees with "
+            "their jobs in progress; job counts: operators whose completed-job count is off; notifications: "
+            "queued minus expected"))
+
+    def setup(self, options):
+        """Pending bookings in the copy, ``per_unit`` to a unit asking for the same days."""
+        units = list(Equipment.objects.filter(status=Equipment.Status.AVAILABLE)
+                     .exclude(bookings__status=Status.IN_PROGRESS)
+                     .order_by('?').values_list('pk', 'owner_id')[:options['units']])
+        farmers = list(FarmerProfile.objects.order_by('?').values_list('pk', 'user_id', 'county')[:100])
+        start = timezone.localdate() + timedelta(days=400)
+        rng = random.Random(0)
+        rows = []
+        for i, (equipment_id, operator_id) in enumerate(units):
+            for _ in range(options['per_unit']):
+                farmer_id, _, county = rng.choice(farmers)
+                rows.append(RentalBooking(
+                    farmer_id=farmer_id, equipment_id=equipment_id, operator_id=operator_id,
+                    job_description="Contention benchmark", land_size_acres=Decimal('4'),
+                    farm_location_county=county, requested_start_date=start + timedelta(days=10 * i),
+                    requested_end_date=start + timedelta(days=10 * i + 2), quoted_rate=0))
+        created = RentalBooking.objects.bulk_create(rows)
+        people = User.objects.in_bulk({u for b in created for u in (b.farmer.user_id, b.operator.user_id)})
+        users = {b.pk: {transitions.FARMER: people[b.farmer.user_id],
+                        transitions.OPERATOR: people[b.operator.user_id]} for b in created}
+        jobs_before = dict(OperatorProfile.objects.filter(pk__in=[o for _, o in units])
+                           .values_list('pk', 'total_jobs_completed'))
+        return [b.pk for b in created], users, jobs_before
+
+    def run_mode(self, mode, db_path, bookings, users, options):
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        settings_ = {'mode': mode, 'seconds': options['seconds'], 'think_ms': options['think_ms']}
+        processes = [
+            context.Process(target=_worker, args=(slot, db_path, settings.SQLITE_PRODUCTION_OPTIONS, bookings,
+                                                  users, settings_, results))
+            for slot in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        combined = {'attempts': 0, 'won': [], 'rejected': 0, 'locked': 0, 'errors': 0, 'latencies': []}
+        for _ in processes:
+            for key, value in results.get().items():
+                combined[key] += value
+        for process in processes:
+            process.join()
+        return combined
+
+    def check(self, bookings, jobs_before, stats):
+        rows = list(RentalBooking.objects.filter(pk__in=bookings).values_list(
+            'pk', 'equipment_id', 'operator_id', 'status', 'requested_start_date', 'requested_end_date'))
+
+        # No booking goes through the same status twice here, so two successful clicks from one status
+        # mean two people were both told they had moved it.
+        double_wins = sum(n - 1 for n in Counter((pk, seen) for pk, seen, _ in stats['won']).values())
+        blocking = {}
+        for pk, equipment_id, _, status, start, end in rows:
+            if status in availability.BLOCKING_STATUSES:
+                blocking.setdefault(equipment_id, []).append((start, end))
+        overlaps = sum(
+            1 for spans in blocking.values() for i, a in enumerate(spans) for b in spans[i + 1:]
+            if a[0] <= b[1] and b[0] <= a[1])
+        in_progress = {e for _, e, _, status, _, _ in rows if status == Status.IN_PROGRESS}
+        units = {e for _, e, _, _, _, _ in rows}
+        rented = set(Equipment.objects.filter(pk__in=units, status=Equipment.Status.RENTED).values_list('pk', flat=True))
+        completed = Counter(o for _, _, o, status, _, _ in rows if status == Status.COMPLETED)
+        jobs_after = dict(OperatorProfile.objects.filter(pk__in=jobs_before).values_list('pk', 'total_jobs_completed'))
+        queued = Notification.objects.filter(related_booking__in=bookings).count()
+        return {
+            'double_wins': double_wins,
+            'overlaps': overlaps,
+            'unit_status': len(rented ^ in_progress),
+            'job_counts': sum(jobs_after[o] - jobs_before[o] != completed[o] for o in jobs_before),
+            'notifications': queued - sum(n for *_, n in stats['won']),
+        }
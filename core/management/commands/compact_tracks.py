@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from core import tracks
+from core.models import TelemetryFix, TrackChunk
+
+
+class Command(BaseCommand):
+    help = "Move settled GPS fixes from TelemetryFix rows into compact per-booking TrackChunk blocks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=60, metavar='MINUTES',
+                            help="Only compact fixes recorded at least this long ago.")
+        parser.add_argument('--booking', type=int, action='append', dest='bookings',
+                            help="Booking to compact; repeatable. Defaults to every booking with settled fixes.")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(minutes=options['older_than'])
+        bookings = options['bookings'] or (
+            TelemetryFix.objects.filter(recorded_at__lt=before).order_by()
+            .values_list('booking_id', flat=True).distinct())
+        moved = compacted = 0
+        for booking_id in list(bookings):
+            count = tracks.compact(booking_id, before)
+            moved += count
+            compacted += bool(count)
+        stored = TrackChunk.objects.aggregate(fixes=Sum('fix_count'), size=Sum(Length('data')))
+        self.stdout.write(self.style.SUCCESS(f"Compacted {moved} fixes from {compacted} bookings"))
+        if stored['fixes']:
+            self.stdout.write(f"{stored['fixes']} fixes in track chunks take {stored['size']:,} bytes "
+                              f"({stored['size'] / stored['fixes']:.1f} bytes per fix)")
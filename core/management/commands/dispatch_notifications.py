@@ -0,0 +1,52 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.notifications import Dispatcher
+
+
+class Command(BaseCommand):
+    help = "Deliver queued SMS and push notifications with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help="Seconds an idle worker waits before looking for work again.")
+        parser.add_argument('--once', action='store_true', help="Exit once nothing is due instead of polling.")
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        handled = [0] * options['workers']
+
+        def work(slot):
+            dispatcher = Dispatcher(batch_size=options['batch_size'])
+            try:
+                while not stop.is_set():
+                    count = dispatcher.run_once()
+                    handled[slot] += count
+                    if not count:
+                        if options['once']:
+                            break
+                        stop.wait(options['poll_interval'])
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=work, args=(slot,), name=f'dispatch-{slot}', daemon=True)
+                   for slot in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Handled {sum(handled)} notifications with {len(threads)} workers in {elapsed:.1f}s"))
@@ -0,0 +1,367 @@
+import itertools
+import random
+import secrets
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core import facets, geo, occupancy, payouts, reputation, unread
+from core.models import (
+    BookingReview, Equipment, EquipmentCategory, FarmerProfile, Notification, OperatorPayout, OperatorProfile,
+    Payment, RentalBooking, ServiceArea, User,
+)
+from core.pricing import compute_quote, money
+
+# County name -> approximate centroid (lat, lon).
+COUNTIES = {
+    'Nakuru': (-0.30, 36.08), 'Uasin Gishu': (0.52, 35.27), 'Trans Nzoia': (1.02, 35.00),
+    'Bungoma': (0.56, 34.56), 'Kakamega': (0.28, 34.75), 'Nyandarua': (-0.18, 36.52),
+    'Meru': (0.05, 37.65), 'Embu': (-0.53, 37.45), 'Machakos': (-1.52, 37.26),
+    'Narok': (-1.08, 35.87), 'Kericho': (-0.37, 35.28), 'Bomet': (-0.78, 35.34),
+    'Kisii': (-0.68, 34.77), 'Laikipia': (0.36, 36.78), 'Kitui': (-1.37, 38.01),
+    'Makueni': (-1.80, 37.62), 'Nyeri': (-0.42, 36.95), "Murang'a": (-0.72, 37.15),
+    'Kirinyaga': (-0.50, 37.28), 'Siaya': (0.06, 34.29),
+}
+CROPS = ['Maize', 'Beans', 'Wheat', 'Potatoes', 'Sorghum', 'Rice', 'Sugarcane', 'Barley', 'Millet', 'Cassava']
+# Category -> (daily rate range in KES, horsepower range or None, capacity examples)
+CATEGORIES = {
+    'Tractor': ((3500, 9000), (45, 120), ['2-disc plough', '3-disc plough', 'Rotavator']),
+    'Planter': ((2000, 5000), None, ['2-row planter', '3-row planter', '4-row planter']),
+    'Combine Harvester': ((15000, 40000), (120, 300), ['14 ft header', '18 ft header']),
+    'Boom Sprayer': ((1500, 4000), None, ['400 L tank', '600 L tank']),
+    'Thresher': ((1500, 3500), (10, 25), ['1 ton/hr', '2 ton/hr']),
+    'Trailer': ((1000, 3000), None, ['3-ton capacity', '5-ton capacity']),
+    'Water Pump': ((800, 2000), (5, 15), ['2 inch outlet', '3 inch outlet']),
+}
+BRANDS = ['John Deere', 'Massey Ferguson', 'New Holland', 'Kubota', 'Mahindra', 'TAFE', 'Case IH', 'Swaraj',
+          'Sonalika', 'Same']
+FIRST_NAMES = ['Wanjiku', 'Otieno', 'Kiprono', 'Achieng', 'Mwangi', 'Njeri', 'Cheruiyot', 'Wafula', 'Akinyi',
+               'Kamau', 'Chebet', 'Mutua', 'Nduta', 'Barasa', 'Jepkosgei', 'Omondi', 'Wairimu', 'Kiptoo']
+LAST_NAMES = ['Kariuki', 'Odhiambo', 'Rotich', 'Wanyama', 'Njoroge', 'Mutiso', 'Koech', 'Ouma', 'Kimani',
+              'Langat', 'Muthoni', 'Onyango', 'Kibet', 'Wekesa', 'Maina', 'Ndirangu']
+SYLLABLES = ['ka', 'ri', 'mu', 'ngo', 'ta', 'le', 'ki', 'sa', 'bo', 'nya', 'ru', 'chi', 'we', 'o', 'ma']
+# (first month, last month) of the planting/harvest windows that drive demand.
+SEASONS = [(3, 5), (7, 9), (10, 12)]
+
+
+def chunked(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = "Bulk-generate a synthetic marketplace (users, equipment, bookings, payments, reviews...)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--farmers', type=int, default=1000)
+        parser.add_argument('--operators', type=int, default=200)
+        parser.add_argument('--equipment-per-operator', type=int, default=3)
+        parser.add_argument('--seasons', type=int, default=3, help="Years of booking history to generate.")
+        parser.add_argument('--bookings-per-season', type=int, default=3,
+                            help="Upper bound on bookings per equipment unit per season.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.run = secrets.token_hex(3)
+        self.password = make_password(None)
+        self.today = timezone.localdate()
+        self.sequence = itertools.count(1)
+
+        categories = self.create_categories()
+        farmers = self.create_farmers(options['farmers'])
+        operators = self.create_operators(options['operators'])
+        service_areas = self.create_service_areas(operators)
+        equipment = self.create_equipment(operators, categories, options['equipment_per_operator'])
+        bookings = self.create_bookings(equipment, farmers, service_areas, options['seasons'],
+                                        options['bookings_per_season'])
+        self.create_payments(bookings)
+        self.create_payouts(bookings)
+        self.create_reviews(bookings, farmers, operators)
+        self.create_notifications(bookings, farmers)
+
+        # Bookings are seeded straight into their final status rather than walked through
+        # transitions.transition(), so put right here what it would have kept in step.
+        years = range(self.today.year - options['seasons'], self.today.year + 2)
+        for batch in chunked(equipment, self.batch_size):
+            occupancy.rebuild([pk for pk, *_ in batch], years)
+            self.mark_rented([pk for pk, *_ in batch])
+        facets.invalidate()
+        reputation.reconcile(batch_size=self.batch_size)
+        unread.reconcile(batch_size=self.batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated run {self.run}: {len(farmers)} farmers, {len(operators)} operators, "
+            f"{len(equipment)} equipment units, {len(bookings)} bookings"))
+
+    def bulk(self, model, objects, keep=None):
+        """Insert in batches, returning the created objects or ``keep(obj)`` of each."""
+        created = []
+        for batch in chunked(objects, self.batch_size):
+            with transaction.atomic():
+                batch = model.objects.bulk_create(batch)
+            created.extend(map(keep, batch) if keep else batch)
+        return created
+
+    def reference(self, prefix):
+        return f"{prefix}{self.run.upper()}{next(self.sequence):09d}"
+
+    def person(self):
+        return self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+
+    def phone(self):
+        return f"+2547{self.rng.randrange(10_000_000, 99_999_999)}"
+
+    def point(self, county, spread=0.25):
+        lat, lon = COUNTIES[county]
+        return (Decimal(str(round(lat + self.rng.uniform(-spread, spread), 6))),
+                Decimal(str(round(lon + self.rng.uniform(-spread, spread), 6))))
+
+    def create_categories(self):
+        return {
+            name: EquipmentCategory.objects.get_or_create(name=name)[0].pk
+            for name in CATEGORIES
+        }
+
+    def create_users(self, role, count):
+        def users():
+            for i in range(count):
+                first, last = self.person()
+                yield User(
+                    username=f'{role}-{self.run}-{i}', first_name=first, last_name=last, role=role,
+                    phone_number=self.phone(), password=self.password, id_verified=self.rng.random() < 0.7,
+                )
+        return self.bulk(User, users())
+
+    def create_farmers(self, count):
+        users = self.create_users(User.Role.FARMER, count)
+
+        def profiles():
+            for user in users:
+                county = self.rng.choice(list(COUNTIES))
+                lat, lon = self.point(county)
+                crops = self.rng.sample(CROPS, 3)
+                yield FarmerProfile(
+                    user=user, farm_name=f"{user.last_name} Farm", county=county,
+                    village=''.join(self.rng.choices(SYLLABLES, k=3)).title(),
+                    total_land_acres=Decimal(self.rng.randrange(5, 100)) / 10,
+                    primary_crop=crops[0], secondary_crops=', '.join(crops[1:]),
+                    gps_latitude=lat, gps_longitude=lon, geohash=geo.encode(lat, lon),
+                    has_smartphone=self.rng.random() < 0.6,
+                )
+        return self.bulk(FarmerProfile, profiles(), keep=lambda p: (p.pk, p.user_id, p.county))
+
+    def create_operators(self, count):
+        users = self.create_users(User.Role.OPERATOR, count)
+
+        def profiles():
+            for user in users:
+                mobile = self.rng.random() < 0.85
+                yield OperatorProfile(
+                    user=user, business_name=f"{user.last_name} Agri Services",
+                    years_experience=self.rng.randrange(1, 25), county=self.rng.choice(list(COUNTIES)),
+                    service_radius_km=self.rng.choice([20, 30, 50, 80]),
+                    mobile_money_number=user.phone_number if mobile else '',
+                    bank_account='' if mobile else f"0{self.rng.randrange(10 ** 11, 10 ** 12)}",
+                )
+        return self.bulk(OperatorProfile, profiles(), keep=lambda p: (p.pk, p.user_id, p.county))
+
+    def create_service_areas(self, operators):
+        areas = {}
+
+        def rows():
+            for pk, _, home in operators:
+                counties = {home, *self.rng.sample(list(COUNTIES), self.rng.randrange(0, 3))}
+                for county in counties:
+                    charge = Decimal('0.00') if county == home else Decimal(self.rng.randrange(5, 30) * 100)
+                    areas[pk, county] = charge
+                    yield ServiceArea(operator_id=pk, county=county, additional_charge=charge)
+        self.bulk(ServiceArea, rows())
+        return areas
+
+    def create_equipment(self, operators, categories, per_operator):
+        def units():
+            serial = 0
+            for owner, _, county in operators:
+                for _ in range(self.rng.randrange(1, 2 * per_operator)):
+                    name = self.rng.choice(list(CATEGORIES))
+                    (low, high), hp, capacities = CATEGORIES[name]
+                    brand = self.rng.choice(BRANDS)
+                    lat, lon = self.point(county)
+                    serial += 1
+                    hourly = self.rng.random() < 0.4
+                    daily = Decimal(self.rng.randrange(low, high, 50))
+                    yield Equipment(
+                        owner_id=owner, category_id=categories[name], name=f"{brand} {name}", brand=brand,
+                        model=f"{brand[:2].upper()}-{self.rng.randrange(100, 999)}",
+                        year_manufactured=self.rng.randrange(1995, self.today.year + 1),
+                        serial_number=f"SN-{self.run}-{serial}", capacity_info=self.rng.choice(capacities),
+                        description=f"Well maintained {name.lower()} available in {county} and nearby counties.",
+                        horsepower=Decimal(self.rng.randrange(*hp)) if hp else None,
+                        daily_rate=daily, hourly_rate=(daily / 6).quantize(Decimal('1')) if hourly else None,
+                        fuel_type=self.rng.choice(Equipment.FuelType.values[:3]),
+                        price_includes_fuel=self.rng.random() < 0.3,
+                        current_county=county, gps_latitude=lat, gps_longitude=lon, geohash=geo.encode(lat, lon),
+                        status=self.rng.choices(Equipment.Status.values, weights=[85, 0, 10, 5])[0],
+                    )
+        return self.bulk(Equipment, units(),
+                         keep=lambda e: (e.pk, e.owner_id, e.current_county, e.daily_rate, e.hourly_rate))
+
+    def mark_rented(self, equipment_ids):
+        """RENTED for units with a job in progress and AVAILABLE for other rented units, as transitions do."""
+        busy = RentalBooking.objects.filter(equipment_id__in=equipment_ids, status=RentalBooking.Status.IN_PROGRESS)
+        units = Equipment.objects.filter(pk__in=equipment_ids)
+        units.filter(status=Equipment.Status.AVAILABLE, pk__in=busy.values('equipment_id')).update(
+            status=Equipment.Status.RENTED)
+        units.filter(status=Equipment.Status.RENTED).exclude(pk__in=busy.values('equipment_id')).update(
+            status=Equipment.Status.AVAILABLE)
+
+    def booking_status(self, start, end):
+        s = RentalBooking.Status
+        p = RentalBooking.PaymentStatus
+        if end < self.today:
+            status = self.rng.choices([s.COMPLETED, s.CANCELLED_FARMER, s.CANCELLED_OPERATOR, s.DISPUTED],
+                                      weights=[85, 8, 5, 2])[0]
+            if status == s.COMPLETED:
+                return status, p.FULLY_PAID
+            return status, p.REFUNDED if self.rng.random() < 0.5 else p.UNPAID
+        if start <= self.today:
+            return s.IN_PROGRESS, p.DEPOSIT_PAID
+        status = self.rng.choice([s.PENDING, s.CONFIRMED])
+        return status, p.DEPOSIT_PAID if status == s.CONFIRMED else p.UNPAID
+
+    def create_bookings(self, equipment, farmers, service_areas, seasons, per_season):
+        farmers_by_county = {}
+        for farmer in farmers:
+            farmers_by_county.setdefault(farmer[2], []).append(farmer)
+
+        def rows():
+            for pk, owner, county, daily, hourly in equipment:
+                unit = Equipment(pk=pk, owner_id=owner, daily_rate=daily, hourly_rate=hourly)
+                candidates = farmers_by_county.get(county) or farmers
+                for year in range(self.today.year - seasons + 1, self.today.year + 1):
+                    for first_month, last_month in SEASONS:
+                        # Bookings for a unit are laid out back to back, so they never overlap.
+                        cursor = date(year, first_month, 1) + timedelta(days=self.rng.randrange(0, 14))
+                        season_end = date(year, last_month, 28)
+                        for _ in range(self.rng.randrange(0, per_season + 1)):
+                            start = cursor
+                            end = start + timedelta(days=self.rng.randrange(0, 5))
+                            if end > season_end:
+                                break
+                            cursor = end + timedelta(days=self.rng.randrange(1, 10))
+                            farmer_pk, _, farm_county = self.rng.choice(candidates)
+                            acres = Decimal(self.rng.randrange(5, 100)) / 10
+                            quote = compute_quote(unit, service_areas.get((owner, farm_county)),
+                                                  (end - start).days + 1, acres)
+                            status, payment_status = self.booking_status(start, end)
+                            done = status == RentalBooking.Status.COMPLETED
+                            yield RentalBooking(
+                                farmer_id=farmer_pk, equipment_id=pk, operator_id=owner,
+                                job_description=f"Work {acres} acres of {self.rng.choice(CROPS).lower()}",
+                                land_size_acres=acres, crop_type=self.rng.choice(CROPS),
+                                farm_location_county=farm_county,
+                                requested_start_date=start, requested_end_date=end,
+                                actual_start_date=start if done else None, actual_end_date=end if done else None,
+                                actual_hours=money(acres * Decimal('1.4')) if done else None,
+                                quoted_rate=quote.quoted_rate, transport_fee=quote.transport_fee,
+                                total_amount=quote.total_amount, deposit_amount=quote.deposit_amount,
+                                status=status, payment_status=payment_status,
+                            )
+        return self.bulk(RentalBooking, rows(), keep=lambda b: (
+            b.pk, b.farmer_id, b.operator_id, b.status, b.payment_status, b.total_amount, b.deposit_amount,
+            b.requested_start_date))
+
+    def paid_at(self, day):
+        return timezone.make_aware(datetime.combine(day, time(self.rng.randrange(6, 20), self.rng.randrange(60))))
+
+    def create_payments(self, bookings):
+        p = RentalBooking.PaymentStatus
+
+        def rows():
+            for pk, _, _, _, payment_status, total, deposit, start in bookings:
+                if payment_status == p.UNPAID:
+                    continue
+                method = self.rng.choices(Payment.Method.values, weights=[80, 10, 5, 3, 2])[0]
+                paid = [(Payment.Type.DEPOSIT, deposit, start - timedelta(days=2))]
+                if payment_status == p.FULLY_PAID:
+                    paid.append((Payment.Type.FINAL, total - deposit, start + timedelta(days=1)))
+                if payment_status == p.REFUNDED:
+                    paid.append((Payment.Type.REFUND, deposit, start))
+                for kind, amount, day in paid:
+                    yield Payment(
+                        booking_id=pk, amount=amount, method=method, payment_type=kind,
+                        transaction_id=self.reference('TX'),
+                        is_confirmed=True, paid_at=self.paid_at(day),
+                    )
+        self.bulk(Payment, rows())
+
+    def create_payouts(self, bookings):
+        """Pays out most settled jobs, leaving the recent ones for the next payout run."""
+        def rows():
+            for pk, _, operator, status, payment_status, total, _, start in bookings:
+                if (status != RentalBooking.Status.COMPLETED or payment_status != RentalBooking.PaymentStatus.FULLY_PAID
+                        or self.today - start < timedelta(days=60)):
+                    continue
+                fee, net = payouts.fee_split(total)
+                yield OperatorPayout(
+                    operator_id=operator, booking_id=pk, gross_amount=total, platform_fee_amount=fee,
+                    net_amount=net, status=OperatorPayout.Status.PAID, payout_method=payouts.MOBILE_MONEY,
+                    payout_reference=self.reference('PO'),
+                    initiated_at=self.paid_at(start + timedelta(days=7)),
+                    completed_at=self.paid_at(start + timedelta(days=7)),
+                )
+        self.bulk(OperatorPayout, rows())
+
+    def create_reviews(self, bookings, farmers, operators):
+        farmer_users = {pk: user for pk, user, _ in farmers}
+        operator_users = {pk: user for pk, user, _ in operators}
+
+        def rows():
+            for pk, farmer, operator, status, *_ in bookings:
+                if status != RentalBooking.Status.COMPLETED:
+                    continue
+                if self.rng.random() < 0.6:
+                    yield BookingReview(
+                        booking_id=pk, reviewer_id=farmer_users[farmer], reviewee_id=operator_users[operator],
+                        rating=self.rng.choices(range(1, 6), weights=[3, 5, 12, 35, 45])[0],
+                        punctuality_rating=self.rng.randrange(2, 6), quality_rating=self.rng.randrange(2, 6),
+                        comment=self.rng.choice(['', 'Good work', 'Arrived late', 'Excellent ploughing']),
+                    )
+                if self.rng.random() < 0.3:
+                    yield BookingReview(
+                        booking_id=pk, reviewer_id=operator_users[operator], reviewee_id=farmer_users[farmer],
+                        rating=self.rng.choices(range(1, 6), weights=[2, 3, 10, 35, 50])[0],
+                    )
+        self.bulk(BookingReview, rows())
+
+    def create_notifications(self, bookings, farmers):
+        farmer_users = {pk: user for pk, user, _ in farmers}
+
+        def rows():
+            for pk, farmer, _, status, *_ in bookings:
+                yield Notification(
+                    user_id=farmer_users[farmer], title=f"Booking #{pk} received",
+                    message="Your booking request has been sent to the operator.", related_booking_id=pk,
+                    channel=Notification.Channel.IN_APP, is_read=self.rng.random() < 0.8,
+                )
+                if status != RentalBooking.Status.PENDING:
+                    yield Notification(
+                        user_id=farmer_users[farmer], title=f"Booking #{pk} {status.replace('_', ' ')}",
+                        message=f"Booking #{pk} is now {status.replace('_', ' ')}.", related_booking_id=pk,
+                        channel=Notification.Channel.SMS, is_read=self.rng.random() < 0.5,
+                        delivery_status=Notification.Delivery.SENT, attempts=1,
+                    )
+        self.bulk(Notification, rows())
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import fulltext
+
+
+class Command(BaseCommand):
+    help = "Rebuild the equipment full-text index from the equipment table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--optimize', action='store_true', help="Also merge the index into a single segment.")
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if not fulltext.rebuild(options['database'], optimize=options['optimize']):
+            raise CommandError("No full-text index on this database (needs SQLite with FTS5 and migration 0003)")
+        self.stdout.write(self.style.SUCCESS("Equipment full-text index rebuilt"))
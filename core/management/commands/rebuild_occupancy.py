@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import occupancy
+from core.models import Equipment
+
+
+class Command(BaseCommand):
+    help = "Rebuild equipment day-bitmaps from bookings and maintenance logs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, action='append', dest='years',
+                            help="Year to rebuild; repeatable. Defaults to this year and next.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        years = options['years'] or [today.year, today.year + 1]
+        ids = Equipment.objects.order_by('pk').values_list('pk', flat=True)
+        total = last_pk = 0
+        while batch := list(ids.filter(pk__gt=last_pk)[:options['batch_size']]):
+            occupancy.rebuild(batch, years)
+            total += len(batch)
+            last_pk = batch[-1]
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt occupancy for {total} equipment units in {', '.join(map(str, years))}"))
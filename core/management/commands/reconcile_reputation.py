@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core import reputation
+
+
+class Command(BaseCommand):
+    help = "Rebuild rating summaries, operator averages and completed-job counts, reporting drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without fixing it.")
+
+    def handle(self, *args, **options):
+        drift = reputation.reconcile(batch_size=options['batch_size'], fix=not options['dry_run'])
+        for example in drift.examples:
+            self.stdout.write(f"  {example}")
+        style = self.style.WARNING if drift.summaries_drifted or drift.operators_drifted else self.style.SUCCESS
+        self.stdout.write(style(
+            f"Rating summaries: {drift.summaries_drifted}/{drift.summaries_checked} drifted; "
+            f"operators: {drift.operators_drifted}/{drift.operators_checked} drifted"
+            + ("" if options['dry_run'] else " (fixed)")))
@@ -0,0 +1,62 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.middleware import LATENCY_BUCKETS_MS, empty_view_stats, merge_view_stats
+
+
+def percentile(buckets, fraction):
+    """Upper bound in ms of the histogram bucket holding the given fraction of requests."""
+    target = sum(buckets) * fraction
+    seen = 0
+    for bound, count in zip((*LATENCY_BUCKETS_MS, float('inf')), buckets):
+        seen += count
+        if count and seen >= target:
+            return bound
+    return 0
+
+
+class Command(BaseCommand):
+    help = "Print per-view query counts and latency collected by QueryInstrumentationMiddleware."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=['requests', 'latency', 'queries'], default='latency')
+        parser.add_argument('--json', action='store_true', help="Print the merged stats as JSON.")
+        parser.add_argument('--reset', action='store_true', help="Delete collected stats after printing.")
+
+    def handle(self, *args, **options):
+        directory = getattr(settings, 'REQUEST_STATS_DIR', None)
+        if not directory:
+            raise CommandError("REQUEST_STATS_DIR is not configured")
+        files = sorted(Path(directory).glob('*.json'))
+        views = {}
+        for path in files:
+            for view, stats in json.loads(path.read_text())['views'].items():
+                merge_view_stats(views.setdefault(view, empty_view_stats()), stats)
+
+        if options['json']:
+            self.stdout.write(json.dumps(views, indent=2))
+        else:
+            self.print_table(views, options['sort'])
+        if options['reset']:
+            for path in files:
+                path.unlink(missing_ok=True)
+
+    def print_table(self, views, sort):
+        key = {
+            'requests': lambda item: item[1]['requests'],
+            'latency': lambda item: item[1]['latency_ms_total'] / item[1]['requests'],
+            'queries': lambda item: item[1]['queries_total'] / item[1]['requests'],
+        }[sort]
+        self.stdout.write(f"{'view':40} {'reqs':>7} {'avg ms':>8} {'p95 ms':>8} {'max ms':>8} "
+                          f"{'avg q':>6} {'max q':>6} {'db ms':>8} {'n+1':>5}")
+        for view, stats in sorted(views.items(), key=key, reverse=True):
+            n = stats['requests']
+            self.stdout.write(
+                f"{view[:40]:40} {n:7} {stats['latency_ms_total'] / n:8.1f} "
+                f"{percentile(stats['latency_buckets'], 0.95):>8} {stats['latency_ms_max']:8.1f} "
+                f"{stats['queries_total'] / n:6.1f} {stats['queries_max']:6} {stats['db_ms_total'] / n:8.1f} "
+                f"{stats['n_plus_one_requests']:5}"
+            )
@@ -0,0 +1,80 @@
+import json
+import subprocess
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import BENCHMARKS, BenchmarkContext, run
+from core.models import Equipment, RentalBooking
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+class Command(BaseCommand):
+    help = "Time the marketplace hot paths against the current dataset and flag regressions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f"Benchmarks to run (default all): {', '.join(BENCHMARKS)}")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Median slowdown versus the previous run reported as a regression.")
+        parser.add_argument('--no-record', action='store_true', help="Do not append results to the results file.")
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+        if not Equipment.objects.exists():
+            raise CommandError("The database is empty; run generate_marketplace_data first")
+
+        results_file = Path(getattr(settings, 'BENCHMARK_RESULTS_FILE', settings.BASE_DIR / 'var' / 'benchmarks.jsonl'))
+        previous = self.previous_results(results_file)
+        ctx = BenchmarkContext.sample(options['seed'])
+
+        results = {}
+        regressions = []
+        self.stdout.write(f"{'benchmark':24} {'median ms':>10} {'p95 ms':>10} {'queries':>8}  vs previous")
+        for name in names:
+            result = results[name] = run(name, ctx, options['repeat'])
+            before = previous.get(name)
+            change = ''
+            if before and before['median_ms']:
+                ratio = result['median_ms'] / before['median_ms'] - 1
+                change = f"{ratio:+.0%}"
+                if ratio > options['threshold']:
+                    regressions.append(name)
+                    change += ' REGRESSION'
+            self.stdout.write(f"{name:24} {result['median_ms']:10.2f} {result['p95_ms']:10.2f} "
+                              f"{result['queries']:8}  {change}")
+
+        if not options['no_record']:
+            results_file.parent.mkdir(parents=True, exist_ok=True)
+            with results_file.open('a') as out:
+                out.write(json.dumps({
+                    'recorded_at': time.time(),
+                    'revision': git_revision(),
+                    'dataset': {'equipment': Equipment.objects.count(), 'bookings': RentalBooking.objects.count()},
+                    'results': results,
+                }) + '\n')
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"Regressions: {', '.join(regressions)}")
+
+    def previous_results(self, path):
+        """Latest recorded result of each benchmark."""
+        latest = {}
+        if path.exists():
+            for line in path.read_text().splitlines():
+                if line.strip():
+                    latest.update(json.loads(line)['results'])
+        return latest
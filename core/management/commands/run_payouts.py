@@ -0,0 +1,50 @@
+import os
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import payouts
+
+
+class Command(BaseCommand):
+    help = ("Create payouts for completed, fully paid jobs and write the run's settlement file. "
+            "Re-run with --run to resume an interrupted run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', help="Run reference to start or resume (default: a new one).")
+        parser.add_argument('--output', help="Settlement CSV path (default: PAYOUT_SETTLEMENT_DIR/<run>.csv).")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--fee-percent', type=Decimal, default=payouts.PLATFORM_FEE_PERCENT)
+
+    def handle(self, *args, **options):
+        reference = options['run']
+        if reference is None:
+            reference = payouts.new_reference()
+            for unfinished in payouts.unfinished_runs():
+                self.stdout.write(self.style.WARNING(
+                    f"Run {unfinished} has unsettled payouts; resume it with --run {unfinished}"))
+
+        stats = payouts.create_payouts(reference, batch_size=options['batch_size'],
+                                       fee_percent=options['fee_percent'])
+        self.stdout.write(f"{reference}: queued {stats.created} payouts in {stats.batches} batches")
+        if stats.held:
+            self.stdout.write(self.style.WARNING(
+                f"{stats.held} jobs held back: their operators have no mobile money number or bank account"))
+
+        directory = Path(getattr(settings, 'PAYOUT_SETTLEMENT_DIR', settings.BASE_DIR / 'var' / 'payouts'))
+        output = Path(options['output'] or directory / f'{reference}.csv')
+        output.parent.mkdir(parents=True, exist_ok=True)
+        partial = output.with_name(output.name + '.partial')
+        # The payouts only become PROCESSING once the file is in place; if
+        # writing it fails they stay PENDING and the run can be resumed.
+        with transaction.atomic():
+            with open(partial, 'w', newline='') as stream:
+                settled, accounts, total = payouts.settle(reference, stream)
+                stream.flush()
+                os.fsync(stream.fileno())
+            os.replace(partial, output)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {output}: {accounts} accounts, {settled} payouts, KES {total:,} net; marked processing"))
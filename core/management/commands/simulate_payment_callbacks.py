@@ -0,0 +1,88 @@
+import json
+import random
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from core import payments
+from core.models import Payment, RentalBooking
+
+
+class Command(BaseCommand):
+    help = "Replay a burst of mobile-money callbacks, with retries and duplicates, against the ingestion path."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=5000, help="Distinct payments to simulate.")
+        parser.add_argument('--duplicate-rate', type=float, default=0.3,
+                            help="Fraction of callbacks the gateway delivers more than once.")
+        parser.add_argument('--per-request', type=int, default=1, help="Callbacks per HTTP request.")
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--url', help="POST to a running server instead of calling the batcher in-process.")
+        parser.add_argument('--token', default='', help="X-Callback-Token to send with --url.")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        bookings = list(
+            RentalBooking.objects.exclude(payment_status=RentalBooking.PaymentStatus.FULLY_PAID)
+            .filter(total_amount__gt=0).values_list('pk', 'deposit_amount', 'total_amount')[:options['count']]
+        )
+        if not bookings:
+            raise CommandError("No unpaid bookings to pay; run generate_marketplace_data first")
+
+        run = f"SIM{rng.getrandbits(32):08X}"
+        callbacks = []
+        for i in range(options['count']):
+            pk, deposit, total = rng.choice(bookings)
+            full = rng.random() < 0.5
+            callback = {
+                'transaction_id': f"{run}{i:08d}",
+                'booking': pk,
+                'amount': str(total if full else deposit or total),
+                'method': rng.choice([Payment.Method.MPESA, Payment.Method.AIRTEL_MONEY]),
+                'payment_type': Payment.Type.FINAL if full else Payment.Type.DEPOSIT,
+                'paid_at': timezone.now().isoformat(),
+            }
+            callbacks.append(callback)
+            while rng.random() < options['duplicate_rate']:
+                callbacks.append(callback)
+        rng.shuffle(callbacks)
+        requests = [callbacks[i:i + options['per_request']] for i in range(0, len(callbacks), options['per_request'])]
+
+        send = self.poster(options['url'], options['token']) if options['url'] else self.submit
+        totals = {payments.ACCEPTED: 0, payments.DUPLICATE: 0, payments.REJECTED: 0}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['threads']) as pool:
+            for counts in pool.map(send, requests):
+                for key, value in counts.items():
+                    totals[key] += value
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{len(callbacks)} callbacks ({options['count']} distinct) in {len(requests)} requests, "
+            f"{elapsed:.2f}s: {len(callbacks) / elapsed:,.0f} callbacks/s")
+        self.stdout.write(f"accepted={totals['accepted']} duplicate={totals['duplicate']} "
+                          f"rejected={totals['rejected']}")
+        stored = Payment.objects.filter(transaction_id__startswith=run).count()
+        style = self.style.SUCCESS if stored == options['count'] else self.style.ERROR
+        self.stdout.write(style(f"{stored} payments stored for {options['count']} distinct transactions"))
+
+    def submit(self, batch):
+        try:
+            parsed = [payments.parse_callback(callback) for callback in batch]
+            return payments.summarise(payments.batcher.submit(parsed), parsed)
+        finally:
+            close_old_connections()
+
+    def poster(self, url, token):
+        def post(batch):
+            request = urllib.request.Request(
+                url, data=json.dumps(batch).encode(), method='POST',
+                headers={'Content-Type': 'application/json', 'X-Callback-Token': token})
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return json.loads(response.read())
+        return post
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import random
+import resource
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import telemetry
+from core.models import RentalBooking, TelemetryFix
+
+
+class Command(BaseCommand):
+    help = ("Connect simulated devices to the telemetry WebSocket in-process, stream GPS fixes for in-progress "
+            "bookings and report ingestion throughput, flush cost and event-loop lag.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=5000)
+        parser.add_argument('--seconds', type=float, default=20)
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds between a device's fixes.")
+        parser.add_argument('--keep', action='store_true', help="Keep the simulated fixes instead of deleting them.")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        bookings = list(RentalBooking.objects.filter(status=RentalBooking.Status.IN_PROGRESS)
+                        .values_list('pk', flat=True)[:options['devices']])
+        if not bookings:
+            raise CommandError("No bookings in progress; run generate_marketplace_data first")
+        rng = random.Random(options['seed'])
+        tokens = [telemetry.device_token(RentalBooking(pk=bookings[i % len(bookings)]))
+                  for i in range(options['devices'])]
+        last_fix = TelemetryFix.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+        report = asyncio.run(self.simulate(tokens, rng, options))
+
+        stats = telemetry.ingestor.stats
+        stored = TelemetryFix.objects.filter(pk__gt=last_fix).count()
+        self.stdout.write(f"{report['connected']}/{options['devices']} devices on {len(bookings)} bookings "
+                          f"connected in {report['connect_s']:.2f}s")
+        self.stdout.write(f"{report['sent']} fixes sent in {options['seconds']:.0f}s: "
+                          f"{report['sent'] / options['seconds']:,.0f} fixes/s")
+        self.stdout.write(f"written={stats['written']} dropped={stats['dropped']} positions={stats['positions']} "
+                          f"flushes={stats['flushes']} failed_flushes={stats['failed_flushes']} "
+                          f"last_flush_ms={stats['flush_ms']}")
+        self.stdout.write(f"event loop lag: p50 {report['lag_p50_ms']:.1f} ms, max {report['lag_max_ms']:.1f} ms; "
+                          f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+        style = self.style.SUCCESS if stored == report['sent'] - stats['dropped'] else self.style.ERROR
+        self.stdout.write(style(f"{stored} fixes stored"))
+        if not options['keep']:
+            TelemetryFix.objects.filter(pk__gt=last_fix).delete()
+
+    async def simulate(self, tokens, rng, options):
+        from config.asgi import application
+
+        lags = []
+        stop = asyncio.Event()
+
+        async def watch_loop():
+            while not stop.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.05)
+                lags.append((time.perf_counter() - start - 0.05) * 1000)
+
+        watcher = asyncio.create_task(watch_loop())
+        start = time.perf_counter()
+        connected = asyncio.Queue()
+        devices = [asyncio.create_task(self.device(application, token, random.Random(rng.random()), connected,
+                                                   options))
+                   for token in tokens]
+        for _ in tokens:
+            await connected.get()
+        connect_s = time.perf_counter() - start
+        counts = await asyncio.gather(*devices)
+        await telemetry.shutdown()
+        stop.set()
+        await watcher
+        return {
+            'connected': sum(1 for sent in counts if sent is not None),
+            'connect_s': connect_s,
+            'sent': sum(sent or 0 for sent in counts),
+            'lag_p50_ms': statistics.median(lags),
+            'lag_max_ms': max(lags),
+        }
+
+    async def device(self, application, token, rng, connected, options):
+        """One device: connect, send a fix every ``interval`` seconds, disconnect; returns fixes sent."""
+        inbox = asyncio.Queue()
+        accepted = asyncio.get_running_loop().create_future()
+
+        async def send(message):
+            if not accepted.done() and message['type'] in ('websocket.accept', 'websocket.close'):
+                accepted.set_result(message['type'] == 'websocket.accept')
+
+        scope = {'type': 'websocket', 'path': telemetry.WEBSOCKET_PATH,
+                 'query_string': f'token={token}'.encode(), 'headers': []}
+        await inbox.put({'type': 'websocket.connect'})
+        connection = asyncio.create_task(application(scope, inbox.get, send))
+        ok = await accepted
+        connected.put_nowait(ok)
+        if not ok:
+            await connection
+            return None
+
+        lat, lon = rng.uniform(-1.5, 0.5), rng.uniform(34.5, 38.0)
+        sent = 0
+        deadline = time.monotonic() + options['seconds']
+        await asyncio.sleep(rng.uniform(0, options['interval']))
+        while time.monotonic() < deadline:
+            lat += rng.uniform(-5e-5, 5e-5)
+            lon += rng.uniform(-5e-5, 5e-5)
+            await inbox.put({'type': 'websocket.receive', 'text': json.dumps({
+                'lat': round(lat, 6), 'lon': round(lon, 6), 'speed': rng.randrange(0, 25),
+                'heading': rng.randrange(0, 360), 'accuracy': rng.randrange(3, 20),
+            })})
+            sent += 1
+            await asyncio.sleep(options['interval'])
+        await inbox.put({'type': 'websocket.disconnect', 'code': 1000})
+        await connection
+        return sent
@@ -0,0 +1,26 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.routers import REPLICA_ALIAS, replica_configured
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database into the replica file, for running with a local stand-in replica."
+
+    def handle(self, *args, **options):
+        if not replica_configured():
+            raise CommandError("No replica database is configured; set REPLICA_DATABASE_NAME")
+        primary, replica = connections['default'], connections[REPLICA_ALIAS]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError("sync_replica only copies between SQLite files; use the database's own replication")
+        primary.ensure_connection()
+        # The online backup API rewrites the replica in place, so open replica
+        # connections see the new data on their next transaction.
+        target = sqlite3.connect(replica.settings_dict['NAME'])
+        try:
+            primary.connection.backup(target)
+        finally:
+            target.close()
+        self.stdout.write(self.style.SUCCESS(f"Replica {replica.settings_dict['NAME']} refreshed"))
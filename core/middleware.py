@@ -0,0 +1,174 @@
+"""
+Per-request database and latency instrumentation.
+
+``QueryInstrumentationMiddleware`` wraps every database connection while a
+request is handled and records how many queries ran, how long they took,
+which SQL shapes repeated (the N+1 signature) and the overall view latency.
+Each request is logged as one JSON line on the ``core.instrumentation``
+logger and folded into an in-process per-view histogram. Every
+``REQUEST_STATS_FLUSH_SECONDS`` the histogram is written to
+``REQUEST_STATS_DIR`` (one file per process) for the ``request_stats``
+management command to merge and print. It is only installed when
+``REQUEST_STATS_ENABLED`` is set.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('core.instrumentation')
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+DUPLICATE_QUERY_THRESHOLD = 3
+
+_IN_LIST = re.compile(r'\bIN \((?:%s, )*%s\)', re.IGNORECASE)
+_NUMBER = re.compile(r'\b\d+\b')
+_SPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """SQL with literals and IN-list lengths erased, so repeats of one query shape match."""
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _NUMBER.sub('N', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """Connection execute wrapper that tallies the queries of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.shapes[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold=DUPLICATE_QUERY_THRESHOLD):
+        return {shape: n for shape, n in self.shapes.most_common() if n >= threshold}
+
+
+def empty_view_stats():
+    return {
+        'requests': 0,
+        'latency_ms_total': 0.0,
+        'latency_ms_max': 0.0,
+        'latency_buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+        'queries_total': 0,
+        'queries_max': 0,
+        'db_ms_total': 0.0,
+        'n_plus_one_requests': 0,
+    }
+
+
+def merge_view_stats(into, other):
+    for key in ('requests', 'latency_ms_total', 'queries_total', 'db_ms_total', 'n_plus_one_requests'):
+        into[key] += other[key]
+    for key in ('latency_ms_max', 'queries_max'):
+        into[key] = max(into[key], other[key])
+    into['latency_buckets'] = [a + b for a, b in zip(into['latency_buckets'], other['latency_buckets'])]
+    return into
+
+
+def bucket_index(latency_ms):
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if latency_ms <= bound:
+            return i
+    return len(LATENCY_BUCKETS_MS)
+
+
+class RequestStats:
+    """Thread-safe per-view histogram for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, view, latency_ms, recorder, n_plus_one):
+        with self._lock:
+            stats = self._views.setdefault(view, empty_view_stats())
+            stats['requests'] += 1
+            stats['latency_ms_total'] += latency_ms
+            stats['latency_ms_max'] = max(stats['latency_ms_max'], latency_ms)
+            stats['latency_buckets'][bucket_index(latency_ms)] += 1
+            stats['queries_total'] += recorder.count
+            stats['queries_max'] = max(stats['queries_max'], recorder.count)
+            stats['db_ms_total'] += recorder.duration * 1000
+            stats['n_plus_one_requests'] += bool(n_plus_one)
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self._views))
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def maybe_flush(self, directory, interval):
+        now = time.monotonic()
+        if not directory or now - self._last_flush < interval:
+            return
+        self._last_flush = now
+        self.flush(directory)
+
+    def flush(self, directory):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'{os.getpid()}.json'
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'pid': os.getpid(), 'written_at': time.time(), 'views': self.snapshot()}))
+        os.replace(tmp, path)
+
+
+request_stats = RequestStats()
+
+
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_STATS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.stats_dir = getattr(settings, 'REQUEST_STATS_DIR', None)
+        self.flush_interval = getattr(settings, 'REQUEST_STATS_FLUSH_SECONDS', 10)
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        duplicates = recorder.duplicates()
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'latency_ms': round(latency_ms, 2),
+            'queries': recorder.count,
+            'db_ms': round(recorder.duration * 1000, 2),
+            'duplicate_queries': duplicates,
+        }))
+        request_stats.record(view, latency_ms, recorder, duplicates)
+        request_stats.maybe_flush(self.stats_dir, self.flush_interval)
+        return response
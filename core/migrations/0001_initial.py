@@ -0,0 +1,374 @@
+# Generated by Django 5.2.18 on 2026-10-16 08:24
+
+import core.geo
+import django.contrib.auth.models
+import django.contrib.auth.validators
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('username', models.CharField(error_messages={'unique': 'A user with that username already exists.'}, help_text='Required. 150 characters or fewer. Letters, digits and @/./+/-/_ only.', max_length=150, unique=True, validators=[django.contrib.auth.validators.UnicodeUsernameValidator()], verbose_name='username')),
+                ('first_name', models.CharField(blank=True, max_length=150, verbose_name='first name')),
+                ('last_name', models.CharField(blank=True, max_length=150, verbose_name='last name')),
+                ('email', models.EmailField(blank=True, max_length=254, verbose_name='email address')),
+                ('is_staff', models.BooleanField(default=False, help_text='Designates whether the user can log into this admin site.', verbose_name='staff status')),
+                ('is_active', models.BooleanField(default=True, help_text='Designates whether this user should be treated as active. Unselect this instead of deleting accounts.', verbose_name='active')),
+                ('date_joined', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date joined')),
+                ('role', models.CharField(choices=[('farmer', 'Farmer / Smallholder'), ('operator', 'Equipment Operator / Owner'), ('admin', 'Admin')], default='farmer', max_length=15)),
+                ('phone_number', models.CharField(max_length=20)),
+                ('profile_photo', models.ImageField(blank=True, null=True, upload_to='profiles/')),
+                ('national_id', models.CharField(blank=True, max_length=50)),
+                ('id_verified', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.group', verbose_name='groups')),
+                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.permission', verbose_name='user permissions')),
+            ],
+            options={
+                'verbose_name': 'user',
+                'verbose_name_plural': 'users',
+                'abstract': False,
+            },
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EquipmentCategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('description', models.TextField(blank=True)),
+                ('icon', models.CharField(blank=True, max_length=50)),
+            ],
+            options={
+                'verbose_name_plural': 'Equipment Categories',
+            },
+        ),
+        migrations.CreateModel(
+            name='RatingSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_total', models.PositiveIntegerField(default=0)),
+                ('punctuality_count', models.PositiveIntegerField(default=0)),
+                ('punctuality_total', models.PositiveIntegerField(default=0)),
+                ('quality_count', models.PositiveIntegerField(default=0)),
+                ('quality_total', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Rating Summaries',
+            },
+        ),
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Equipment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('brand', models.CharField(blank=True, max_length=100)),
+                ('model', models.CharField(blank=True, max_length=100)),
+                ('year_manufactured', models.PositiveIntegerField(blank=True, null=True)),
+                ('serial_number', models.CharField(blank=True, max_length=100, unique=True)),
+                ('description', models.TextField(blank=True)),
+                ('fuel_type', models.CharField(choices=[('diesel', 'Diesel'), ('petrol', 'Petrol'), ('electric', 'Electric'), ('manual', 'Manual / Animal-Powered')], default='diesel', max_length=10)),
+                ('horsepower', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True)),
+                ('capacity_info', models.CharField(blank=True, help_text='e.g., 3-row planter, 5-ton capacity', max_length=200)),
+                ('daily_rate', models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))])),
+                ('hourly_rate', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('price_includes_operator', models.BooleanField(default=True)),
+                ('price_includes_fuel', models.BooleanField(default=False)),
+                ('current_county', models.CharField(max_length=100)),
+                ('gps_latitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('gps_longitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('geohash', models.CharField(blank=True, db_index=True, editable=False, max_length=12)),
+                ('status', models.CharField(choices=[('available', 'Available'), ('rented', 'Currently Rented'), ('maintenance', 'Under Maintenance'), ('inactive', 'Inactive')], default='available', max_length=15)),
+                ('last_serviced', models.DateField(blank=True, null=True)),
+                ('next_service_due', models.DateField(blank=True, null=True)),
+                ('insurance_expiry', models.DateField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='equipment', to='core.equipmentcategory')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+            bases=(core.geo.GeohashMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='EquipmentImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(upload_to='equipment_images/')),
+                ('caption', models.CharField(blank=True, max_length=255)),
+                ('is_primary', models.BooleanField(default=False)),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('equipment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='core.equipment')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FarmerProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('farm_name', models.CharField(blank=True, max_length=200)),
+                ('total_land_acres', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('primary_crop', models.CharField(blank=True, max_length=100)),
+                ('secondary_crops', models.CharField(blank=True, max_length=255)),
+                ('county', models.CharField(max_length=100)),
+                ('village', models.CharField(blank=True, max_length=100)),
+                ('gps_latitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('gps_longitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('geohash', models.CharField(blank=True, db_index=True, editable=False, max_length=12)),
+                ('has_smartphone', models.BooleanField(default=True)),
+                ('preferred_language', models.CharField(default='English', max_length=50)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='farmer_profile', to=settings.AUTH_USER_MODEL)),
+            ],
+            bases=(core.geo.GeohashMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='OperatorProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('business_name', models.CharField(blank=True, max_length=200)),
+                ('years_experience', models.PositiveIntegerField(default=0)),
+                ('license_number', models.CharField(blank=True, max_length=100)),
+                ('license_document', models.FileField(blank=True, null=True, upload_to='licenses/')),
+                ('service_radius_km', models.PositiveIntegerField(default=50)),
+                ('county', models.CharField(max_length=100)),
+                ('bank_account', models.CharField(blank=True, max_length=100)),
+                ('mobile_money_number', models.CharField(blank=True, max_length=20)),
+                ('average_rating', models.DecimalField(decimal_places=2, default=0.0, max_digits=3)),
+                ('total_jobs_completed', models.PositiveIntegerField(default=0)),
+                ('is_available', models.BooleanField(default=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='operator_profile', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='equipment',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='equipment', to='core.operatorprofile'),
+        ),
+        migrations.CreateModel(
+            name='RentalBooking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_description', models.TextField(help_text='Describe the work needed e.g. ploughing 5 acres of maize')),
+                ('land_size_acres', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('crop_type', models.CharField(blank=True, max_length=100)),
+                ('farm_location_county', models.CharField(max_length=100)),
+                ('farm_gps_latitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('farm_gps_longitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('farm_directions', models.TextField(blank=True)),
+                ('requested_start_date', models.DateField()),
+                ('requested_end_date', models.DateField()),
+                ('actual_start_date', models.DateField(blank=True, null=True)),
+                ('actual_end_date', models.DateField(blank=True, null=True)),
+                ('estimated_hours', models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True)),
+                ('actual_hours', models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True)),
+                ('quoted_rate', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('transport_fee', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=12)),
+                ('deposit_amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending Confirmation'), ('confirmed', 'Confirmed'), ('in_progress', 'In Progress'), ('completed', 'Completed'), ('cancelled_farmer', 'Cancelled by Farmer'), ('cancelled_operator', 'Cancelled by Operator'), ('disputed', 'Disputed')], default='pending', max_length=20)),
+                ('payment_status', models.CharField(choices=[('unpaid', 'Unpaid'), ('deposit_paid', 'Deposit Paid'), ('fully_paid', 'Fully Paid'), ('refunded', 'Refunded')], default='unpaid', max_length=15)),
+                ('operator_notes', models.TextField(blank=True)),
+                ('farmer_notes', models.TextField(blank=True)),
+                ('cancellation_reason', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('equipment', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='bookings', to='core.equipment')),
+                ('farmer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bookings', to='core.farmerprofile')),
+                ('operator', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='bookings', to='core.operatorprofile')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('method', models.CharField(choices=[('mpesa', 'M-Pesa'), ('airtel_money', 'Airtel Money'), ('bank_transfer', 'Bank Transfer'), ('cash', 'Cash'), ('card', 'Debit/Credit Card')], max_length=15)),
+                ('payment_type', models.CharField(choices=[('deposit', 'Deposit'), ('final', 'Final Payment'), ('refund', 'Refund')], max_length=10)),
+                ('transaction_id', models.CharField(max_length=200, unique=True)),
+                ('is_confirmed', models.BooleanField(default=False)),
+                ('paid_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('notes', models.TextField(blank=True)),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='core.rentalbooking')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OperatorPayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gross_amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('platform_fee_percent', models.DecimalField(decimal_places=2, default=10.0, max_digits=5)),
+                ('platform_fee_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('net_amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('paid', 'Paid'), ('failed', 'Failed')], default='pending', max_length=15)),
+                ('payout_method', models.CharField(blank=True, max_length=50)),
+                ('payout_reference', models.CharField(blank=True, max_length=200)),
+                ('initiated_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('operator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payouts', to='core.operatorprofile')),
+                ('booking', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payout', to='core.rentalbooking')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+                ('channel', models.CharField(choices=[('in_app', 'In-App'), ('sms', 'SMS'), ('push', 'Push Notification')], default='in_app', max_length=10)),
+                ('is_read', models.BooleanField(default=False)),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+                ('delivery_status', models.CharField(blank=True, choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(blank=True, null=True)),
+                ('claimed_by', models.CharField(blank=True, max_length=64)),
+                ('last_error', models.CharField(blank=True, max_length=255)),
+                ('delivered_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL)),
+                ('related_booking', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.rentalbooking')),
+            ],
+            options={
+                'ordering': ['-sent_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BookingReview',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.PositiveSmallIntegerField(choices=[(1, 1), (2, 2), (3, 3), (4, 4), (5, 5)])),
+                ('punctuality_rating', models.PositiveSmallIntegerField(choices=[(1, 1), (2, 2), (3, 3), (4, 4), (5, 5)], null=True)),
+                ('quality_rating', models.PositiveSmallIntegerField(choices=[(1, 1), (2, 2), (3, 3), (4, 4), (5, 5)], null=True)),
+                ('comment', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('reviewee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='received_reviews', to=settings.AUTH_USER_MODEL)),
+                ('reviewer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='given_reviews', to=settings.AUTH_USER_MODEL)),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to='core.rentalbooking')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ServiceArea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('county', models.CharField(max_length=100)),
+                ('additional_charge', models.DecimalField(decimal_places=2, default=0.0, help_text='Extra transport fee for this area', max_digits=8)),
+                ('operator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='service_areas', to='core.operatorprofile')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SupportTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('description', models.TextField()),
+                ('status', models.CharField(choices=[('open', 'Open'), ('in_review', 'Under Review'), ('resolved', 'Resolved'), ('closed', 'Closed')], default='open', max_length=15)),
+                ('priority', models.CharField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High'), ('urgent', 'Urgent')], default='medium', max_length=10)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('assigned_to', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='assigned_tickets', to=settings.AUTH_USER_MODEL)),
+                ('booking', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tickets', to='core.rentalbooking')),
+                ('submitter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tickets', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EquipmentOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('days', models.BinaryField(help_text='Bit n is set when day-of-year n (0-based) is busy', max_length=46)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('equipment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy', to='core.equipment')),
+            ],
+            options={
+                'verbose_name_plural': 'Equipment Occupancy',
+                'unique_together': {('equipment', 'year')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MaintenanceLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_date', models.DateField()),
+                ('service_type', models.CharField(max_length=200)),
+                ('description', models.TextField()),
+                ('cost', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('performed_by', models.CharField(blank=True, max_length=200)),
+                ('next_service_date', models.DateField(blank=True, null=True)),
+                ('attachment', models.FileField(blank=True, null=True, upload_to='maintenance_docs/')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('equipment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='maintenance_logs', to='core.equipment')),
+            ],
+            options={
+                'ordering': ['-service_date'],
+                'indexes': [models.Index(fields=['equipment', '-service_date'], name='core_mainte_equipme_d72ba2_idx')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='equipment',
+            index=models.Index(fields=['status', 'category', 'current_county'], name='core_equipm_status_4b9743_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rentalbooking',
+            index=models.Index(fields=['equipment', 'status', 'requested_start_date'], name='core_rental_equipme_c7c657_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rentalbooking',
+            index=models.Index(fields=['farmer', '-created_at'], name='core_rental_farmer__ae0dd2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['booking', 'is_confirmed'], name='core_paymen_booking_b74316_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read', '-sent_at'], name='core_notifi_user_id_fc04d5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['delivery_status', 'next_attempt_at'], name='core_notifi_deliver_c0e41b_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bookingreview',
+            unique_together={('booking', 'reviewer')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='servicearea',
+            unique_together={('operator', 'county')},
+        ),
+    ]
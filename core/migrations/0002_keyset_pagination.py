@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-16 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='equipment',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AlterModelOptions(
+            name='notification',
+            options={'ordering': ['-sent_at', '-id']},
+        ),
+        migrations.AlterModelOptions(
+            name='rentalbooking',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='core_notifi_user_id_fc04d5_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='rentalbooking',
+            name='core_rental_farmer__ae0dd2_idx',
+        ),
+        migrations.AddIndex(
+            model_name='equipment',
+            index=models.Index(fields=['-created_at', '-id'], name='core_equipm_created_7e8563_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-sent_at', '-id'], name='core_notifi_user_id_fc88ad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read', '-sent_at', '-id'], name='core_notifi_user_id_8a9ce4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rentalbooking',
+            index=models.Index(fields=['farmer', '-created_at', '-id'], name='core_rental_farmer__af98dd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rentalbooking',
+            index=models.Index(fields=['operator', '-created_at', '-id'], name='core_rental_operato_167109_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+"""
+SQLite FTS5 index over Equipment's free-text columns.
+
+An external-content table: the text stays in core_equipment and the index
+is kept in step by triggers, which also catch bulk_create and
+queryset.update(). The update trigger only fires when an indexed column
+changes, so status and GPS updates do not touch the index. Other database
+backends, and SQLite builds without FTS5, skip this and core.fulltext falls
+back to icontains.
+"""
+from django.db import OperationalError, migrations
+
+COLUMNS = ['name', 'brand', 'model', 'description', 'capacity_info']
+
+FORWARD = [
+    f"""CREATE VIRTUAL TABLE core_equipment_fts USING fts5(
+        {', '.join(COLUMNS)},
+        content='core_equipment', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER core_equipment_fts_insert AFTER INSERT ON core_equipment BEGIN
+        INSERT INTO core_equipment_fts(rowid, {', '.join(COLUMNS)})
+        VALUES (new.id, {', '.join(f'new.{c}' for c in COLUMNS)});
+    END""",
+    f"""CREATE TRIGGER core_equipment_fts_delete AFTER DELETE ON core_equipment BEGIN
+        INSERT INTO core_equipment_fts(core_equipment_fts, rowid, {', '.join(COLUMNS)})
+        VALUES ('delete', old.id, {', '.join(f'old.{c}' for c in COLUMNS)});
+    END""",
+    f"""CREATE TRIGGER core_equipment_fts_update AFTER UPDATE OF {', '.join(COLUMNS)} ON core_equipment BEGIN
+        INSERT INTO core_equipment_fts(core_equipment_fts, rowid, {', '.join(COLUMNS)})
+        VALUES ('delete', old.id, {', '.join(f'old.{c}' for c in COLUMNS)});
+        INSERT INTO core_equipment_fts(rowid, {', '.join(COLUMNS)})
+        VALUES (new.id, {', '.join(f'new.{c}' for c in COLUMNS)});
+    END""",
+    "INSERT INTO core_equipment_fts(core_equipment_fts) VALUES ('rebuild')",
+]
+
+BACKWARD = [
+    "DROP TRIGGER IF EXISTS core_equipment_fts_update",
+    "DROP TRIGGER IF EXISTS core_equipment_fts_delete",
+    "DROP TRIGGER IF EXISTS core_equipment_fts_insert",
+    "DROP TABLE IF EXISTS core_equipment_fts",
+]
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        except OperationalError:
+            return  # SQLite built without FTS5
+        cursor.execute("DROP TABLE temp.fts5_probe")
+    for statement in FORWARD:
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in BACKWARD:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_keyset_pagination'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-16 08:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_equipment_fulltext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelemetryFix',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recorded_at', models.DateTimeField()),
+                ('latitude_e6', models.IntegerField()),
+                ('longitude_e6', models.IntegerField()),
+                ('speed_kmh', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('heading', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('accuracy_m', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('booking', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='telemetry_fixes', to='core.rentalbooking')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['booking', 'recorded_at'], name='core_teleme_booking_46c47d_idx')],
+            },
+        ),
+    ]
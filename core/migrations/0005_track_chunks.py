@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-16 08:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_telemetry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField()),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('fix_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_chunks', to='core.rentalbooking')),
+            ],
+            options={
+                'ordering': ['booking', 'seq'],
+                'constraints': [models.UniqueConstraint(fields=('booking', 'seq'), name='unique_track_chunk_seq')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 09:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_track_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackAnalysis',
+            fields=[
+                ('booking', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='track_analysis', serialize=False, to='core.rentalbooking')),
+                ('fix_count', models.PositiveIntegerField(default=0)),
+                ('late_fixes', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('ended_at', models.DateTimeField(blank=True, null=True)),
+                ('engine_seconds', models.FloatField(default=0)),
+                ('moving_seconds', models.FloatField(default=0)),
+                ('distance_km', models.FloatField(default=0)),
+                ('worked_acres', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('state', models.BinaryField(default=b'')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Track Analyses',
+            },
+        ),
+    ]
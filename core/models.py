@@ -1,9 +1,28 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
 from decimal import Decimal
 
+from . import geo
+
+
+class TrackedFieldsMixin:
+    """
+    Keeps the ``tracked_fields`` values an instance was loaded or last saved
+    with in ``_loaded_values``, so save hooks can tell what changed.
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {f: v for f, v in zip(field_names, values) if f in cls.tracked_fields}
+        return instance
+
+    def remember_saved(self):
+        self._loaded_values = {f: getattr(self, f) for f in self.tracked_fields}
+
 
 class User(AbstractUser):
     """Platform user — farmers, operators, and admins."""
@@ -24,7 +43,7 @@ class User(AbstractUser):
         return f"{self.get_full_name()} ({self.role})"
 
 
-class FarmerProfile(models.Model):
+class FarmerProfile(TrackedFieldsMixin, geo.GeohashMixin, models.Model):
     """Profile for smallholder farmers."""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='farmer_profile')
     farm_name = models.CharField(max_length=200, blank=True)
@@ -35,14 +54,18 @@ class FarmerProfile(models.Model):
     village = models.CharField(max_length=100, blank=True)
     gps_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     gps_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     has_smartphone = models.BooleanField(default=True)
     preferred_language = models.CharField(max_length=50, default='English')
 
+    objects = geo.GeoQuerySet.as_manager()
+    tracked_fields = ('county', 'village', 'primary_crop')
+
     def __str__(self):
         return f"Farmer: {self.user.get_full_name()} — {self.county}"
 
 
-class OperatorProfile(models.Model):
+class OperatorProfile(TrackedFieldsMixin, models.Model):
     """Profile for equipment owners/operators."""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='operator_profile')
     business_name = models.CharField(max_length=200, blank=True)
@@ -57,6 +80,8 @@ class OperatorProfile(models.Model):
     total_jobs_completed = models.PositiveIntegerField(default=0)
     is_available = models.BooleanField(default=True)
 
+    tracked_fields = ('county',)
+
     def __str__(self):
         return f"Operator: {self.user.get_full_name()}"
 
@@ -74,7 +99,7 @@ class EquipmentCategory(models.Model):
         verbose_name_plural = 'Equipment Categories'
 
 
-class Equipment(models.Model):
+class Equipment(TrackedFieldsMixin, geo.GeohashMixin, models.Model):
     """Individual machinery/equipment unit listed for rental."""
     class Status(models.TextChoices):
         AVAILABLE = 'available', _('Available')
@@ -111,6 +136,7 @@ class Equipment(models.Model):
     current_county = models.CharField(max_length=100)
     gps_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     gps_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
 
     status = models.CharField(max_length=15, choices=Status.choices, default=Status.AVAILABLE)
     last_serviced = models.DateField(null=True, blank=True)
@@ -119,11 +145,20 @@ class Equipment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = geo.GeoQuerySet.as_manager()
+    # Columns the facet counts and brand and county autocomplete are built from.
+    tracked_fields = ('status', 'category_id', 'fuel_type', 'current_county', 'horsepower',
+                      'price_includes_operator', 'price_includes_fuel', 'brand')
+
     def __str__(self):
         return f"{self.name} ({self.brand}) — {self.owner}"
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['status', 'category', 'current_county']),
+            models.Index(fields=['-created_at', '-id']),
+        ]
 
 
 class EquipmentImage(models.Model):
@@ -138,7 +173,22 @@ class EquipmentImage(models.Model):
         return f"Image for {self.equipment.name}"
 
 
-class ServiceArea(models.Model):
+class EquipmentOccupancy(models.Model):
+    """Packed bitset of the days in one year an equipment unit is booked or being serviced."""
+    equipment = models.ForeignKey(Equipment, on_delete=models.CASCADE, related_name='occupancy')
+    year = models.PositiveSmallIntegerField()
+    days = models.BinaryField(max_length=46, help_text="Bit n is set when day-of-year n (0-based) is busy")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('equipment', 'year')
+        verbose_name_plural = 'Equipment Occupancy'
+
+    def __str__(self):
+        return f"Occupancy of equipment #{self.equipment_id} in {self.year}"
+
+
+class ServiceArea(TrackedFieldsMixin, models.Model):
     """Counties/areas where an operator provides service."""
     operator = models.ForeignKey(OperatorProfile, on_delete=models.CASCADE, related_name='service_areas')
     county = models.CharField(max_length=100)
@@ -148,11 +198,13 @@ class ServiceArea(models.Model):
     class Meta:
         unique_together = ('operator', 'county')
 
+    tracked_fields = ('county',)
+
     def __str__(self):
         return f"{self.operator} serves {self.county}"
 
 
-class RentalBooking(models.Model):
+class RentalBooking(TrackedFieldsMixin, models.Model):
     """A booking/rental request from a farmer."""
     class Status(models.TextChoices):
         PENDING = 'pending', _('Pending Confirmation')
@@ -206,11 +258,19 @@ class RentalBooking(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    tracked_fields = ('status', 'equipment_id', 'requested_start_date', 'requested_end_date',
+                      'farm_location_county', 'crop_type')
+
     def __str__(self):
         return f"Booking #{self.pk} — {self.farmer} rents {self.equipment.name}"
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['equipment', 'status', 'requested_start_date']),
+            models.Index(fields=['farmer', '-created_at', '-id']),
+            models.Index(fields=['operator', '-created_at', '-id']),
+        ]
 
 
 class Payment(models.Model):
@@ -240,6 +300,9 @@ class Payment(models.Model):
     def __str__(self):
         return f"Payment #{self.transaction_id} — KES {self.amount}"
 
+    class Meta:
+        indexes = [models.Index(fields=['booking', 'is_confirmed'])]
+
 
 class OperatorPayout(models.Model):
     """Payout to operator after job completion."""
@@ -266,7 +329,7 @@ class OperatorPayout(models.Model):
         return f"Payout to {self.operator} — {self.net_amount}"
 
 
-class BookingReview(models.Model):
+class BookingReview(TrackedFieldsMixin, models.Model):
     """Two-way review: farmer reviews operator, operator reviews farmer."""
     booking = models.ForeignKey(RentalBooking, on_delete=models.CASCADE, related_name='reviews')
     reviewer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='given_reviews')
@@ -280,11 +343,52 @@ class BookingReview(models.Model):
     class Meta:
         unique_together = ('booking', 'reviewer')
 
+    tracked_fields = ('reviewee_id', 'rating', 'punctuality_rating', 'quality_rating')
+
     def __str__(self):
-        return f"Review by {self.reviewer} for booking #{self.booking.pk}"
+        return f"Review by {self.reviewer} for booking #{self.booking_id}"
+
+    def save(self, *args, **kwargs):
+        # The post_save hook updates the reviewee's RatingSummary; commit both or neither.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+class RatingSummary(models.Model):
+    """Running review totals for a user, kept in step with BookingReview rows."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary')
+    review_count = models.PositiveIntegerField(default=0)
+    rating_total = models.PositiveIntegerField(default=0)
+    punctuality_count = models.PositiveIntegerField(default=0)
+    punctuality_total = models.PositiveIntegerField(default=0)
+    quality_count = models.PositiveIntegerField(default=0)
+    quality_total = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Rating Summaries'
+
+    def __str__(self):
+        return f"Ratings of user #{self.user_id}: {self.average_rating} from {self.review_count}"
+
+    @staticmethod
+    def _mean(total, count):
+        return (Decimal(total) / count).quantize(Decimal('0.01')) if count else Decimal('0.00')
+
+    @property
+    def average_rating(self):
+        return self._mean(self.rating_total, self.review_count)
 
+    @property
+    def average_punctuality(self):
+        return self._mean(self.punctuality_total, self.punctuality_count)
 
-class MaintenanceLog(models.Model):
+    @property
+    def average_quality(self):
+        return self._mean(self.quality_total, self.quality_count)
+
+
+class MaintenanceLog(TrackedFieldsMixin, models.Model):
     """Maintenance records for equipment."""
     equipment = models.ForeignKey(Equipment, on_delete=models.CASCADE, related_name='maintenance_logs')
     service_date = models.DateField()
@@ -296,11 +400,14 @@ class MaintenanceLog(models.Model):
     attachment = models.FileField(upload_to='maintenance_docs/', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    tracked_fields = ('equipment_id', 'service_date')
+
     def __str__(self):
         return f"{self.equipment.name} — {self.service_type} on {self.service_date}"
 
     class Meta:
         ordering = ['-service_date']
+        indexes = [models.Index(fields=['equipment', '-service_date'])]
 
 
 class SupportTicket(models.Model):
@@ -333,13 +440,19 @@ class SupportTicket(models.Model):
         return f"Ticket #{self.pk}: {self.subject}"
 
 
-class Notification(models.Model):
+class Notification(TrackedFieldsMixin, models.Model):
     """In-app and SMS notifications."""
     class Channel(models.TextChoices):
         IN_APP = 'in_app', _('In-App')
         SMS = 'sms', _('SMS')
         PUSH = 'push', _('Push Notification')
 
+    class Delivery(models.TextChoices):
+        QUEUED = 'queued', _('Queued')
+        SENDING = 'sending', _('Sending')
+        SENT = 'sent', _('Sent')
+        FAILED = 'failed', _('Failed')
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
     title = models.CharField(max_length=255)
     message = models.TextField()
@@ -348,8 +461,108 @@ class Notification(models.Model):
     related_booking = models.ForeignKey(RentalBooking, on_delete=models.SET_NULL, null=True, blank=True)
     sent_at = models.DateTimeField(auto_now_add=True)
 
+    # SMS/push outbox; blank for notifications that are only shown in-app
+    delivery_status = models.CharField(max_length=10, choices=Delivery.choices, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    claimed_by = models.CharField(max_length=64, blank=True)
+    last_error = models.CharField(max_length=255, blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    tracked_fields = ('user_id', 'is_read')
+
     def __str__(self):
         return f"[{self.channel}] {self.title} → {self.user}"
 
     class Meta:
-        ordering = ['-sent_at']
\ No newline at end of file
+        ordering = ['-sent_at', '-id']
+        indexes = [
+            models.Index(fields=['user', '-sent_at', '-id']),
+            models.Index(fields=['user', 'is_read', '-sent_at', '-id']),
+            models.Index(fields=['delivery_status', 'next_attempt_at']),
+        ]
+
+
+class UnreadCounter(models.Model):
+    """Number of unread notifications for a user, kept in step with Notification rows."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='unread_counter')
+    unread = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.unread} unread for user #{self.user_id}"
+
+
+class TelemetryFix(models.Model):
+    """
+    One GPS fix pushed by the operator's device during a job. Append-only;
+    coordinates are stored in microdegrees (about 11 cm) as plain integers.
+    """
+    booking = models.ForeignKey(RentalBooking, on_delete=models.CASCADE, related_name='telemetry_fixes',
+                                db_index=False)
+    recorded_at = models.DateTimeField()
+    latitude_e6 = models.IntegerField()
+    longitude_e6 = models.IntegerField()
+    speed_kmh = models.PositiveSmallIntegerField(null=True, blank=True)
+    heading = models.PositiveSmallIntegerField(null=True, blank=True)
+    accuracy_m = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Booking #{self.booking_id} at {self.latitude_e6 / 1e6:.6f},{self.longitude_e6 / 1e6:.6f}"
+
+    class Meta:
+        indexes = [models.Index(fields=['booking', 'recorded_at'])]
+
+
+class TrackChunk(models.Model):
+    """
+    Up to a few thousand of a booking's GPS fixes, delta-encoded into one
+    binary block by ``core.tracks`` once they are settled.
+    """
+    booking = models.ForeignKey(RentalBooking, on_delete=models.CASCADE, related_name='track_chunks')
+    seq = models.PositiveIntegerField()
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    fix_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    def __str__(self):
+        return f"Booking #{self.booking_id} track chunk {self.seq} ({self.fix_count} fixes)"
+
+    class Meta:
+        ordering = ['booking', 'seq']
+        constraints = [models.UniqueConstraint(fields=['booking', 'seq'], name='unique_track_chunk_seq')]
+
+
+class TrackAnalysis(models.Model):
+    """
+    Hours and area worked on a booking as read from its GPS track by
+    ``core.jobs.TrackAnalyzer``, with the analyzer's state so it can carry
+    on as more fixes arrive.
+    """
+    booking = models.OneToOneField(RentalBooking, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='track_analysis')
+    fix_count = models.PositiveIntegerField(default=0)
+    late_fixes = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    ended_at = models.DateTimeField(null=True, blank=True)
+    engine_seconds = models.FloatField(default=0)
+    moving_seconds = models.FloatField(default=0)
+    distance_km = models.FloatField(default=0)
+    worked_acres = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    state = models.BinaryField(default=b'')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Track Analyses'
+
+    def __str__(self):
+        return f"Booking #{self.booking_id}: {self.engine_hours:.2f} h, {self.worked_acres} acres"
+
+    @property
+    def engine_hours(self):
+        return self.engine_seconds / 3600
+
+    @property
+    def moving_hours(self):
+        return self.moving_seconds / 3600
@@ -0,0 +1,227 @@
+"""
+SMS and push delivery through a transactional outbox.
+
+Code that wants to text or push a user calls ``enqueue`` inside its own
+transaction; that only inserts a QUEUED ``Notification`` row, so the request
+never waits on a gateway and a rolled-back booking never sends anything.
+
+``Dispatcher`` workers (run by ``dispatch_notifications``) claim due rows in
+batches with a conditional UPDATE that also sets a lease, so concurrent
+workers never share a row and a crashed worker's rows come back once the
+lease runs out. Claimed rows are coalesced into one message per phone number
+(or user, for push) and handed to the channel's gateway from the
+``NOTIFICATION_GATEWAYS`` setting. Failures are retried with exponential
+backoff and jitter until ``MAX_ATTEMPTS``.
+"""
+import functools
+import logging
+import random
+import threading
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import unread
+from .models import Notification
+
+logger = logging.getLogger('core.notifications')
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 6 * 60 * 60
+LEASE_SECONDS = 120
+
+DEFAULT_GATEWAYS = {
+    Notification.Channel.SMS: {'BACKEND': 'core.notifications.FakeGateway'},
+    Notification.Channel.PUSH: {'BACKEND': 'core.notifications.FakeGateway'},
+}
+
+
+def enqueue(user, title, message, channel=Notification.Channel.SMS, related_booking=None):
+    """Create a notification; SMS and push ones are queued for the dispatcher."""
+    return Notification.objects.create(**_outbox_fields(
+        user=user, title=title, message=message, channel=channel, related_booking=related_booking))
+
+
+def enqueue_many(notifications):
+    """``bulk_create`` unsaved notifications, queueing those that need delivery."""
+    for notification in notifications:
+        for name, value in _outbox_fields(channel=notification.channel).items():
+            setattr(notification, name, value)
+    with transaction.atomic():
+        created = Notification.objects.bulk_create(notifications)
+        unread.notifications_created(created)
+    return created
+
+
+def _outbox_fields(**fields):
+    if fields['channel'] != Notification.Channel.IN_APP:
+        fields.update(delivery_status=Notification.Delivery.QUEUED, next_attempt_at=timezone.now())
+    return fields
+
+
+@dataclass
+class Message:
+    channel: str
+    recipient: str
+    body: str
+    notification_ids: list = field(default_factory=list)
+
+
+class Gateway:
+    """
+    Delivery client for one channel. ``send`` gets a batch of ``Message``s
+    and returns a list of the same length holding ``None`` for each message
+    accepted and an error string for each rejected. Raising fails the batch.
+    """
+
+    def send(self, messages):
+        raise NotImplementedError
+
+
+class FakeGateway(Gateway):
+    """
+    Local stand-in that records messages instead of sending them. The
+    instance lives as long as the worker, so only the last ``keep`` messages
+    are kept; ``delivered`` counts them all.
+    """
+
+    def __init__(self, failure_rate=0.0, seed=None, keep=1000):
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.sent = deque(maxlen=keep)
+        self.delivered = 0
+        self._lock = threading.Lock()
+
+    def send(self, messages):
+        results = []
+        with self._lock:
+            for message in messages:
+                if self.rng.random() < self.failure_rate:
+                    results.append("Simulated gateway failure")
+                    continue
+                self.sent.append(message)
+                self.delivered += 1
+                results.append(None)
+                logger.debug("%s to %s: %s", message.channel, message.recipient, message.body)
+        return results
+
+
+@functools.cache
+def gateway(channel):
+    config = getattr(settings, 'NOTIFICATION_GATEWAYS', DEFAULT_GATEWAYS)[channel]
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+def backoff(attempts, rng=random):
+    """Seconds to wait before retry number ``attempts``: doubling, capped, half jittered."""
+    delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+    return delay / 2 + rng.uniform(0, delay / 2)
+
+
+def coalesce(notifications):
+    """
+    Group claimed notifications into one message per recipient, oldest
+    first. SMS without a phone number comes back in the second list.
+    """
+    messages, undeliverable = {}, []
+    for notification in sorted(notifications, key=lambda n: (n.sent_at, n.pk)):
+        if notification.channel == Notification.Channel.SMS:
+            recipient = notification.user.phone_number.strip()
+            if not recipient:
+                undeliverable.append(notification)
+                continue
+        else:
+            recipient = str(notification.user_id)
+        text = f"{notification.title}: {notification.message}"
+        message = messages.get((notification.channel, recipient))
+        if message is None:
+            messages[notification.channel, recipient] = Message(notification.channel, recipient, text,
+                                                                [notification.pk])
+        else:
+            message.body += f"\n{text}"
+            message.notification_ids.append(notification.pk)
+    return list(messages.values()), undeliverable
+
+
+class Dispatcher:
+    def __init__(self, batch_size=200, lease_seconds=LEASE_SECONDS, rng=None):
+        self.batch_size = batch_size
+        self.lease = timedelta(seconds=lease_seconds)
+        self.rng = rng or random.Random()
+
+    def claim(self):
+        """Lease a batch of due notifications to this worker; returns ``(token, rows)``."""
+        now = timezone.now()
+        due = Notification.objects.filter(
+            delivery_status__in=[Notification.Delivery.QUEUED, Notification.Delivery.SENDING],
+            next_attempt_at__lte=now,
+        )
+        ids = list(due.order_by('next_attempt_at').values_list('pk', flat=True)[:self.batch_size])
+        if not ids:
+            return None, []
+        token = uuid.uuid4().hex
+        # Rows another worker claimed in the meantime no longer match ``due``.
+        due.filter(pk__in=ids).update(
+            delivery_status=Notification.Delivery.SENDING, claimed_by=token,
+            next_attempt_at=now + self.lease, attempts=F('attempts') + 1,
+        )
+        rows = list(Notification.objects.filter(claimed_by=token, delivery_status=Notification.Delivery.SENDING)
+                    .select_related('user').only('channel', 'title', 'message', 'sent_at', 'attempts',
+                                                 'user__phone_number'))
+        return token, rows
+
+    def deliver(self, rows):
+        """Send claimed rows; returns ``{notification_id: error or None}``."""
+        messages, undeliverable = coalesce(rows)
+        results = {row.pk: "User has no phone number" for row in undeliverable}
+        by_channel = {}
+        for message in messages:
+            by_channel.setdefault(message.channel, []).append(message)
+        for channel, batch in by_channel.items():
+            try:
+                errors = gateway(channel).send(batch)
+            except Exception as exc:
+                logger.exception("%s gateway failed for %d messages", channel, len(batch))
+                errors = [f"{type(exc).__name__}: {exc}"] * len(batch)
+            for message, error in zip(batch, errors):
+                for pk in message.notification_ids:
+                    results[pk] = error
+        return results
+
+    def record(self, token, rows, results):
+        now = timezone.now()
+        sent = [pk for pk, error in results.items() if error is None]
+        delivered = Notification.objects.filter(pk__in=sent, claimed_by=token).update(
+            delivery_status=Notification.Delivery.SENT, delivered_at=now, claimed_by='', last_error='')
+        # Each write is conditional on still holding the lease: once it has run out another worker may
+        # have claimed the row, and resetting it would make that worker's delivery look like a retry.
+        retries = 0
+        with transaction.atomic():
+            for row in rows:
+                error = results.get(row.pk)
+                if error is None:
+                    continue
+                if row.attempts >= MAX_ATTEMPTS:
+                    status, next_attempt_at = Notification.Delivery.FAILED, None
+                else:
+                    status = Notification.Delivery.QUEUED
+                    next_attempt_at = now + timedelta(seconds=backoff(row.attempts, self.rng))
+                retries += Notification.objects.filter(pk=row.pk, claimed_by=token).update(
+                    delivery_status=status, next_attempt_at=next_attempt_at, claimed_by='',
+                    last_error=error[:255])
+        return delivered, retries
+
+    def run_once(self):
+        """Claim, send and record one batch; returns the number of notifications handled."""
+        token, rows = self.claim()
+        if rows:
+            self.record(token, rows, self.deliver(rows))
+        return len(rows)
@@ -0,0 +1,198 @@
+"""
+Day-bitmap occupancy store.
+
+Each ``EquipmentOccupancy`` row packs one unit's busy days for a calendar
+year into 46 bytes: bit n is day-of-year n, counting from 0. Busy days come
+from blocking bookings (CONFIRMED, IN_PROGRESS) and ``MaintenanceLog``
+service dates. In memory a bitmap is a plain ``int``, so combining thousands
+of units or scanning for free runs is a handful of bitwise operations rather
+than date-range queries.
+"""
+import calendar
+import functools
+import operator
+from datetime import date, timedelta
+
+from django.db import transaction
+
+from .availability import BLOCKING_STATUSES, _batches
+from .models import EquipmentOccupancy, MaintenanceLog, RentalBooking
+
+BITMAP_BYTES = 46
+
+
+def days_in_year(year):
+    return 366 if calendar.isleap(year) else 365
+
+
+def day_index(day):
+    return day.timetuple().tm_yday - 1
+
+
+def span_mask(start, end, year):
+    """Bits for the days of ``[start, end]`` that fall inside ``year``."""
+    start = max(start, date(year, 1, 1))
+    end = min(end, date(year, 12, 31))
+    if end < start:
+        return 0
+    return ((1 << (day_index(end) - day_index(start) + 1)) - 1) << day_index(start)
+
+
+def year_mask(year):
+    return (1 << days_in_year(year)) - 1
+
+
+def pack(bitmap):
+    return bitmap.to_bytes(BITMAP_BYTES, 'little')
+
+
+def unpack(data):
+    return int.from_bytes(bytes(data), 'little') if data else 0
+
+
+def union(bitmaps):
+    """Days busy for any of the units."""
+    return functools.reduce(operator.or_, bitmaps, 0)
+
+
+def intersection(bitmaps, year):
+    """Days busy for every one of the units."""
+    return functools.reduce(operator.and_, bitmaps, year_mask(year))
+
+
+def free_mask(bitmap, start, end):
+    """Free days of one bitmap within ``[start, end]`` (same calendar year)."""
+    return ~bitmap & span_mask(start, end, start.year)
+
+
+def run_starts(mask, length):
+    """Bits at which a run of ``length`` consecutive set bits begins."""
+    runs = mask
+    covered = 1
+    # Doubling: after each step ``runs`` marks starts of runs ``covered`` long.
+    while covered < length:
+        step = min(covered, length - covered)
+        runs &= runs >> step
+        covered += step
+    return runs
+
+
+def days_from_mask(mask, year):
+    """The dates whose bits are set, in order."""
+    first = date(year, 1, 1)
+    while mask:
+        lowest = mask & -mask
+        yield first + timedelta(days=lowest.bit_length() - 1)
+        mask ^= lowest
+
+
+def units_with_free_run(bitmaps, start, end, length):
+    """
+    ``{equipment_id: first free date}`` for units with ``length`` consecutive
+    free days inside ``[start, end]``. ``bitmaps`` maps equipment id to bitmap.
+    """
+    if start.year != end.year:
+        raise ValueError("Free-run searches must stay within one calendar year")
+    found = {}
+    for equipment_id, bitmap in bitmaps.items():
+        starts = run_starts(free_mask(bitmap, start, end), length)
+        if starts:
+            found[equipment_id] = date(start.year, 1, 1) + timedelta(days=(starts & -starts).bit_length() - 1)
+    return found
+
+
+def load(equipment_ids, year):
+    """``{equipment_id: bitmap}`` for ``year``; units with no row are free."""
+    bitmaps = dict.fromkeys(equipment_ids, 0)
+    for batch in _batches(bitmaps):
+        rows = EquipmentOccupancy.objects.filter(equipment_id__in=batch, year=year).values_list('equipment_id', 'days')
+        for equipment_id, data in rows:
+            bitmaps[equipment_id] = unpack(data)
+    return bitmaps
+
+
+def compute(equipment_ids, years):
+    """Bitmaps rebuilt from bookings and maintenance logs, keyed by (equipment_id, year)."""
+    years = sorted(set(years))
+    first, last = date(years[0], 1, 1), date(years[-1], 12, 31)
+    bitmaps = {(equipment_id, year): 0 for equipment_id in equipment_ids for year in years}
+    bookings = RentalBooking.objects.filter(
+        equipment_id__in=equipment_ids,
+        status__in=BLOCKING_STATUSES,
+        requested_start_date__lte=last,
+        requested_end_date__gte=first,
+    ).values_list('equipment_id', 'requested_start_date', 'requested_end_date')
+    for equipment_id, start, end in bookings:
+        for year in years:
+            bitmaps[equipment_id, year] |= span_mask(start, end, year)
+    services = MaintenanceLog.objects.filter(
+        equipment_id__in=equipment_ids, service_date__range=(first, last),
+    ).values_list('equipment_id', 'service_date')
+    for equipment_id, day in services:
+        bitmaps[equipment_id, day.year] |= 1 << day_index(day)
+    return bitmaps
+
+
+def rebuild(equipment_ids, years):
+    """Recompute and store the bitmaps of the given units and years."""
+    for batch in _batches(equipment_ids):
+        rows = [
+            EquipmentOccupancy(equipment_id=equipment_id, year=year, days=pack(bitmap))
+            for (equipment_id, year), bitmap in compute(batch, years).items()
+        ]
+        EquipmentOccupancy.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['equipment', 'year'], update_fields=['days', 'updated_at'])
+
+
+def mark_busy(equipment_id, start, end):
+    """Set the bits for ``[start, end]``; years never built are rebuilt from source."""
+    with transaction.atomic():
+        for year in range(start.year, end.year + 1):
+            row = EquipmentOccupancy.objects.select_for_update().filter(equipment_id=equipment_id, year=year).first()
+            if row is None:
+                rebuild([equipment_id], [year])
+                continue
+            row.days = pack(unpack(row.days) | span_mask(start, end, year))
+            row.save(update_fields=['days', 'updated_at'])
+
+
+def refresh(equipment_id, start, end):
+    """Rebuild the years covering ``[start, end]``, e.g. after a span stops being busy."""
+    rebuild([equipment_id], range(start.year, end.year + 1))
+
+
+def booking_changed(booking, previous):
+    """
+    Keep bitmaps in step with a saved booking. ``previous`` holds the
+    status, equipment and dates it was loaded with (empty when new).
+    """
+    span = (booking.equipment_id, booking.requested_start_date, booking.requested_end_date)
+    old_span = (previous.get('equipment_id'), previous.get('requested_start_date'),
+                previous.get('requested_end_date'))
+    was_busy = previous.get('status') in BLOCKING_STATUSES
+    is_busy = booking.status in BLOCKING_STATUSES
+    if was_busy and (not is_busy or old_span != span):
+        refresh(*old_span)
+    if is_busy and (not was_busy or old_span != span):
+        mark_busy(*span)
+
+
+def booking_deleted(booking):
+    if booking.status in BLOCKING_STATUSES:
+        refresh(booking.equipment_id, booking.requested_start_date, booking.requested_end_date)
+
+
+def maintenance_changed(log, created, previous):
+    """Keep bitmaps in step with a saved log; ``previous`` holds the unit and day it was loaded with."""
+    old = (previous.get('equipment_id'), previous.get('service_date'))
+    if not created and old != (log.equipment_id, log.service_date):
+        if None in old:
+            # Not loaded from the database: the old day is unknown, so rebuild the one we have.
+            refresh(log.equipment_id, log.service_date, log.service_date)
+            return
+        refresh(old[0], old[1], old[1])
+    mark_busy(log.equipment_id, log.service_date, log.service_date)
+
+
+def maintenance_deleted(log):
+    refresh(log.equipment_id, log.service_date, log.service_date)
@@ -0,0 +1,91 @@
+"""
+Keyset (cursor) pagination.
+
+OFFSET pagination makes the database walk past every earlier row, so page
+500 of a farmer's history costs 500 times page one. A cursor instead
+records the sort key of the last row served and the next page starts from
+there with an index seek::
+
+    created_at <= :t AND (created_at < :t OR id < :id)
+
+The leading ``<=`` keeps the condition usable as an index range; the
+trailing ``id`` breaks ties between rows created in the same instant.
+Cursors are opaque URL-safe strings. Ordering fields must be non-null and
+end with a unique field.
+"""
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+DEFAULT_ORDERING = ('-created_at', '-pk')
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """A cursor that was tampered with or belongs to another listing."""
+
+
+@dataclass
+class CursorPage:
+    items: list
+    next_cursor: str = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class CursorPaginator:
+    def __init__(self, queryset, ordering=DEFAULT_ORDERING, page_size=DEFAULT_PAGE_SIZE):
+        self.queryset = queryset.order_by(*ordering)
+        self.keys = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.fields = [queryset.model._meta.pk if name == 'pk' else queryset.model._meta.get_field(name)
+                       for name, _ in self.keys]
+        self.page_size = page_size
+
+    def encode(self, item):
+        values = [self._dump(getattr(item, name)) for name, _ in self.keys]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except (binascii.Error, ValueError) as exc:
+            raise InvalidCursor("Malformed cursor") from exc
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            raise InvalidCursor("Cursor does not match this listing")
+        try:
+            return [field.to_python(value) for field, value in zip(self.fields, values)]
+        except (TypeError, ValueError, ValidationError) as exc:
+            raise InvalidCursor("Malformed cursor") from exc
+
+    @staticmethod
+    def _dump(value):
+        return value.isoformat() if hasattr(value, 'isoformat') else value
+
+    def after(self, values):
+        """Q for rows that sort strictly after ``values``."""
+        condition = None
+        for (name, descending), value in reversed(list(zip(self.keys, values))):
+            strict = Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+            if condition is None:
+                condition = strict
+            else:
+                condition = Q(**{f"{name}__{'lte' if descending else 'gte'}": value}) & (strict | condition)
+        return condition
+
+    def page(self, cursor=None, page_size=None):
+        size = max(1, min(page_size or self.page_size, MAX_PAGE_SIZE))
+        queryset = self.queryset
+        if cursor:
+            queryset = queryset.filter(self.after(self.decode(cursor)))
+        items = list(queryset[:size + 1])
+        if len(items) <= size:
+            return CursorPage(items)
+        items = items[:size]
+        return CursorPage(items, self.encode(items[-1]))
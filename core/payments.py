@@ -0,0 +1,295 @@
+"""
+Mobile-money callback ingestion.
+
+Gateways (M-Pesa, Airtel Money) retry callbacks until acknowledged and
+bursts during harvest contain many duplicates. Callbacks are normalised to
+``{transaction_id, booking, amount, method, payment_type, paid_at}`` and
+applied in batches: duplicates are dropped by ``Payment.transaction_id``'s
+unique constraint via ``INSERT ... ON CONFLICT DO NOTHING`` instead of an
+exception per row, and each affected booking's ``payment_status`` is
+recomputed from its confirmed payments, which makes re-delivery harmless.
+
+``CallbackBatcher`` adds group commit on top: concurrent requests hand
+their callbacks to whichever thread is currently flushing, so one
+transaction covers many requests, and every request is acknowledged only
+once its callbacks are committed.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, Q, Sum, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Payment, RentalBooking
+from .pricing import money
+
+logger = logging.getLogger('core.payments')
+
+ACCEPTED = 'accepted'
+DUPLICATE = 'duplicate'
+REJECTED = 'rejected'
+
+_amount = Payment._meta.get_field('amount')
+MAX_AMOUNT = Decimal(10) ** (_amount.max_digits - _amount.decimal_places)
+
+
+class InvalidCallback(ValueError):
+    """A callback payload is missing fields or has unusable values."""
+
+
+def parse_callback(data):
+    """Validate one normalised callback dict."""
+    if not isinstance(data, dict):
+        raise InvalidCallback("Callback must be an object")
+    try:
+        transaction_id = str(data['transaction_id']).strip()
+        booking = int(data['booking'])
+        amount = Decimal(str(data['amount']))
+    except (KeyError, TypeError, ValueError, InvalidOperation) as exc:
+        raise InvalidCallback(f"Missing or invalid field: {exc}") from exc
+    if not transaction_id or len(transaction_id) > 200:
+        raise InvalidCallback("Invalid transaction_id")
+    if not amount.is_finite() or abs(amount) >= MAX_AMOUNT:
+        raise InvalidCallback(f"Amount must be a number below {MAX_AMOUNT}")
+    amount = money(amount)
+    if amount <= 0:
+        raise InvalidCallback("Amount must be positive")
+    method = data.get('method', Payment.Method.MPESA)
+    if method not in Payment.Method.values:
+        raise InvalidCallback(f"Unknown method {method!r}")
+    payment_type = data.get('payment_type', Payment.Type.DEPOSIT)
+    if payment_type not in Payment.Type.values:
+        raise InvalidCallback(f"Unknown payment_type {payment_type!r}")
+    paid_at = None
+    if data.get('paid_at'):
+        try:
+            paid_at = parse_datetime(data['paid_at'])
+        except (TypeError, ValueError) as exc:
+            raise InvalidCallback(f"Invalid paid_at: {exc}") from exc
+        if paid_at is None:
+            raise InvalidCallback(f"Invalid paid_at {data['paid_at']!r}")
+        if timezone.is_naive(paid_at):
+            paid_at = timezone.make_aware(paid_at)
+    return {
+        'transaction_id': transaction_id,
+        'booking': booking,
+        'amount': amount,
+        'method': method,
+        'payment_type': payment_type,
+        'paid_at': paid_at,
+    }
+
+
+def payment_status_for(booking_total, deposit, paid, refunded):
+    status = RentalBooking.PaymentStatus
+    if refunded and paid - refunded <= 0:
+        return status.REFUNDED
+    paid -= refunded
+    if paid >= booking_total > 0:
+        return status.FULLY_PAID
+    if paid > 0 and paid >= min(deposit, booking_total):
+        return status.DEPOSIT_PAID
+    return status.UNPAID
+
+
+def refresh_payment_status(booking_ids):
+    """
+    Recompute ``payment_status`` for bookings from their confirmed payments.
+    Each write is conditional on the status it was computed from, so a
+    concurrent refresh that got there first is not overwritten with an
+    older reading of the ledger. Moves ``transitions.PAYMENT_EDGES`` does
+    not allow are logged and left for staff.
+    """
+    # Imported here: transitions builds on this module.
+    from . import transitions
+    money_field = DecimalField(max_digits=14, decimal_places=2)
+    refund = Q(payment_type=Payment.Type.REFUND)
+    totals = {
+        row['booking_id']: row
+        for row in Payment.objects.filter(booking_id__in=booking_ids, is_confirmed=True)
+        .order_by().values('booking_id')
+        .annotate(
+            paid=Sum(Case(When(~refund, then='amount'), default=Value(0), output_field=money_field)),
+            refunded=Sum(Case(When(refund, then='amount'), default=Value(0), output_field=money_field)),
+        )
+    }
+    changes = {}
+    bookings = RentalBooking.objects.filter(pk__in=booking_ids).values_list(
+        'pk', 'total_amount', 'deposit_amount', 'payment_status')
+    for pk, total, deposit, current in bookings:
+        row = totals.get(pk, {})
+        new = payment_status_for(total, deposit, money(row.get('paid') or 0), money(row.get('refunded') or 0))
+        if new == current:
+            continue
+        if not transitions.payment_edge_allowed(current, new):
+            logger.warning("Booking #%s: ledger says %s but payment status %s is final", pk, new, current)
+            continue
+        changes.setdefault((current, new), []).append(pk)
+    now = timezone.now()
+    for (current, new), pks in changes.items():
+        RentalBooking.objects.filter(pk__in=pks, payment_status=current).update(payment_status=new, updated_at=now)
+
+
+def request_refund(booking_id):
+    """
+    Queue a refund of everything confirmed as paid for a booking, net of
+    earlier refunds, as an unconfirmed REFUND payment sent back the way the
+    last payment came. Its gateway callback confirms it like any payment we
+    initiated, and ``payment_status`` then becomes REFUNDED. Returns the
+    payment, or ``None`` when nothing is owed or a refund is already queued.
+    """
+    confirmed = Payment.objects.filter(booking_id=booking_id, is_confirmed=True)
+    refund = Q(payment_type=Payment.Type.REFUND)
+    paid = confirmed.filter(~refund).aggregate(total=Sum('amount'))['total'] or 0
+    refunded = confirmed.filter(refund).aggregate(total=Sum('amount'))['total'] or 0
+    owed = money(paid - refunded)
+    transaction_id = f'refund-{booking_id}'
+    if owed <= 0 or Payment.objects.filter(transaction_id=transaction_id).exists():
+        return None
+    method = confirmed.filter(~refund).order_by('-paid_at', '-pk').values_list('method', flat=True).first()
+    return Payment.objects.create(booking_id=booking_id, amount=owed, method=method, transaction_id=transaction_id,
+                                  payment_type=Payment.Type.REFUND, notes="Booking cancelled")
+
+
+def apply_callbacks(callbacks):
+    """
+    Record a batch of parsed callbacks in one transaction. Returns
+    ``{transaction_id: ACCEPTED | DUPLICATE | REJECTED}``.
+    """
+    outcome = {}
+    unique = {}
+    for callback in callbacks:
+        unique.setdefault(callback['transaction_id'], callback)
+    if not unique:
+        return outcome
+
+    now = timezone.now()
+    with transaction.atomic():
+        known_bookings = set(RentalBooking.objects.filter(
+            pk__in={c['booking'] for c in unique.values()}).values_list('pk', flat=True))
+        already_confirmed = set(Payment.objects.filter(
+            transaction_id__in=unique, is_confirmed=True).values_list('transaction_id', flat=True))
+        rows = []
+        for transaction_id, callback in unique.items():
+            if callback['booking'] not in known_bookings:
+                outcome[transaction_id] = REJECTED
+            elif transaction_id in already_confirmed:
+                outcome[transaction_id] = DUPLICATE
+            else:
+                outcome[transaction_id] = ACCEPTED
+                rows.append(Payment(
+                    booking_id=callback['booking'], amount=callback['amount'], method=callback['method'],
+                    payment_type=callback['payment_type'], transaction_id=transaction_id,
+                    is_confirmed=True, paid_at=callback['paid_at'] or now,
+                ))
+        if rows:
+            Payment.objects.bulk_create(rows, ignore_conflicts=True)
+            # Payments initiated by us (e.g. an STK push) already exist unconfirmed; the callback is
+            # what the gateway actually took, so it overrides what was recorded when it was initiated.
+            affected = {row.booking_id for row in rows}
+            pending = list(Payment.objects.select_for_update().filter(
+                transaction_id__in=[row.transaction_id for row in rows], is_confirmed=False))
+            for payment in pending:
+                callback = unique[payment.transaction_id]
+                affected.add(payment.booking_id)
+                payment.booking_id = callback['booking']
+                payment.amount = callback['amount']
+                payment.method = callback['method']
+                payment.payment_type = callback['payment_type']
+                payment.is_confirmed = True
+                payment.paid_at = callback['paid_at'] or now
+            Payment.objects.bulk_update(
+                pending, ['booking', 'amount', 'method', 'payment_type', 'is_confirmed', 'paid_at'])
+            refresh_payment_status(affected)
+    return outcome
+
+
+@dataclass
+class _Submission:
+    callbacks: list
+    done: threading.Event
+    outcome: dict = None
+    error: BaseException = None
+
+
+class CallbackBatcher:
+    """
+    Group commit for callback requests. The first thread to arrive becomes
+    the flusher: if other requests are in flight it waits ``max_wait``
+    seconds for them to queue, then applies everything queued in batches of
+    up to ``max_batch`` callbacks until the queue is empty. Other threads
+    just wait for their batch to commit. A lone request is applied at once.
+    """
+
+    def __init__(self, max_batch=1000, max_wait=0.005):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._queue = []
+        self._flushing = False
+        self._in_flight = 0
+
+    def submit(self, callbacks):
+        submission = _Submission(list(callbacks), threading.Event())
+        with self._lock:
+            self._queue.append(submission)
+            self._in_flight += 1
+            lead = not self._flushing
+            self._flushing = True
+        try:
+            if lead:
+                self._flush()
+            submission.done.wait()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        if submission.error is not None:
+            raise submission.error
+        return submission.outcome
+
+    def _take(self):
+        with self._lock:
+            batch, size = [], 0
+            while self._queue and (not batch or size + len(self._queue[0].callbacks) <= self.max_batch):
+                submission = self._queue.pop(0)
+                batch.append(submission)
+                size += len(submission.callbacks)
+            if not batch:
+                self._flushing = False
+            return batch
+
+    def _flush(self):
+        with self._lock:
+            company = self._in_flight > 1
+        if company:
+            time.sleep(self.max_wait)
+        while batch := self._take():
+            try:
+                outcome = apply_callbacks([c for s in batch for c in s.callbacks])
+            except Exception as exc:
+                for submission in batch:
+                    submission.error = exc
+                    submission.done.set()
+                continue
+            for submission in batch:
+                submission.outcome = {c['transaction_id']: outcome[c['transaction_id']] for c in submission.callbacks}
+                submission.done.set()
+
+
+batcher = CallbackBatcher()
+
+
+def summarise(outcome, callbacks):
+    """Per-request counts, counting in-request repeats as duplicates."""
+    counts = {ACCEPTED: 0, DUPLICATE: 0, REJECTED: 0}
+    seen = set()
+    for callback in callbacks:
+        transaction_id = callback['transaction_id']
+        counts[DUPLICATE if transaction_id in seen else outcome[transaction_id]] += 1
+        seen.add(transaction_id)
+    return counts
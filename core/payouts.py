@@ -0,0 +1,187 @@
+"""
+Operator payout runs.
+
+A run settles every COMPLETED, FULLY_PAID booking that has no payout yet.
+It works in two restartable phases, both tagged with the run's reference
+(stored in ``OperatorPayout.payout_reference``):
+
+1. ``create_payouts`` walks eligible bookings in primary-key batches and
+   inserts PENDING payouts with ``bulk_create``. Each batch commits on its
+   own, and ``OperatorPayout.booking`` is unique, so a run interrupted
+   half-way simply carries on from the bookings that are still unpaid.
+2. ``settle`` moves the run's PENDING payouts to PROCESSING and streams
+   exactly those, ordered by payee account, into a CSV with one line per
+   account. The caller keeps the transaction open until the file is safely
+   on disk, so a payout is PROCESSING if and only if it is in the file:
+   ``withdraw()`` cannot delete one that was already written, and a failed
+   write leaves the run PENDING for the next attempt.
+
+Operators without a mobile-money number or bank account are left out until
+they add one, so nothing is created that cannot be paid.
+"""
+import csv
+import itertools
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OperatorPayout, RentalBooking
+from .pricing import money
+
+PLATFORM_FEE_PERCENT = Decimal('10.00')
+MOBILE_MONEY = 'mpesa'
+BANK = 'bank'
+
+SETTLEMENT_COLUMNS = ['payout_method', 'account', 'payee', 'payouts', 'gross_amount', 'platform_fee_amount',
+                      'net_amount', 'reference']
+
+
+def new_reference(now=None):
+    return (now or timezone.now()).strftime('PO-%Y%m%d-%H%M%S')
+
+
+def fee_split(gross, fee_percent=PLATFORM_FEE_PERCENT):
+    """``(platform_fee_amount, net_amount)`` for a gross amount."""
+    fee = money(gross * fee_percent / 100)
+    return fee, gross - fee
+
+
+def eligible_bookings():
+    return RentalBooking.objects.filter(
+        status=RentalBooking.Status.COMPLETED,
+        payment_status=RentalBooking.PaymentStatus.FULLY_PAID,
+        payout__isnull=True,
+    )
+
+
+def _payable(bookings):
+    return bookings.filter(~Q(operator__mobile_money_number='') | ~Q(operator__bank_account=''))
+
+
+@dataclass
+class RunStats:
+    batches: int = 0
+    created: int = 0
+    held: int = 0
+
+
+def create_payouts(reference, batch_size=2000, fee_percent=PLATFORM_FEE_PERCENT):
+    """Insert PENDING payouts for every payable booking, one batch per transaction."""
+    stats = RunStats()
+    bookings = _payable(eligible_bookings()).order_by('pk').values_list(
+        'pk', 'operator_id', 'total_amount', 'operator__mobile_money_number')
+    last_pk = 0
+    while batch := list(bookings.filter(pk__gt=last_pk)[:batch_size]):
+        last_pk = batch[-1][0]
+        payouts = []
+        for pk, operator_id, gross, mobile_money_number in batch:
+            fee, net = fee_split(gross, fee_percent)
+            payouts.append(OperatorPayout(
+                operator_id=operator_id, booking_id=pk, gross_amount=gross, platform_fee_percent=fee_percent,
+                platform_fee_amount=fee, net_amount=net, payout_reference=reference,
+                payout_method=MOBILE_MONEY if mobile_money_number else BANK,
+            ))
+        with transaction.atomic():
+            # Rows another run got to first are skipped rather than failing the batch, so count
+            # what this run actually inserted.
+            OperatorPayout.objects.bulk_create(payouts, ignore_conflicts=True)
+            stats.created += OperatorPayout.objects.filter(
+                payout_reference=reference, booking_id__in=[row[0] for row in batch]).count()
+        stats.batches += 1
+    stats.held = eligible_bookings().count()
+    return stats
+
+
+def pending_payouts(reference):
+    return OperatorPayout.objects.filter(payout_reference=reference, status=OperatorPayout.Status.PENDING)
+
+
+def unfinished_runs():
+    return list(
+        OperatorPayout.objects.filter(status=OperatorPayout.Status.PENDING).exclude(payout_reference='')
+        .order_by('payout_reference').values_list('payout_reference', flat=True).distinct()
+    )
+
+
+def settlement_lines(reference, initiated_at, chunk_size=2000):
+    """
+    Yield one dict per payee account, totalling the run's payouts handed to
+    settlement at ``initiated_at``. Rows are streamed in account order, so
+    memory stays flat however large the run is.
+    """
+    rows = OperatorPayout.objects.filter(
+        payout_reference=reference, status=OperatorPayout.Status.PROCESSING, initiated_at=initiated_at,
+    ).order_by(
+        'operator__mobile_money_number', 'operator__bank_account', 'operator_id',
+    ).values_list(
+        'operator__mobile_money_number', 'operator__bank_account', 'operator__business_name',
+        'operator__user__first_name', 'operator__user__last_name',
+        'gross_amount', 'platform_fee_amount', 'net_amount',
+    ).iterator(chunk_size=chunk_size)
+
+    def account(row):
+        # Pay to the operator's current details, preferring mobile money.
+        mobile_money_number, bank_account = row[:2]
+        return (MOBILE_MONEY, mobile_money_number) if mobile_money_number else (BANK, bank_account)
+
+    for (method, number), group in itertools.groupby(rows, key=account):
+        first = next(group)
+        business_name, first_name, last_name = first[2:5]
+        count, gross, fee, net = 1, *first[5:]
+        for row in group:
+            count += 1
+            gross += row[5]
+            fee += row[6]
+            net += row[7]
+        yield {
+            'payout_method': method,
+            'account': number,
+            'payee': business_name or f"{first_name} {last_name}".strip(),
+            'payouts': count,
+            'gross_amount': gross,
+            'platform_fee_amount': fee,
+            'net_amount': net,
+            'reference': reference,
+        }
+
+
+def write_settlement(reference, initiated_at, stream):
+    """Write a settlement CSV to ``stream``; returns ``(accounts, net total)``."""
+    writer = csv.DictWriter(stream, fieldnames=SETTLEMENT_COLUMNS)
+    writer.writeheader()
+    accounts, total = 0, Decimal('0.00')
+    for line in settlement_lines(reference, initiated_at):
+        writer.writerow(line)
+        accounts += 1
+        total += line['net_amount']
+    return accounts, total
+
+
+def mark_processing(reference, initiated_at):
+    """Hand the run's PENDING payouts over to settlement."""
+    return pending_payouts(reference).update(status=OperatorPayout.Status.PROCESSING, initiated_at=initiated_at)
+
+
+def settle(reference, stream):
+    """
+    Hand the run's PENDING payouts over to settlement and write exactly
+    those to ``stream``; returns ``(payouts, accounts, net total)``. Call it
+    inside a transaction that commits only once the file is durable: the
+    update locks the rows, so ``withdraw()`` waits until then and finds
+    them PROCESSING.
+    """
+    initiated_at = timezone.now()
+    with transaction.atomic():
+        count = mark_processing(reference, initiated_at)
+        return (count, *write_settlement(reference, initiated_at, stream))
+
+
+def withdraw(booking_id):
+    """
+    Cancel a booking's payout that no run has handed to settlement yet, e.g.
+    because the job is disputed; it is eligible again once COMPLETED.
+    """
+    return OperatorPayout.objects.filter(booking_id=booking_id, status=OperatorPayout.Status.PENDING).delete()[0]
@@ -0,0 +1,134 @@
+"""
+Rental quotes.
+
+A quote prices one equipment unit for a job: the rental (whole days at the
+daily rate, or estimated hours at the hourly rate when that is cheaper),
+plus the owner's ``ServiceArea`` transport charge for the farm county, plus
+the deposit due to confirm. All arithmetic is Decimal.
+
+Quotes are memoised in the cache per (equipment, county, rental days, land
+size) under a per-operator pricing version. Saving equipment or service
+areas moves the operator to a new version, which orphans every cached quote
+built from the old rates without having to find and delete them.
+"""
+import hashlib
+import time
+from decimal import ROUND_HALF_UP, Decimal
+from typing import NamedTuple
+
+from django.core.cache import cache
+
+from .models import ServiceArea
+
+CENT = Decimal('0.01')
+HOURS_PER_ACRE = Decimal('1.5')
+DEPOSIT_PERCENT = Decimal('30')
+QUOTE_TIMEOUT = 60 * 60
+
+
+class Quote(NamedTuple):
+    basis: str                  # 'daily' or 'hourly'
+    quoted_rate: Decimal
+    rental_days: int
+    estimated_hours: Decimal
+    transport_fee: Decimal
+    total_amount: Decimal
+    deposit_amount: Decimal
+
+
+def money(value):
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def rental_days(start, end):
+    """Number of billable days in an inclusive date span."""
+    if end < start:
+        raise ValueError(f"End date {end} is before start date {start}")
+    return (end - start).days + 1
+
+
+def _version_key(operator_id):
+    return f'pricing-version:{operator_id}'
+
+
+def invalidate_operator(operator_id):
+    """Retire every cached quote for the operator's equipment."""
+    cache.set(_version_key(operator_id), time.time_ns(), None)
+
+
+def _operator_versions(operator_ids):
+    keys = {_version_key(pk): pk for pk in operator_ids}
+    found = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def compute_quote(equipment, transport_fee, days, acres=None):
+    """Price one unit given its transport fee; no database or cache access."""
+    transport_fee = money(transport_fee or 0)
+    estimated_hours = money(Decimal(acres) * HOURS_PER_ACRE) if acres else Decimal('0.00')
+    basis, rate, rental = 'daily', equipment.daily_rate, equipment.daily_rate * days
+    if equipment.hourly_rate and estimated_hours:
+        hourly = equipment.hourly_rate * estimated_hours
+        if hourly < rental:
+            basis, rate, rental = 'hourly', equipment.hourly_rate, hourly
+    total = money(rental + transport_fee)
+    return Quote(
+        basis=basis,
+        quoted_rate=money(rate),
+        rental_days=days,
+        estimated_hours=estimated_hours,
+        transport_fee=transport_fee,
+        total_amount=total,
+        deposit_amount=money(total * DEPOSIT_PERCENT / 100),
+    )
+
+
+def quote_many(equipment_list, county, start, end, acres=None):
+    """
+    Quotes for a page of equipment, in the same order.
+
+    Costs at most one cache round trip for versions, one for quotes and, on
+    misses, one ``ServiceArea`` query for the whole page. Units annotated
+    with ``transport_fee`` (as search results are) skip the query entirely.
+    """
+    days = rental_days(start, end)
+    acres = Decimal(acres) if acres else None
+    versions = _operator_versions({equipment.owner_id for equipment in equipment_list})
+    job = hashlib.md5(f'{county}|{days}|{acres or 0}'.encode()).hexdigest()
+    keys = [f'quote:{versions[e.owner_id]}:{e.pk}:{job}' for e in equipment_list]
+    cached = cache.get_many(keys)
+    misses = [(key, e) for key, e in zip(keys, equipment_list) if key not in cached]
+    if misses:
+        unannotated = {e.owner_id for _, e in misses if not hasattr(e, 'transport_fee')}
+        charges = dict(
+            ServiceArea.objects.filter(operator_id__in=unannotated, county=county)
+            .values_list('operator_id', 'additional_charge')
+        ) if unannotated else {}
+        fresh = {
+            key: compute_quote(e, getattr(e, 'transport_fee', charges.get(e.owner_id)), days, acres)
+            for key, e in misses
+        }
+        cache.set_many({key: tuple(quote) for key, quote in fresh.items()}, QUOTE_TIMEOUT)
+        cached.update(fresh)
+    return [Quote(*cached[key]) for key in keys]
+
+
+def quote(equipment, county, start, end, acres=None):
+    return quote_many([equipment], county, start, end, acres)[0]
+
+
+def apply_quote(booking):
+    """Fill a booking's pricing fields from a fresh quote for its job."""
+    result = quote(booking.equipment, booking.farm_location_county, booking.requested_start_date,
+                   booking.requested_end_date, booking.land_size_acres)
+    booking.quoted_rate = result.quoted_rate
+    booking.transport_fee = result.transport_fee
+    booking.total_amount = result.total_amount
+    booking.deposit_amount = result.deposit_amount
+    if result.basis == 'hourly' and booking.estimated_hours is None:
+        booking.estimated_hours = result.estimated_hours
+    return result
@@ -0,0 +1,172 @@
+"""
+Operator and farmer reputation: review aggregates and completed-job counts.
+
+Each review adds to (or, when deleted, subtracts from) its reviewee's
+``RatingSummary`` with a single ``UPDATE ... SET total = total + n``, so a
+busy operator's average never needs an AVG over all their reviews. The row
+lock taken by that update also serialises the follow-up refresh of
+``OperatorProfile.average_rating``. A review's save and its summary update
+share one transaction, as a delete and its post_delete hooks already do.
+``reconcile()`` recomputes everything from source in batches and reports
+drift.
+"""
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import BookingReview, OperatorProfile, RatingSummary, RentalBooking, User
+
+SUMMARY_FIELDS = ['review_count', 'rating_total', 'punctuality_count', 'punctuality_total',
+                  'quality_count', 'quality_total']
+
+
+def _deltas(rating, punctuality, quality, sign):
+    deltas = {'review_count': sign, 'rating_total': sign * rating}
+    for value, name in ((punctuality, 'punctuality'), (quality, 'quality')):
+        if value is not None:
+            deltas[f'{name}_count'] = sign
+            deltas[f'{name}_total'] = sign * value
+    return deltas
+
+
+def _apply(user_id, deltas):
+    if not any(deltas.values()):
+        return
+    with transaction.atomic():
+        RatingSummary.objects.bulk_create([RatingSummary(user_id=user_id)], ignore_conflicts=True)
+        RatingSummary.objects.filter(user_id=user_id).update(
+            **{name: F(name) + delta for name, delta in deltas.items() if delta})
+        summary = RatingSummary.objects.get(user_id=user_id)
+        OperatorProfile.objects.filter(user_id=user_id).update(average_rating=summary.average_rating)
+
+
+def _recompute(user_id):
+    with transaction.atomic():
+        summary = _truth([user_id]).get(user_id) or RatingSummary()
+        summary.user_id = user_id
+        RatingSummary.objects.bulk_create([summary], update_conflicts=True, unique_fields=['user'],
+                                          update_fields=SUMMARY_FIELDS)
+        OperatorProfile.objects.filter(user_id=user_id).update(average_rating=summary.average_rating)
+
+
+def review_saved(review, created, previous):
+    """
+    Fold a created or edited review into its reviewee's summary. An edit of
+    an instance that was never loaded has no old values to take back out,
+    so the reviewee's summary is recomputed from their reviews instead.
+    """
+    if not created and not previous:
+        _recompute(review.reviewee_id)
+        return
+    old = {}
+    if not created:
+        old = _deltas(previous['rating'], previous.get('punctuality_rating'), previous.get('quality_rating'), -1)
+        if previous.get('reviewee_id') != review.reviewee_id:
+            _apply(previous['reviewee_id'], old)
+            old = {}
+    new = _deltas(review.rating, review.punctuality_rating, review.quality_rating, 1)
+    merged = {name: new.get(name, 0) + old.get(name, 0) for name in {*new, *old}}
+    _apply(review.reviewee_id, merged)
+
+
+def review_deleted(review):
+    _apply(review.reviewee_id,
+           _deltas(review.rating, review.punctuality_rating, review.quality_rating, -1))
+
+
+def booking_changed(booking, previous):
+    """Count jobs into or out of ``OperatorProfile.total_jobs_completed``."""
+    completed = RentalBooking.Status.COMPLETED
+    was_done = previous.get('status') == completed
+    is_done = booking.status == completed
+    if was_done != is_done:
+        OperatorProfile.objects.filter(pk=booking.operator_id).update(
+            total_jobs_completed=F('total_jobs_completed') + (1 if is_done else -1))
+
+
+def booking_deleted(booking):
+    if booking.status == RentalBooking.Status.COMPLETED:
+        OperatorProfile.objects.filter(pk=booking.operator_id).update(
+            total_jobs_completed=F('total_jobs_completed') - 1)
+
+
+@dataclass
+class Drift:
+    summaries_checked: int = 0
+    summaries_drifted: int = 0
+    operators_checked: int = 0
+    operators_drifted: int = 0
+    examples: list = field(default_factory=list)
+
+
+def _truth(user_ids):
+    totals = (
+        BookingReview.objects.filter(reviewee_id__in=user_ids)
+        .order_by().values('reviewee_id')
+        .annotate(
+            review_count=Count('id'), rating_total=Sum('rating'),
+            punctuality_count=Count('punctuality_rating'), punctuality_total=Sum('punctuality_rating'),
+            quality_count=Count('quality_rating'), quality_total=Sum('quality_rating'),
+        )
+    )
+    return {
+        row.pop('reviewee_id'): RatingSummary(**{name: value or 0 for name, value in row.items()})
+        for row in totals
+    }
+
+
+def reconcile(batch_size=1000, fix=True, max_examples=20):
+    """
+    Recompute rating summaries, operator averages and completed-job counts
+    from source, one batch of users at a time, and report what had drifted.
+    """
+    drift = Drift()
+    fields = SUMMARY_FIELDS
+    last_pk = 0
+    while user_ids := list(User.objects.filter(pk__gt=last_pk).order_by('pk')
+                           .values_list('pk', flat=True)[:batch_size]):
+        last_pk = user_ids[-1]
+        truth = _truth(user_ids)
+        stored = RatingSummary.objects.in_bulk(user_ids)
+        fixes = []
+        for user_id in user_ids:
+            expected = truth.get(user_id) or RatingSummary()
+            expected.user_id = user_id
+            current = stored.get(user_id)
+            if current is None and not expected.review_count:
+                continue
+            drift.summaries_checked += 1
+            if current is None or any(getattr(current, f) != getattr(expected, f) for f in fields):
+                drift.summaries_drifted += 1
+                if len(drift.examples) < max_examples:
+                    drift.examples.append(f"user #{user_id}: stored "
+                                          f"{current and current.review_count}/{current and current.rating_total}, "
+                                          f"actual {expected.review_count}/{expected.rating_total}")
+                fixes.append(expected)
+
+        operators = OperatorProfile.objects.filter(user_id__in=user_ids).values_list(
+            'pk', 'user_id', 'average_rating', 'total_jobs_completed')
+        completed = dict(
+            RentalBooking.objects.filter(operator__user_id__in=user_ids, status=RentalBooking.Status.COMPLETED)
+            .order_by().values_list('operator_id').annotate(n=Count('id'))
+        )
+        operator_fixes = []
+        for pk, user_id, average, jobs in operators:
+            drift.operators_checked += 1
+            summary = truth.get(user_id) or RatingSummary()
+            expected = OperatorProfile(pk=pk, average_rating=summary.average_rating,
+                                       total_jobs_completed=completed.get(pk, 0))
+            if (average, jobs) != (expected.average_rating, expected.total_jobs_completed):
+                drift.operators_drifted += 1
+                if len(drift.examples) < max_examples:
+                    drift.examples.append(f"operator #{pk}: stored {average}/{jobs} jobs, "
+                                          f"actual {expected.average_rating}/{expected.total_jobs_completed} jobs")
+                operator_fixes.append(expected)
+
+        if fix:
+            with transaction.atomic():
+                RatingSummary.objects.bulk_create(
+                    fixes, update_conflicts=True, unique_fields=['user'], update_fields=fields)
+                OperatorProfile.objects.bulk_update(operator_fixes, ['average_rating', 'total_jobs_completed'])
+    return drift
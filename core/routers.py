@@ -0,0 +1,119 @@
+"""
+Primary/replica routing.
+
+With a ``replica`` database configured (see ``REPLICA_DATABASE_NAME`` in the
+settings), discovery reads — equipment, categories, images, service areas,
+profiles and reviews — go to the replica. Bookings, payments, payouts and
+everything else stay on the primary, as do all writes.
+
+A replica lags the primary, so anything that has just written must not read
+from it. Reads are pinned to the primary:
+
+* inside a transaction on the primary,
+* for the rest of a request once it has written anything, and
+* for ``REPLICA_PIN_SECONDS`` afterwards, via a cookie set by
+  ``PrimaryPinningMiddleware``, so the page after "book now" shows the booking.
+
+``use_primary()`` pins a block explicitly; ``analytics_alias()`` is the
+alias reporting code should read from with ``.using()``.
+
+Outside a request nothing resets the pin: a management command, worker
+loop or thread that writes reads from the primary for the rest of its
+context. That errs towards fresh reads. A long-running loop that wants the
+replica back should run each unit of work in ``unpinned()``. New threads
+start unpinned, because they do not inherit context variables.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_ALIAS = 'replica'
+ROUTER = 'core.routers.PrimaryReplicaRouter'
+PIN_COOKIE = 'db_primary'
+
+REPLICA_MODELS = {
+    'core.equipment', 'core.equipmentcategory', 'core.equipmentimage', 'core.servicearea',
+    'core.operatorprofile', 'core.farmerprofile', 'core.bookingreview', 'core.ratingsummary',
+}
+
+_pinned = ContextVar('db_pinned', default=False)
+_wrote = ContextVar('db_wrote', default=False)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES and ROUTER in settings.DATABASE_ROUTERS
+
+
+def analytics_alias():
+    return REPLICA_ALIAS if replica_configured() else DEFAULT_DB_ALIAS
+
+
+def pin_to_primary():
+    """Send the rest of this request's (or task's) reads to the primary."""
+    _pinned.set(True)
+
+
+@contextmanager
+def use_primary():
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+@contextmanager
+def unpinned():
+    """Scope the pin to a block, the way the middleware scopes it to a request."""
+    pinned, wrote = _pinned.set(False), _wrote.set(False)
+    try:
+        yield
+    finally:
+        _pinned.reset(pinned)
+        _wrote.reset(wrote)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower not in REPLICA_MODELS or _pinned.get():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        _pinned.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows, so objects from either may relate.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_ALIAS
+
+
+class PrimaryPinningMiddleware:
+    """
+    Scope the primary pin to a request, and carry it over to the same
+    client's next requests for ``REPLICA_PIN_SECONDS`` after a write.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+    def __call__(self, request):
+        pinned = _pinned.set(PIN_COOKIE in request.COOKIES)
+        wrote = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get():
+                response.set_cookie(PIN_COOKIE, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        finally:
+            _pinned.reset(pinned)
+            _wrote.reset(wrote)
+        return response
@@ -0,0 +1,77 @@
+"""
+Equipment discovery: "what can I rent for this job, where and when".
+
+Everything a result page needs — category filter, county coverage through
+``ServiceArea``, the availability check against blocking bookings and the
+total price — is folded into one SQL statement, so the database plans the
+whole search instead of the application issuing one availability query per
+unit.
+"""
+from decimal import Decimal
+
+from django.db.models import DecimalField, Exists, ExpressionWrapper, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .availability import BLOCKING_STATUSES
+from .models import Equipment, RentalBooking, ServiceArea
+from .pricing import quote_many, rental_days
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def available_equipment(start, end, category=None, county=None):
+    """
+    Queryset of equipment free for the whole of ``[start, end]``, cheapest
+    total first.
+
+    ``category`` may be an ``EquipmentCategory`` or its pk. With ``county``,
+    only units located in it or whose owner serves it are returned, and the
+    owner's ``ServiceArea.additional_charge`` for it is used as transport
+    fee. Rows are annotated with ``rental_days``, ``transport_fee`` and
+    ``estimated_total``; SQLite does the arithmetic in floating point, so
+    use the annotations for ranking and ``search_available_equipment()`` for
+    exact quotes.
+    """
+    days = rental_days(start, end)
+    equipment = Equipment.objects.filter(status=Equipment.Status.AVAILABLE)
+    if category is not None:
+        equipment = equipment.filter(category=category)
+
+    transport_fee = Value(Decimal('0.00'), output_field=MONEY)
+    if county:
+        service_area = ServiceArea.objects.filter(operator=OuterRef('owner'), county=county)
+        equipment = equipment.filter(Q(current_county=county) | Exists(service_area))
+        transport_fee = Coalesce(Subquery(service_area.values('additional_charge')[:1]), transport_fee,
+                                 output_field=MONEY)
+
+    clashes = RentalBooking.objects.filter(
+        equipment=OuterRef('pk'),
+        status__in=BLOCKING_STATUSES,
+        requested_start_date__lte=end,
+        requested_end_date__gte=start,
+    )
+    return (
+        equipment
+        .exclude(Exists(clashes))
+        .annotate(
+            rental_days=Value(days),
+            transport_fee=transport_fee,
+            estimated_total=ExpressionWrapper(F('daily_rate') * days + F('transport_fee'), output_field=MONEY),
+        )
+        .select_related('category', 'owner__user')
+        .order_by('estimated_total', '-owner__average_rating', 'pk')
+    )
+
+
+def search_available_equipment(start, end, category=None, county=None, acres=None, limit=20, offset=0):
+    """
+    One page of ``available_equipment()`` as a list, fetched in a single
+    query and priced in one batch: each unit carries its ``quote`` and the
+    quote's exact ``total_price``. Ranking is by the daily-rate estimate, so
+    with ``acres`` an hourly quote can come in below its neighbours'.
+    """
+    page = list(available_equipment(start, end, category, county)[offset:offset + limit])
+    for equipment, quote in zip(page, quote_many(page, county, start, end, acres)):
+        equipment.quote = quote
+        equipment.total_price = quote.total_amount
+    return page
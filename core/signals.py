@@ -0,0 +1,113 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import autocomplete, facets, live, occupancy, pricing, reputation, unread
+from .models import (
+    BookingReview, Equipment, FarmerProfile, MaintenanceLog, Notification, OperatorProfile, RentalBooking,
+    ServiceArea,
+)
+
+
+@receiver(post_save, sender=RentalBooking)
+def booking_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_loaded_values', {})
+    occupancy.booking_changed(instance, previous)
+    reputation.booking_changed(instance, previous)
+    live.booking_changed(instance, previous)
+    autocomplete.row_saved(instance, created, previous)
+    instance.remember_saved()
+
+
+@receiver(post_delete, sender=RentalBooking)
+def booking_deleted(sender, instance, **kwargs):
+    occupancy.booking_deleted(instance)
+    reputation.booking_deleted(instance)
+
+
+@receiver(post_save, sender=BookingReview)
+def review_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_loaded_values', {})
+    reputation.review_saved(instance, created, previous)
+    instance.remember_saved()
+
+
+@receiver(post_delete, sender=BookingReview)
+def review_deleted(sender, instance, **kwargs):
+    reputation.review_deleted(instance)
+
+
+@receiver(post_save, sender=Notification)
+def notification_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_loaded_values', {})
+    unread.notification_saved(instance, created, previous)
+    instance.remember_saved()
+
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    unread.notification_deleted(instance)
+
+
+@receiver(post_save, sender=MaintenanceLog)
+def maintenance_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    occupancy.maintenance_changed(instance, created, getattr(instance, '_loaded_values', {}))
+    instance.remember_saved()
+
+
+@receiver(post_delete, sender=MaintenanceLog)
+def maintenance_deleted(sender, instance, **kwargs):
+    occupancy.maintenance_deleted(instance)
+
+
+@receiver(post_save, sender=Equipment)
+def equipment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_loaded_values', {})
+    facets.equipment_saved(instance, created, previous)
+    autocomplete.row_saved(instance, created, previous)
+    instance.remember_saved()
+
+
+@receiver(post_delete, sender=Equipment)
+def equipment_deleted(sender, instance, **kwargs):
+    facets.equipment_deleted(instance)
+
+
+@receiver(post_save, sender=Equipment)
+@receiver(post_delete, sender=Equipment)
+def equipment_pricing_changed(sender, instance, **kwargs):
+    pricing.invalidate_operator(instance.owner_id)
+
+
+@receiver(post_save, sender=ServiceArea)
+@receiver(post_delete, sender=ServiceArea)
+def service_area_changed(sender, instance, **kwargs):
+    pricing.invalidate_operator(instance.operator_id)
+
+
+@receiver(post_save, sender=FarmerProfile)
+@receiver(post_save, sender=OperatorProfile)
+@receiver(post_save, sender=ServiceArea)
+def autocomplete_row_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    autocomplete.row_saved(instance, created, getattr(instance, '_loaded_values', {}))
+    instance.remember_saved()
+
+
+@receiver(post_delete, sender=FarmerProfile)
+@receiver(post_delete, sender=OperatorProfile)
+@receiver(post_delete, sender=Equipment)
+@receiver(post_delete, sender=ServiceArea)
+@receiver(post_delete, sender=RentalBooking)
+def autocomplete_row_deleted(sender, instance, **kwargs):
+    autocomplete.row_deleted(instance)
@@ -0,0 +1,321 @@
+"""
+Live GPS telemetry from operators' devices during jobs.
+
+A device opens a WebSocket to ``WEBSOCKET_PATH`` with the signed token from
+``device_token()`` (served to the booking's operator by the
+``booking-telemetry-token`` view) and sends fixes as JSON text frames,
+one object or a list of them::
+
+    {"lat": -0.303099, "lon": 36.080026, "t": 1718000000.5, "speed": 12, "heading": 270, "accuracy": 8}
+
+Only ``lat`` and ``lon`` are required; ``t`` (Unix seconds) defaults to the
+arrival time. Connections stay on the event loop and do no database work
+after the handshake: fixes go into the process-wide ``Ingestor``'s buffer,
+which a background task inserts with one ``executemany`` every
+``TELEMETRY_FLUSH_SECONDS`` (or sooner once ``FLUSH_SIZE`` are waiting).
+Each flush also moves ``Equipment.gps_latitude``/``gps_longitude`` to the
+latest fix of units last moved at least ``TELEMETRY_POSITION_SECONDS``
+ago, in one ``bulk_update``, and tells devices whose booking is no longer
+in progress to disconnect. The newest fix of each message is published
+straight away to the booking's ``core.live`` channel for farmers watching,
+and each flush is fed to the bookings' ``core.jobs`` analyzers, which keep
+their hours and worked area up to date.
+
+If the database falls behind, at most ``TELEMETRY_MAX_BUFFERED`` fixes are
+held and newer ones are dropped and counted rather than exhausting memory.
+"""
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db import close_old_connections, connections, router, transaction
+
+from . import geo, jobs, live
+from .models import Equipment, RentalBooking, TelemetryFix
+
+logger = logging.getLogger('core.telemetry')
+
+WEBSOCKET_PATH = '/ws/telemetry/'
+TOKEN_SALT = 'core.telemetry'
+FLUSH_SIZE = 20000
+MAX_FIXES_PER_MESSAGE = 500
+MIN_FIX_INTERVAL_SECONDS = 0.5
+MAX_CLOCK_SKEW_SECONDS = 60
+MAX_FIX_AGE_SECONDS = 24 * 60 * 60
+SMALLINT_MAX = 32767
+FIX_COLUMNS = ('booking_id', 'recorded_at', 'latitude_e6', 'longitude_e6', 'speed_kmh', 'heading', 'accuracy_m')
+
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_NOT_IN_PROGRESS = 4403
+CLOSE_BOOKING_ENDED = 4410
+
+
+def device_token(booking):
+    return signing.dumps({'booking': booking.pk}, salt=TOKEN_SALT, compress=True)
+
+
+def read_token(token):
+    """The booking id in ``token``; raises ``signing.BadSignature`` if it is forged or expired."""
+    max_age = getattr(settings, 'TELEMETRY_TOKEN_MAX_AGE', 12 * 60 * 60)
+    return signing.loads(token, salt=TOKEN_SALT, max_age=max_age)['booking']
+
+
+def _small(value):
+    return None if value is None else max(0, min(SMALLINT_MAX, round(float(value))))
+
+
+def parse_fixes(text, now=None):
+    """``[(t, latitude_e6, longitude_e6, speed_kmh, heading, accuracy_m)]`` from one frame."""
+    now = time.time() if now is None else now
+    try:
+        data = json.loads(text)
+    except ValueError as exc:
+        raise ValueError(f"Invalid JSON: {exc}") from None
+    items = data if isinstance(data, list) else [data]
+    if len(items) > MAX_FIXES_PER_MESSAGE:
+        raise ValueError(f"At most {MAX_FIXES_PER_MESSAGE} fixes per message")
+    fixes = []
+    for item in items:
+        try:
+            lat, lon = float(item['lat']), float(item['lon'])
+            t = float(item.get('t', now))
+            fix = (t, round(lat * 1e6), round(lon * 1e6), _small(item.get('speed')),
+                   _small(item.get('heading')), _small(item.get('accuracy')))
+        except (KeyError, TypeError, ValueError, OverflowError, AttributeError):
+            raise ValueError("Each fix needs numeric 'lat' and 'lon'") from None
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180) or math.isnan(t):
+            raise ValueError(f"Fix out of range: {lat}, {lon}")
+        if not now - MAX_FIX_AGE_SECONDS <= t <= now + MAX_CLOCK_SKEW_SECONDS:
+            raise ValueError(f"Fix time {t} is too far from the server clock")
+        fixes.append(fix)
+    return fixes
+
+
+def _degrees(e6):
+    return Decimal(e6).scaleb(-6)
+
+
+def _insert_fixes(batch):
+    # One executemany of plain tuples: bulk_create would build and prepare a
+    # model instance per fix, which costs more than the insert itself.
+    connection = connections[router.db_for_write(TelemetryFix)]
+    adapt = connection.ops.adapt_datetimefield_value
+    quote = connection.ops.quote_name
+    sql = (f"INSERT INTO {quote(TelemetryFix._meta.db_table)} ({', '.join(map(quote, FIX_COLUMNS))}) "
+           f"VALUES ({', '.join(['%s'] * len(FIX_COLUMNS))})")
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            (booking_id, adapt(datetime.fromtimestamp(t, dt_timezone.utc)), *rest)
+            for booking_id, t, *rest in batch
+        ])
+
+
+def write(batch, positions, analyses=None):
+    """
+    Store ``batch`` of ``(booking_id, *fix)`` tuples and move equipment to
+    ``positions`` (``{equipment_id: (t, latitude_e6, longitude_e6)}``), then
+    feed the fixes to ``analyses``, a ``jobs.LiveAnalyses``.
+    Returns the ids of bookings in the batch that are no longer in progress.
+    """
+    close_old_connections()
+    units = [
+        Equipment(pk=pk, gps_latitude=_degrees(lat), gps_longitude=_degrees(lon),
+                  geohash=geo.encode(lat / 1e6, lon / 1e6))
+        for pk, (_, lat, lon) in positions.items()
+    ]
+    with transaction.atomic():
+        _insert_fixes(batch)
+        Equipment.objects.bulk_update(units, ['gps_latitude', 'gps_longitude', 'geohash'], batch_size=500)
+    bookings = {fix[0] for fix in batch}
+    ended = set(RentalBooking.objects.filter(pk__in=bookings).exclude(status=RentalBooking.Status.IN_PROGRESS)
+                .values_list('pk', flat=True))
+    if analyses is not None:
+        try:
+            analyses.feed(batch)
+            analyses.save(ended)
+        except Exception:
+            # The fixes are stored, so analyze_tracks can still work the job out from them.
+            logger.exception("Analysing %d telemetry fixes failed", len(batch))
+    return ended
+
+
+class Ingestor:
+    """Buffers fixes from every connection in the process and writes them in batches."""
+
+    def __init__(self, flush_seconds=None, position_seconds=None, max_buffered=None):
+        self.flush_seconds = flush_seconds or getattr(settings, 'TELEMETRY_FLUSH_SECONDS', 1.0)
+        self.position_seconds = position_seconds or getattr(settings, 'TELEMETRY_POSITION_SECONDS', 30)
+        self.max_buffered = max_buffered or getattr(settings, 'TELEMETRY_MAX_BUFFERED', 200000)
+        self.buffer = []
+        self.latest = {}
+        self.moved_at = {}
+        self.ended = set()
+        self.analyses = jobs.LiveAnalyses()
+        self.stats = Counter()
+        self._task = None
+        self._wake = None
+        self._lock = None
+        self._stopping = False
+
+    def add(self, booking_id, equipment_id, fixes):
+        self.stats['received'] += len(fixes)
+        room = max(0, self.max_buffered - len(self.buffer))
+        if len(fixes) > room:
+            self.stats['dropped'] += len(fixes) - room
+            fixes = fixes[:room]
+        if not fixes:
+            return
+        self.buffer.extend((booking_id, *fix) for fix in fixes)
+        newest = max(fixes)
+        if newest[0] > self.latest.get(equipment_id, (-math.inf,))[0]:
+            self.latest[equipment_id] = newest[:3]
+        live.broker().publish(live.channel(booking_id), live.POSITION, live.position_payload(*newest))
+        if len(self.buffer) >= FLUSH_SIZE and self._wake is not None:
+            self._wake.set()
+
+    def start(self):
+        """Start the flush loop on the running event loop, if it is not running already."""
+        if self._task is None or self._task.done():
+            self._wake, self._lock, self._stopping = asyncio.Event(), asyncio.Lock(), False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock or asyncio.Lock():
+            now = time.monotonic()
+            due = {pk: position for pk, position in self.latest.items()
+                   if now - self.moved_at.get(pk, -math.inf) >= self.position_seconds}
+            if not self.buffer and not due:
+                return
+            batch, self.buffer = self.buffer, []
+            for pk in due:
+                del self.latest[pk]
+            start = time.perf_counter()
+            try:
+                self.ended = await sync_to_async(write)(batch, due, self.analyses)
+            except Exception:
+                logger.exception("Telemetry flush of %d fixes failed; retrying", len(batch))
+                self.stats['failed_flushes'] += 1
+                self.buffer[:0] = batch[:max(0, self.max_buffered - len(self.buffer))]
+                for pk, position in due.items():
+                    self.latest.setdefault(pk, position)
+                return
+            self.moved_at.update(dict.fromkeys(due, now))
+            self.stats['written'] += len(batch)
+            self.stats['positions'] += len(due)
+            self.stats['flushes'] += 1
+            self.stats['flush_ms'] = round((time.perf_counter() - start) * 1000)
+
+    async def stop(self):
+        """Let the flush loop finish its current write, then write what is left."""
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        await sync_to_async(self.analyses.save)(everything=True)
+
+
+ingestor = Ingestor()
+
+
+def equipment_in_progress(booking_ids):
+    """``{booking_id: equipment_id}`` for those of ``booking_ids`` that are in progress."""
+    close_old_connections()
+    return dict(RentalBooking.objects.filter(pk__in=booking_ids, status=RentalBooking.Status.IN_PROGRESS)
+                .values_list('pk', 'equipment_id'))
+
+
+class BookingLookups:
+    """
+    Checks handshakes' bookings together: every connection that arrives
+    while a query is running waits for the next one, so a reconnect storm
+    costs a handful of queries rather than one each.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self._task = None
+
+    async def equipment_for(self, booking_id):
+        future = self.pending.get(booking_id)
+        if future is None:
+            future = self.pending[booking_id] = asyncio.get_running_loop().create_future()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._resolve())
+        return await asyncio.shield(future)
+
+    async def _resolve(self):
+        await asyncio.sleep(0)
+        while self.pending:
+            pending, self.pending = self.pending, {}
+            try:
+                found = await sync_to_async(equipment_in_progress)(list(pending))
+            except Exception as exc:
+                for future in pending.values():
+                    future.set_exception(exc)
+                continue
+            for booking_id, future in pending.items():
+                future.set_result(found.get(booking_id))
+
+
+lookups = BookingLookups()
+
+
+async def device_socket(scope, receive, send):
+    """ASGI WebSocket endpoint for one device reporting one booking."""
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token', [''])[0]
+    try:
+        booking_id = read_token(token)
+    except signing.BadSignature:
+        return await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+    equipment_id = await lookups.equipment_for(booking_id)
+    if equipment_id is None:
+        return await send({'type': 'websocket.close', 'code': CLOSE_NOT_IN_PROGRESS})
+    await send({'type': 'websocket.accept'})
+    ingestor.start()
+    last = -math.inf
+    while True:
+        event = await receive()
+        if event['type'] == 'websocket.disconnect':
+            return
+        if event['type'] != 'websocket.receive':
+            continue
+        if booking_id in ingestor.ended:
+            return await send({'type': 'websocket.close', 'code': CLOSE_BOOKING_ENDED})
+        try:
+            fixes = parse_fixes(event.get('text') or (event.get('bytes') or b'').decode())
+        except ValueError as exc:
+            await send({'type': 'websocket.send', 'text': json.dumps({'error': str(exc)})})
+            continue
+        kept = []
+        for fix in sorted(fixes):
+            if fix[0] >= last + MIN_FIX_INTERVAL_SECONDS:
+                kept.append(fix)
+                last = fix[0]
+        ingestor.add(booking_id, equipment_id, kept)
+
+
+async def shutdown():
+    """Write whatever is still buffered; run when the ASGI server stops."""
+    await ingestor.stop()
@@ -1,3 +1,1581 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import (
+    autocomplete, availability, facets, fulltext, geo, jobs, live, middleware, notifications, occupancy, payments,
+    payouts, pricing, reputation, routers, search, telemetry, tracks, transitions, unread,
+)
+from .pagination import CursorPaginator, InvalidCursor
+from .models import (
+    BookingReview, Equipment, EquipmentCategory, FarmerProfile, MaintenanceLog, Notification, OperatorPayout,
+    OperatorProfile, Payment, RatingSummary, RentalBooking, ServiceArea, TelemetryFix, TrackAnalysis, TrackChunk, User,
+)
+
+# "SCAN core_x" reads the whole table; "SCAN core_x USING INDEX" walks a whole index.
+FULL_SCAN = re.compile(r'\bSCAN (core_\w+)')
+
+
+class GeoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='operator', phone_number='+254700000010', role=User.Role.OPERATOR)
+        operator = OperatorProfile.objects.create(user=user, county='Nakuru')
+        category = EquipmentCategory.objects.create(name='Tractor')
+
+        def unit(n, lat, lon):
+            return Equipment.objects.create(owner=operator, category=category, name=f'Unit {n}', daily_rate=1000,
+                                            current_county='Nakuru', serial_number=f'SN-G{n}',
+                                            gps_latitude=lat, gps_longitude=lon)
+        cls.here = unit(1, Decimal('-0.303100'), Decimal('36.080000'))
+        cls.near = unit(2, Decimal('-0.348100'), Decimal('36.080000'))
+        cls.far = unit(3, Decimal('-0.483100'), Decimal('36.080000'))
+        cls.nowhere = unit(4, None, None)
+
+    def test_encode(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744), 'u4pruydqq')
+        self.assertEqual(geo.encode(57.64911, 10.40744, precision=5), 'u4pru')
+        self.assertLess(abs(geo.haversine_km(-0.3031, 36.08, -0.3481, 36.08) - 5.0), 0.05)
+
+    def test_geohash_follows_coordinates(self):
+        self.assertEqual(self.here.geohash, geo.encode(self.here.gps_latitude, self.here.gps_longitude))
+        self.assertEqual(self.nowhere.geohash, '')
+        self.nowhere.gps_latitude, self.nowhere.gps_longitude = self.near.gps_latitude, self.near.gps_longitude
+        self.nowhere.save(update_fields=['gps_latitude', 'gps_longitude'])
+        self.assertEqual(Equipment.objects.get(pk=self.nowhere.pk).geohash, self.near.geohash)
+
+    def test_radius_queries(self):
+        candidates = set(Equipment.objects.within_radius(-0.3031, 36.08, 10).values_list('pk', flat=True))
+        self.assertLessEqual({self.here.pk, self.near.pk}, candidates)
+        self.assertNotIn(self.nowhere.pk, candidates)
+        nearest = Equipment.objects.nearest(-0.3031, 36.08, 10)
+        self.assertEqual([unit.pk for unit in nearest], [self.here.pk, self.near.pk])
+        self.assertAlmostEqual(nearest[1].distance_km, 5.0, delta=0.05)
+        self.assertEqual([unit.pk for unit in Equipment.objects.nearest(-0.3031, 36.08, 30, limit=1)],
+                         [self.here.pk])
+        self.assertEqual(len(Equipment.objects.nearest(-0.3031, 36.08, 30)), 3)
+
+
+class AvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='operator', phone_number='+254700000011', role=User.Role.OPERATOR)
+        cls.operator = OperatorProfile.objects.create(user=user, county='Nakuru')
+        cls.farmer = FarmerProfile.objects.create(
+            user=User.objects.create(username='farmer', phone_number='+254700000012'), county='Nakuru')
+        cls.equipment = Equipment.objects.create(
+            owner=cls.operator, category=EquipmentCategory.objects.create(name='Tractor'), name='Tractor',
+            daily_rate=1000, current_county='Nakuru', serial_number='SN-A1')
+        cls.day = timezone.localdate() + timedelta(days=30)
+
+    def booking(self, start, end, status=RentalBooking.Status.PENDING):
+        return RentalBooking.objects.create(
+            farmer=self.farmer, equipment=self.equipment, operator=self.operator, job_description='Ploughing',
+            land_size_acres=2, farm_location_county='Nakuru', requested_start_date=self.day + timedelta(days=start),
+            requested_end_date=self.day + timedelta(days=end), quoted_rate=1000, status=status)
+
+    def free(self, start, end):
+        return availability.is_available(self.equipment.pk, self.day + timedelta(days=start),
+                                         self.day + timedelta(days=end))
+
+    def test_calendar(self):
+        day = self.day
+        calendar = availability.AvailabilityCalendar([(day, day + timedelta(days=2))])
+        calendar.add(day + timedelta(days=3), day + timedelta(days=4))
+        calendar.add(day + timedelta(days=8), day + timedelta(days=8))
+        self.assertEqual(list(calendar), [(day, day + timedelta(days=4)), (day + timedelta(days=8),) * 2])
+        self.assertFalse(calendar.is_free(day + timedelta(days=4), day + timedelta(days=6)))
+        self.assertTrue(calendar.is_free(day + timedelta(days=5), day + timedelta(days=7)))
+        self.assertEqual(list(calendar.free_windows(day - timedelta(days=1), day + timedelta(days=9))), [
+            (day - timedelta(days=1),) * 2, (day + timedelta(days=5), day + timedelta(days=7)),
+            (day + timedelta(days=9),) * 2])
+        with self.assertRaises(ValueError):
+            calendar.is_free(day, day - timedelta(days=1))
+
+    def test_overlap_edges(self):
+        self.booking(0, 2, RentalBooking.Status.CONFIRMED)
+        self.booking(10, 12, RentalBooking.Status.CANCELLED_FARMER)
+        self.booking(20, 21)
+        self.assertFalse(self.free(2, 3))
+        self.assertFalse(self.free(-3, 0))
+        self.assertFalse(self.free(-5, 5))
+        self.assertTrue(self.free(3, 5))
+        self.assertTrue(self.free(-3, -1))
+        self.assertTrue(self.free(10, 12))
+        self.assertTrue(self.free(20, 21))
+        self.assertEqual(availability.find_available([self.equipment.pk], self.day, self.day), [])
+
+    def test_reserve(self):
+        first, clash, after = self.booking(0, 2), self.booking(2, 4), self.booking(3, 4)
+        availability.reserve(first)
+        with self.assertRaises(availability.BookingConflict):
+            availability.reserve(clash)
+        availability.reserve(after)
+        self.assertEqual(dict(RentalBooking.objects.values_list('pk', 'status')), {
+            first.pk: RentalBooking.Status.CONFIRMED, clash.pk: RentalBooking.Status.PENDING,
+            after.pk: RentalBooking.Status.CONFIRMED})
+        with self.assertRaises(availability.BookingConflict):
+            availability.reserve(first)
+
+
+class EquipmentSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        def operator(n, county):
+            user = User.objects.create(username=f'operator{n}', phone_number=f'+2547000002{n:02}',
+                                       role=User.Role.OPERATOR)
+            return OperatorProfile.objects.create(user=user, county=county)
+        local, travelling = operator(1, 'Nakuru'), operator(2, 'Meru')
+        ServiceArea.objects.create(operator=travelling, county='Nakuru', additional_charge=500)
+        cls.tractors = EquipmentCategory.objects.create(name='Tractor')
+        planters = EquipmentCategory.objects.create(name='Planter')
+
+        def unit(n, owner, rate, county, category=None, **extra):
+            return Equipment.objects.create(owner=owner, category=category or cls.tractors, name=f'Unit {n}',
+                                            daily_rate=rate, current_county=county, serial_number=f'SN-S{n}',
+                                            **extra)
+        cls.cheap = unit(1, local, 1000, 'Nakuru')
+        cls.visiting = unit(2, travelling, 800, 'Meru')
+        cls.booked = unit(3, local, 500, 'Nakuru')
+        unit(4, local, 100, 'Nakuru', category=planters)
+        unit(5, local, 100, 'Nakuru', status=Equipment.Status.MAINTENANCE)
+        unit(6, operator(3, 'Turkana'), 100, 'Turkana')
+        cls.start = timezone.localdate() + timedelta(days=10)
+        farmer = FarmerProfile.objects.create(
+            user=User.objects.create(username='farmer', phone_number='+254700000213'), county='Nakuru')
+        RentalBooking.objects.create(
+            farmer=farmer, equipment=cls.booked, operator=local, job_description='Ploughing', land_size_acres=2,
+            farm_location_county='Nakuru', requested_start_date=cls.start + timedelta(days=1),
+            requested_end_date=cls.start + timedelta(days=5), quoted_rate=500, status=RentalBooking.Status.CONFIRMED)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_filters_and_ranking(self):
+        end = self.start + timedelta(days=1)
+        results = list(search.available_equipment(self.start, end, self.tractors, 'Nakuru'))
+        self.assertEqual([(unit.pk, unit.estimated_total) for unit in results],
+                         [(self.cheap.pk, 2000), (self.visiting.pk, 2100)])
+        later = search.available_equipment(self.start + timedelta(days=6), end + timedelta(days=6),
+                                           self.tractors.pk, 'Nakuru')
+        self.assertEqual([unit.pk for unit in later], [self.booked.pk, self.cheap.pk, self.visiting.pk])
+
+    def test_priced_page_is_one_query(self):
+        end = self.start + timedelta(days=1)
+        with self.assertNumQueries(1):
+            page = search.search_available_equipment(self.start, end, self.tractors, 'Nakuru')
+        self.assertEqual([unit.total_price for unit in page], [Decimal('2000.00'), Decimal('2100.00')])
+        self.assertEqual(page[1].quote.transport_fee, Decimal('500.00'))
+
+
+class OccupancyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='operator', phone_number='+254700000013', role=User.Role.OPERATOR)
+        cls.operator = OperatorProfile.objects.create(user=user, county='Nakuru')
+        cls.farmer = FarmerProfile.objects.create(
+            user=User.objects.create(username='farmer', phone_number='+254700000014'), county='Nakuru')
+        category = EquipmentCategory.objects.create(name='Tractor')
+        cls.equipment, cls.other = [
+            Equipment.objects.create(owner=cls.operator, category=category, name=f'Tractor {n}', daily_rate=1000,
+                                     current_county='Nakuru', serial_number=f'SN-O{n}') for n in (1, 2)]
+        cls.year = timezone.localdate().year + 1
+
+    def day(self, month, day):
+        return date(self.year, month, day)
+
+    def busy_days(self, equipment=None):
+        bitmap = occupancy.load([(equipment or self.equipment).pk], self.year)[(equipment or self.equipment).pk]
+        return list(occupancy.days_from_mask(bitmap, self.year))
+
+    def assertMatchesSource(self):
+        stored = {(e, self.year): occupancy.load([e], self.year)[e] for e in (self.equipment.pk, self.other.pk)}
+        self.assertEqual(stored, occupancy.compute([self.equipment.pk, self.other.pk], [self.year]))
+
+    def test_bit_operations(self):
+        year = self.year
+        self.assertEqual(occupancy.span_mask(date(year - 1, 12, 30), date(year, 1, 2), year), 0b11)
+        self.assertEqual(occupancy.span_mask(date(year, 3, 1), date(year, 2, 1), year), 0)
+        bitmap = occupancy.span_mask(date(year, 1, 3), date(year, 1, 4), year)
+        self.assertEqual(occupancy.unpack(occupancy.pack(bitmap)), bitmap)
+        self.assertEqual(occupancy.run_starts(0b0111011, 3), 0b0001000)
+        found = occupancy.units_with_free_run({1: bitmap, 2: 0}, date(year, 1, 1), date(year, 1, 10), 3)
+        self.assertEqual(found, {1: date(year, 1, 5), 2: date(year, 1, 1)})
+        with self.assertRaises(ValueError):
+            occupancy.units_with_free_run({}, date(year, 12, 30), date(year + 1, 1, 2), 2)
+
+    def test_bookings_keep_bitmaps_in_step(self):
+        booking = RentalBooking.objects.create(
+            farmer=self.farmer, equipment=self.equipment, operator=self.operator, job_description='Ploughing',
+            land_size_acres=2, farm_location_county='Nakuru', requested_start_date=self.day(3, 1),
+            requested_end_date=self.day(3, 2), quoted_rate=1000)
+        self.assertEqual(self.busy_days(), [])
+        availability.reserve(booking)
+        self.assertEqual(self.busy_days(), [self.day(3, 1), self.day(3, 2)])
+
+        booking = RentalBooking.objects.get(pk=booking.pk)
+        booking.requested_start_date, booking.requested_end_date = self.day(4, 1), self.day(4, 1)
+        booking.save()
+        self.assertEqual(self.busy_days(), [self.day(4, 1)])
+        booking.equipment = self.other
+        booking.save()
+        self.assertEqual((self.busy_days(), self.busy_days(self.other)), ([], [self.day(4, 1)]))
+        booking.status = RentalBooking.Status.CANCELLED_OPERATOR
+        booking.save()
+        self.assertEqual(self.busy_days(self.other), [])
+        self.assertMatchesSource()
+
+    def test_maintenance_keeps_bitmaps_in_step(self):
+        log = MaintenanceLog.objects.create(equipment=self.equipment, service_date=self.day(5, 1),
+                                            service_type='Oil change', description='Routine')
+        self.assertEqual(self.busy_days(), [self.day(5, 1)])
+        log = MaintenanceLog.objects.get(pk=log.pk)
+        log.service_date = self.day(5, 9)
+        log.save()
+        self.assertEqual(self.busy_days(), [self.day(5, 9)])
+        log.equipment = self.other
+        log.save()
+        self.assertEqual((self.busy_days(), self.busy_days(self.other)), ([], [self.day(5, 9)]))
+        self.assertMatchesSource()
+        log.delete()
+        self.assertEqual(self.busy_days(self.other), [])
+
+
+class PricingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='operator', phone_number='+254700000015', role=User.Role.OPERATOR)
+        cls.operator = OperatorProfile.objects.create(user=user, county='Nakuru')
+        cls.area = ServiceArea.objects.create(operator=cls.operator, county='Meru', additional_charge=300)
+        cls.equipment = Equipment.objects.create(
+            owner=cls.operator, category=EquipmentCategory.objects.create(name='Tractor'), name='Tractor',
+            daily_rate=1000, hourly_rate=200, current_county='Nakuru', serial_number='SN-P1')
+        cls.start = timezone.localdate() + timedelta(days=10)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_daily_or_hourly_whichever_is_cheaper(self):
+        end = self.start + timedelta(days=1)
+        daily = pricing.quote(self.equipment, 'Meru', self.start, end)
+        self.assertEqual((daily.basis, daily.total_amount, daily.deposit_amount),
+                         ('daily', Decimal('2300.00'), Decimal('690.00')))
+        hourly = pricing.quote(self.equipment, 'Nakuru', self.start, end, acres=2)
+        self.assertEqual((hourly.basis, hourly.estimated_hours, hourly.total_amount),
+                         ('hourly', Decimal('3.00'), Decimal('600.00')))
+        with self.assertRaises(ValueError):
+            pricing.quote(self.equipment, 'Meru', end, self.start)
+
+    def test_quotes_are_memoised_until_the_operator_changes_prices(self):
+        end = self.start + timedelta(days=1)
+        with self.assertNumQueries(1):
+            pricing.quote(self.equipment, 'Meru', self.start, end)
+        with self.assertNumQueries(0):
+            pricing.quote(self.equipment, 'Meru', self.start, end)
+
+        self.equipment.daily_rate = 1500
+        self.equipment.save()
+        self.assertEqual(pricing.quote(self.equipment, 'Meru', self.start, end).total_amount, Decimal('3300.00'))
+        self.area.additional_charge = 100
+        self.area.save()
+        self.assertEqual(pricing.quote(self.equipment, 'Meru', self.start, end).total_amount, Decimal('3100.00'))
+
+    def test_apply_quote(self):
+        booking = RentalBooking(equipment=self.equipment, farm_location_county='Meru', land_size_acres=2,
+                                requested_start_date=self.start, requested_end_date=self.start)
+        pricing.apply_quote(booking)
+        self.assertEqual((booking.quoted_rate, booking.transport_fee, booking.total_amount, booking.estimated_hours),
+                         (Decimal('200.00'), Decimal('300.00'), Decimal('900.00'), Decimal('3.00')))
+
+
+class AdminQueryCountTests(TestCase):
+    """Admin pages cost a fixed number of queries, not one per row shown."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_marketplace_data', farmers=60, operators=60, equipment_per_operator=2,
+                     seasons=1, bookings_per_season=2, seed=2, stdout=io.StringIO())
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw', phone_number='+254700000017')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_changelists(self):
+        for model, queries in [(FarmerProfile, 5), (OperatorProfile, 5), (Equipment, 5), (RentalBooking, 4),
+                               (Payment, 4), (Notification, 4)]:
+            with self.subTest(model=model.__name__):
+                self.assertGreater(model.objects.count(), 50)
+                url = f'/admin/core/{model._meta.model_name}/'
+                with self.assertNumQueries(queries):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class RequestStatsTests(TestCase):
+    def setUp(self):
+        middleware.request_stats.reset()
+        self.addCleanup(middleware.request_stats.reset)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def view(self, request):
+        for pk in range(4):
+            User.objects.filter(pk=pk).exists()
+        return HttpResponse('ok')
+
+    def test_fingerprint_erases_literals(self):
+        self.assertEqual(middleware.fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s) AND  n = 12'),
+                         'SELECT * FROM t WHERE id IN (...) AND n = N')
+
+    def test_off_unless_enabled(self):
+        self.assertFalse(settings.REQUEST_STATS_ENABLED)
+        with self.assertRaises(MiddlewareNotUsed):
+            middleware.QueryInstrumentationMiddleware(self.view)
+
+    def test_records_and_flushes(self):
+        with self.settings(REQUEST_STATS_ENABLED=True, REQUEST_STATS_DIR=self.directory,
+                           REQUEST_STATS_FLUSH_SECONDS=0):
+            handler = middleware.QueryInstrumentationMiddleware(self.view)
+            with self.assertLogs('core.instrumentation') as logs:
+                handler(RequestFactory().get('/equipment/'))
+            line = json.loads(logs.records[0].getMessage())
+            self.assertEqual((line['path'], line['status'], line['queries']), ('/equipment/', 200, 4))
+            self.assertEqual(list(line['duplicate_queries'].values()), [4])
+
+            stats = middleware.request_stats.snapshot()['unresolved']
+            self.assertEqual((stats['requests'], stats['queries_max'], stats['n_plus_one_requests']), (1, 4, 1))
+            self.assertEqual(len(os.listdir(self.directory)), 1)
+
+            out = io.StringIO()
+            call_command('request_stats', '--json', stdout=out)
+            self.assertEqual(json.loads(out.getvalue())['unresolved']['queries_total'], 4)
+
+
+class ReputationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.operator = OperatorProfile.objects.create(
+            user=User.objects.create(username='operator', phone_number='+254700000030', role=User.Role.OPERATOR),
+            county='Nakuru')
+        cls.other = User.objects.create(username='other', phone_number='+254700000031', role=User.Role.OPERATOR)
+        cls.farmer = FarmerProfile.objects.create(
+            user=User.objects.create(username='farmer', phone_number='+254700000032'), county='Nakuru')
+        cls.equipment = Equipment.objects.create(
+            owner=cls.operator, category=EquipmentCategory.objects.create(name='Tractor'), name='Tractor',
+            daily_rate=1000, current_county='Nakuru', serial_number='SN-R1')
+
+    def book(self, status=RentalBooking.Status.PENDING):
+        start = timezone.localdate() + timedelta(days=30)
+        return RentalBooking.objects.create(
+            farmer=self.farmer, equipment=self.equipment, operator=self.operator, job_description='Ploughing',
+            land_size_acres=2, farm_location_county='Nakuru', requested_start_date=start,
+            requested_end_date=start, quoted_rate=1000, status=status)
+
+    def summary(self, user):
+        summary = RatingSummary.objects.filter(user=user).first()
+        return summary and (summary.review_count, summary.rating_total, summary.quality_count)
+
+    def assertNoDrift(self):
+        drift = reputation.reconcile(fix=False)
+        self.assertEqual((drift.summaries_drifted, drift.operators_drifted), (0, 0), drift.examples)
+
+    def test_review_edit_and_delete(self):
+        review = BookingReview.objects.create(booking=self.book(), reviewer=self.farmer.user,
+                                              reviewee=self.operator.user, rating=4, quality_rating=5)
+        self.assertEqual(self.summary(self.operator.user), (1, 4, 1))
+        self.operator.refresh_from_db()
+        self.assertEqual(self.operator.average_rating, Decimal('4.00'))
+
+        review = BookingReview.objects.get(pk=review.pk)
+        review.rating, review.quality_rating = 2, None
+        review.save()
+        self.assertEqual(self.summary(self.operator.user), (1, 2, 0))
+        self.assertNoDrift()
+
+        review.reviewee = self.other
+        review.save()
+        self.assertEqual(self.summary(self.operator.user), (0, 0, 0))
+        self.assertEqual(self.summary(self.other), (1, 2, 0))
+        self.assertNoDrift()
+
+        review.delete()
+        self.assertEqual(self.summary(self.other), (0, 0, 0))
+        self.assertNoDrift()
+
+    def test_resaving_an_unloaded_review_is_not_counted_twice(self):
+        booking = self.book()
+        review = BookingReview.objects.create(booking=booking, reviewer=self.farmer.user,
+                                              reviewee=self.operator.user, rating=4)
+        BookingReview(pk=review.pk, booking=booking, reviewer=self.farmer.user, reviewee=self.operator.user,
+                      rating=2, created_at=review.created_at).save()
+        self.assertEqual(self.summary(self.operator.user), (1, 2, 0))
+        self.operator.refresh_from_db()
+        self.assertEqual(self.operator.average_rating, Decimal('2.00'))
+        self.assertNoDrift()
+
+    def test_review_and_summary_commit_together(self):
+        with mock.patch.object(reputation, '_apply', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            BookingReview.objects.create(booking=self.book(), reviewer=self.farmer.user,
+                                         reviewee=self.operator.user, rating=4)
+        self.assertFalse(BookingReview.objects.exists())
+
+    def test_completed_jobs_follow_saves_and_deletes(self):
+        done = self.book(RentalBooking.Status.COMPLETED)
+        pending = self.book()
+        self.operator.refresh_from_db()
+        self.assertEqual(self.operator.total_jobs_completed, 1)
+
+        pending.status = RentalBooking.Status.COMPLETED
+        pending.save()
+        done.status = RentalBooking.Status.DISPUTED
+        done.save()
+        self.operator.refresh_from_db()
+        self.assertEqual(self.operator.total_jobs_completed, 1)
+
+        done.delete()
+        pending.delete()
+        self.operator.refresh_from_db()
+        self.assertEqual(self.operator.total_jobs_completed, 0)
+        self.assertNoDrift()
+
+
+@override_settings(PAYMENT_CALLBACK_TOKEN='s3cret')
+class PaymentCallbackTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        operator = OperatorProfile.objects.create(
+            user=User.objects.create(username='operator', phone_number='+254700000040', role=User.Role.OPERATOR),
+            county='Nakuru')
+        farmer = FarmerProfile.objects.create(
+            user=User.objects.create(username='farmer', phone_number='+254700000041'), county='Nakuru')
+        equipment = Equipment.objects.create(
+            owner=operator, category=EquipmentCategory.objects.create(name='Tractor'), name='Tractor',
+            daily_rate=1000, current_county='Nakuru', serial_number='SN-P1')
+        start = timezone.localdate() + timedelta(days=30)
+        cls.booking, cls.other = [
+            RentalBooking.objects.create(
+                farmer=farmer, equipment=equipment, operator=operator, job_description='Ploughing',
+                land_size_acres=2, farm_location_county='Nakuru', requested_start_date=start + timedelta(days=n),
+                requested_end_date=start + timedelta(days=n), quoted_rate=1000, total_amount=1000,
+                deposit_amount=300) for n in (0, 5)]
+
+    def post(self, payload, token='s3cret'):
+        return self.client.post('/payments/callback/', payload if isinstance(payload, str) else json.dumps(payload),
+                                content_type='application/json', headers={'X-Callback-Token': token})
+
+    def callback(self, **fields):
+        return {'transaction_id': 'MP-1', 'booking': self.booking.pk, 'amount': '300', **fields}
+
+    def test_callbacks_need_the_configured_token(self):
+        self.assertEqual(self.post(self.callback(), token='guess').status_code, 403)
+        self.assertEqual(self.post(self.callback(), token='').status_code, 403)
+        with self.settings(PAYMENT_CALLBACK_TOKEN=''):
+            self.assertEqual(self.post(self.callback(), token='').status_code, 403)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_malformed_callbacks_are_rejected(self):
+        for payload in [
+            'not json', [1], {'booking': self.booking.pk, 'amount': '300'}, self.callback(booking='x'),
+            self.callback(amount='NaN'), self.callback(amount='Infinity'), self.callback(amount='1e30'),
+            self.callback(amount='-5'), self.callback(amount='0.001'), self.callback(amount=[]),
+            self.callback(paid_at=123), self.callback(paid_at='yesterday'),
+            self.callback(paid_at='2025-13-01T00:00:00'), self.callback(method='cheque'),
+        ]:
+            with self.subTest(payload=payload):
+                self.assertEqual(self.post(payload).status_code, 400)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_redelivery_is_a_duplicate(self):
+        first = self.post([self.callback(paid_at='2025-03-01T10:00:00'), self.callback()]).json()
+        self.assertEqual(first, {'accepted': 1, 'duplicate': 1, 'rejected': 0})
+        self.assertEqual(self.post(self.callback()).json(), {'accepted': 0, 'duplicate': 1, 'rejected': 0})
+        self.assertEqual(self.post(self.callback(transaction_id='MP-2', booking=0)).json()['rejected'], 1)
+        payment = Payment.objects.get()
+        self.assertEqual((payment.amount, payment.paid_at.day), (Decimal('300.00'), 1))
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.payment_status, RentalBooking.PaymentStatus.DEPOSIT_PAID)
+
+    def test_callback_reconciles_an_initiated_payment(self):
+        Payment.objects.create(booking=self.other, amount=50, method=Payment.Method.MPESA,
+                               payment_type=Payment.Type.DEPOSIT, transaction_id='MP-1')
+        self.assertEqual(self.post(self.callback(amount='1000', payment_type='final')).json()['accepted'], 1)
+        payment = Payment.objects.get()
+        self.assertEqual((payment.booking_id, payment.amount, payment.payment_type, payment.is_confirmed),
+                         (self.booking.pk, Decimal('1000.00'), Payment.Type.FINAL, True))
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.payment_status, RentalBooking.PaymentStatus.FULLY_PAID)
+
+    def test_lone_request_does_not_wait(self):
+        with mock.patch('core.payments.time.sleep') as sleep:
+            payments.CallbackBatcher(max_wait=1).submit([payments.parse_callback(self.callback())])
+        sleep.assert_not_called()
+
+
+class PayoutRunTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = EquipmentCategory.objects.create(name='Tractor')
+        farmer = FarmerProfile.objects.create(
+            user=User.objects.create(username='farmer', phone_number='+254700000050'), county='Nakuru')
+        cls.paid, cls.unpayable = [
+            OperatorProfile.objects.create(
+                user=User.objects.create(username=name, phone_number=f'+25470000005{n}', role=User.Role.OPERATOR),
+                county='Nakuru', mobile_money_number=number)
+            for n, (name, number) in enumerate([('paid', '+254711000001'), ('unpayable', '')], 1)]
+        start = timezone.localdate() - timedelta(days=60)
+        cls.bookings = []
+        for n, operator in enumerate([cls.paid] * 3 + [cls.unpayable]):
+            equipment = Equipment.objects.create(owner=operator, category=category, name=f'Tractor {n}',
+                                                 daily_rate=1000, current_county='Nakuru', serial_number=f'SN-PO{n}')
+            cls.bookings.append(RentalBooking.objects.create(
+                farmer=farmer, equipment=equipment, operator=operator, job_description='Ploughing',
+                land_size_acres=2, farm_location_county='Nakuru', requested_start_date=start,
+                requested_end_date=start, quoted_rate=1000, total_amount=1000,
+                status=RentalBooking.Status.COMPLETED, payment_status=RentalBooking.PaymentStatus.FULLY_PAID))
+
+    def test_runs_are_idempotent(self):
+        stats = payouts.create_payouts('PO-1', batch_size=2)
+        self.assertEqual((stats.batches, stats.created, stats.held), (2, 3, 1))
+        self.assertEqual(payouts.create_payouts('PO-2').created, 0)
+        self.assertEqual(payouts.unfinished_runs(), ['PO-1'])
+
+        out = io.StringIO()
+        self.assertEqual(payouts.settle('PO-1', out), (3, 1, Decimal('2700.00')))
+        self.assertIn('+254711000001,,3,3000.00,300.00,2700.00,PO-1', out.getvalue())
+        self.assertEqual(payouts.unfinished_runs(), [])
+        self.assertEqual(payouts.settle('PO-1', io.StringIO())[:2], (0, 0))
+
+    def test_rows_taken_by_another_run_are_not_counted(self):
+        payouts.create_payouts('PO-1')
+        OperatorPayout.objects.filter(booking=self.bookings[0]).delete()
+        # A second run that read the bookings before the first one inserted them.
+        with mock.patch.object(payouts, 'eligible_bookings', return_value=RentalBooking.objects.all()):
+            self.assertEqual(payouts.create_payouts('PO-2').created, 1)
+        self.assertEqual(OperatorPayout.objects.filter(payout_reference='PO-1').count(), 2)
+
+    def test_withdraw_only_unsettled_payouts(self):
+        payouts.create_payouts('PO-1')
+        self.assertEqual(payouts.withdraw(self.bookings[0].pk), 1)
+        payouts.settle('PO-1', io.StringIO())
+        self.assertEqual(payouts.withdraw(self.bookings[1].pk), 0)
+        self.assertEqual(payouts.create_payouts('PO-2').created, 1)
+
+    def test_failed_settlement_file_leaves_the_run_pending(self):
+        payouts.create_payouts('PO-1')
+        stream = mock.Mock(write=mock.Mock(side_effect=OSError('disk full')))
+        with self.assertRaises(OSError):
+            payouts.settle('PO-1', stream)
+        self.assertEqual(payouts.pending_payouts('PO-1').count(), 3)
+        self.assertEqual(payouts.withdraw(self.bookings[0].pk), 1)
+
+
+class NotificationOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='farmer', phone_number='+254700000060')
+        cls.silent = User.objects.create(username='silent', phone_number='')
+
+    def setUp(self):
+        self.gateway = notifications.FakeGateway(keep=10)
+        patcher = mock.patch.object(notifications, 'gateway', return_value=self.gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_due(self):
+        Notification.objects.filter(delivery_status=Notification.Delivery.QUEUED).update(
+            next_attempt_at=timezone.now())
+
+    def test_delivery_coalesces_per_recipient(self):
+        for n in range(2):
+            notifications.enqueue(self.user, f'Title {n}', 'Body')
+        notifications.enqueue(self.user, 'Inbox only', 'Body', channel=Notification.Channel.IN_APP)
+        notifications.enqueue(self.silent, 'Title', 'Body')
+        self.assertEqual(notifications.Dispatcher().run_once(), 3)
+
+        self.assertEqual([m.body for m in self.gateway.sent], ['Title 0: Body\nTitle 1: Body'])
+        statuses = dict(Notification.objects.values_list('title', 'delivery_status').filter(user=self.user))
+        self.assertEqual(statuses, {'Title 0': 'sent', 'Title 1': 'sent', 'Inbox only': ''})
+        self.assertEqual(Notification.objects.get(user=self.silent).last_error, 'User has no phone number')
+
+    def test_failures_back_off_until_max_attempts(self):
+        self.gateway.failure_rate = 1
+        notification = notifications.enqueue(self.user, 'Title', 'Body')
+        dispatcher = notifications.Dispatcher()
+        for attempt in range(1, notifications.MAX_ATTEMPTS + 1):
+            self.assertEqual(dispatcher.run_once(), 1)
+            self.assertEqual(dispatcher.run_once(), 0)
+            notification.refresh_from_db()
+            self.assertEqual(notification.attempts, attempt)
+            self.assertEqual(notification.last_error, 'Simulated gateway failure')
+            self.make_due()
+        self.assertEqual(notification.delivery_status, Notification.Delivery.FAILED)
+        self.assertIsNone(notification.next_attempt_at)
+        self.assertLess(notifications.backoff(1), notifications.backoff(5))
+        self.assertLessEqual(notifications.backoff(50), notifications.BACKOFF_MAX_SECONDS)
+
+    def test_lease_hands_rows_of_a_stalled_worker_on(self):
+        notifications.enqueue(self.user, 'Title', 'Body')
+        stalled, rows = notifications.Dispatcher().claim()
+        self.assertEqual(notifications.Dispatcher().claim(), (None, []))
+
+        Notification.objects.update(next_attempt_at=timezone.now())
+        other = notifications.Dispatcher()
+        token, taken = other.claim()
+        self.assertEqual([row.attempts for row in taken], [2])
+        # The stalled worker finishing late must not mark the row it lost.
+        notifications.Dispatcher().record(stalled, rows, {rows[0].pk: None})
+        self.assertEqual(Notification.objects.get().delivery_status, Notification.Delivery.SENDING)
+        other.record(token, taken, other.deliver(taken))
+        self.assertEqual(Notification.objects.get().delivery_status, Notification.Delivery.SENT)
+
+    def test_stale_lease_cannot_requeue_a_reclaimed_row(self):
+        notifications.enqueue(self.user, 'Title', 'Body')
+        stalled, rows = notifications.Dispatcher().claim()
+        Notification.objects.update(next_attempt_at=timezone.now())
+        other = notifications.Dispatcher()
+        token, taken = other.claim()
+
+        self.assertEqual(notifications.Dispatcher().record(stalled, rows, {rows[0].pk: 'Timed out'}), (0, 0))
+        notification = Notification.objects.get()
+        self.assertEqual((notification.delivery_status, notification.claimed_by, notification.last_error),
+                         (Notification.Delivery.SENDING, token, ''))
+        self.assertEqual(other.record(token, taken, other.deliver(taken)), (1, 0))
+        self.assertEqual(Notification.objects.get().delivery_status, Notification.Delivery.SENT)
+
+    def test_fake_gateway_keeps_recent_messages(self):
+        gateway = notifications.FakeGateway(keep=2)
+        gateway.send([notifications.Message('sms', '+254700000060', str(n)) for n in range(5)])
+        self.assertEqual(([m.body for m in gateway.sent], gateway.delivered), (['3', '4'], 5))
+
+
+class UnreadCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader', phone_number='+254700000016')
+
+    def setUp(self):
+        cache.clear()
+
+    def count(self):
+        return unread.count(self.user.pk)
+
+    def test_writes_move_the_counter(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first, second, third = [Notification.objects.create(user=self.user, title=f"Notice {i}", message="Hi")
+                                    for i in range(3)]
+        self.assertEqual(self.count(), 3)
+        with self.assertNumQueries(0):
+            self.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            notifications.enqueue_many([Notification(user=self.user, title="Bulk", message="Hi"),
+                                        Notification(user=self.user, title="Read", message="Hi", is_read=True)])
+        self.assertEqual(self.count(), 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.is_read = True
+            first.save()
+            first.save()
+            second.delete()
+        self.assertEqual(self.count(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(unread.mark_read(self.user.pk, [first.pk, third.pk]), 1)
+        self.assertEqual(self.count(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(unread.mark_all_read(self.user.pk), 1)
+        self.assertEqual(self.count(), 0)
+        self.assertEqual(unread.reconcile(), (1, 0))
+
+    def test_mark_all_read_subtracts_what_it_marked(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(user=self.user, title="Notice", message="Hi")
+            # Counted in by a transaction whose row this one cannot see yet.
+            unread.adjust({self.user.pk: 1})
+            self.assertEqual(unread.mark_all_read(self.user.pk), 1)
+        self.assertEqual(self.count(), 1)
+
+    def test_reconcile_repairs_drift(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(user=self.user, title="Notice", message="Hi")
+        Notification.objects.filter(user=self.user).update(is_read=True)
+        self.assertEqual(self.count(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(unread.reconcile(), (1, 1))
+        self.assertEqual(self.count(), 0)
+
+
+class HotQueryPlanTests(TestCase):
+    """Every hot query must reach its rows through an index, not a full scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_marketplace_data', farmers=200, operators=40, equipment_per_operator=3,
+                     seasons=1, bookings_per_season=2, seed=1, stdout=io.StringIO())
+        cls.today = timezone.localdate()
+        cls.equipment = Equipment.objects.order_by('pk')[0]
+        cls.farmer = FarmerProfile.objects.order_by('pk')[0]
+        cls.category = EquipmentCategory.objects.order_by('pk')[0]
+        cls.county = cls.equipment.current_county
+
+    def assertIndexed(self, queryset, sorted_by_index=False):
+        if connection.vendor != 'sqlite':
+            self.skipTest("Plans are checked against SQLite")
+        plan = queryset.explain()
+        self.assertIsNone(FULL_SCAN.search(plan), f"Full scan in plan:\n{plan}\nfor:\n{queryset.query}")
+        if sorted_by_index:
+            self.assertNotIn('TEMP B-TREE', plan, f"Sort step in plan:\n{plan}\nfor:\n{queryset.query}")
+
+    def assertDeepPageIndexed(self, queryset, ordering=('-created_at', '-pk')):
+        paginator = CursorPaginator(queryset, ordering)
+        oldest = queryset.order_by(*[name.lstrip('-') for name in ordering]).first()
+        values = [getattr(oldest, name.lstrip('-')) for name in ordering]
+        self.assertIndexed(paginator.queryset.filter(paginator.after(values))[:21], sorted_by_index=True)
+
+    def test_unit_availability(self):
+        start = self.today + timedelta(days=10)
+        bookings = RentalBooking.objects.filter(
+            equipment_id=self.equipment.pk, status__in=availability.BLOCKING_STATUSES,
+            requested_start_date__lte=start + timedelta(days=3),
+        ).order_by('-requested_start_date').values_list('requested_end_date', flat=True)[:1]
+        self.assertIndexed(bookings)
+
+    def test_blocking_bookings(self):
+        ids = list(Equipment.objects.values_list('pk', flat=True)[:50])
+        start = self.today + timedelta(days=10)
+        self.assertIndexed(availability.blocking_bookings(ids, start, start + timedelta(days=3)))
+
+    def test_equipment_search(self):
+        start = self.today + timedelta(days=10)
+        self.assertIndexed(search.available_equipment(start, start + timedelta(days=3), self.category, self.county))
+
+    def test_equipment_by_status_category_county(self):
+        self.assertIndexed(Equipment.objects.filter(
+            status=Equipment.Status.AVAILABLE, category=self.category, current_county=self.county))
+
+    def test_farmer_bookings(self):
+        self.assertIndexed(RentalBooking.objects.filter(farmer=self.farmer).order_by('-created_at')[:20])
+
+    def test_unread_notifications(self):
+        user = self.farmer.user_id
+        self.assertIndexed(Notification.objects.filter(user_id=user, is_read=False)[:20])
+
+    def test_due_notifications(self):
+        self.assertIndexed(Notification.objects.filter(
+            delivery_status__in=[Notification.Delivery.QUEUED, Notification.Delivery.SENDING],
+            next_attempt_at__lte=timezone.now(),
+        ).order_by('next_attempt_at').values_list('pk', flat=True)[:200])
+
+    def test_confirmed_payments(self):
+        bookings = list(RentalBooking.objects.values_list('pk', flat=True)[:50])
+        self.assertIndexed(Payment.objects.filter(booking_id__in=bookings, is_confirmed=True))
+
+    def test_maintenance_history(self):
+        self.assertIndexed(MaintenanceLog.objects.filter(equipment=self.equipment).order_by('-service_date')[:10])
+
+    def test_deep_cursor_pages(self):
+        self.assertDeepPageIndexed(Equipment.objects.all())
+        self.assertDeepPageIndexed(RentalBooking.objects.filter(farmer=self.farmer))
+        self.assertDeepPageIndexed(RentalBooking.objects.filter(operator=self.equipment.owner))
+        self.assertDeepPageIndexed(Notification.objects.filter(user_id=self.farmer.user_id), ('-sent_at', '-pk'))
+
+
+class CursorPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader', phone_number='+254700000001')
+        Notification.objects.bulk_create(
+            Notification(user=cls.user, title=f"Notice {i}", message="Hello") for i in range(25))
+        # Several rows share a timestamp, so the id tie-break matters.
+        Notification.objects.filter(pk__in=Notification.objects.order_by('pk').values('pk')[5:15]).update(
+            sent_at=timezone.now())
+
+    def test_pages_cover_every_row_once_in_order(self):
+        paginator = CursorPaginator(Notification.objects.filter(user=self.user), ('-sent_at', '-pk'), page_size=4)
+        seen, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            seen.extend(n.pk for n in page.items)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        expected = list(Notification.objects.filter(user=self.user).order_by('-sent_at', '-pk')
+                        .values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_rejects_bad_cursors(self):
+        paginator = CursorPaginator(Notification.objects.all(), ('-sent_at', '-pk'))
+        well_formed = [paginator.encode(Notification(sent_at=values[0], pk=values[1]))
+                       for values in ([{}, 1], [1, 2], ['2025-01-01T00:00:00', [3]])]
+        for cursor in ('not-a-cursor', 'WzFd', 'WyJ4IiwgMV0', *well_formed):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+
+
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+
+    def in_fresh_context(self, func):
+        return contextvars.Context().run(func)
+
+    def test_discovery_reads_use_the_replica(self):
+        self.assertEqual(self.in_fresh_context(lambda: self.router.db_for_read(Equipment)), 'replica')
+        self.assertEqual(self.in_fresh_context(lambda: self.router.db_for_read(RentalBooking)), 'default')
+        self.assertEqual(self.in_fresh_context(lambda: self.router.db_for_write(Equipment)), 'default')
+
+    def test_reads_after_a_write_stay_on_the_primary(self):
+        def write_then_read():
+            self.router.db_for_write(RentalBooking)
+            return self.router.db_for_read(Equipment)
+        self.assertEqual(self.in_fresh_context(write_then_read), 'default')
+
+        def pinned_block():
+            with routers.use_primary():
+                inside = self.router.db_for_read(Equipment)
+            return inside, self.router.db_for_read(Equipment)
+        self.assertEqual(self.in_fresh_context(pinned_block), ('default', 'replica'))
+
+    def test_middleware_carries_the_pin_to_the_next_request(self):
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(Equipment))
+            if request.method == 'POST':
+                self.router.db_for_write(RentalBooking)
+            return HttpResponse()
+
+        middleware = routers.PrimaryPinningMiddleware(view)
+        factory = RequestFactory()
+        response = self.in_fresh_context(lambda: middleware(factory.post('/bookings/')))
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+        pinned = factory.get('/equipment/')
+        pinned.COOKIES[routers.PIN_COOKIE] = '1'
+        self.in_fresh_context(lambda: middleware(pinned))
+        self.in_fresh_context(lambda: middleware(factory.get('/equipment/')))
+        self.assertEqual(seen, ['replica', 'default', 'replica'])
+
+
+@override_settings(DATABASE_ROUTERS=[routers.ROUTER])
+class PrimaryReplicaDatabaseTests(TransactionTestCase):
+    # No test transaction: inside one every read is pinned to the primary.
+    databases = {'default', 'replica'}
+
+    def categories(self, using=None):
+        rows = EquipmentCategory.objects.using(using) if using else EquipmentCategory.objects
+        return set(rows.values_list('name', flat=True))
+
+    def in_fresh_context(self, func):
+        return contextvars.Context().run(func)
+
+    def test_routing_between_two_files(self):
+        self.in_fresh_context(lambda: EquipmentCategory.objects.create(name='Tractor'))
+        call_command('sync_replica', stdout=io.StringIO())
+
+        def book_now():
+            EquipmentCategory.objects.create(name='Planter')
+            return self.categories()
+        self.assertEqual(self.in_fresh_context(book_now), {'Tractor', 'Planter'})
+        self.assertEqual(self.categories('default'), {'Tractor', 'Planter'})
+        self.assertEqual(self.categories('replica'), {'Tractor'})
+        self.assertEqual(self.in_fresh_context(self.categories), {'Tractor'})
+
+        def pinned_block():
+            with routers.use_primary():
+                return self.categories()
+        self.assertEqual(self.in_fresh_context(pinned_block), {'Tractor', 'Planter'})
+
+        def worker_loop():
+            EquipmentCategory.objects.create(name='Harvester')
+            with routers.unpinned():
+                fresh = self.categories()
+            return fresh, self.categories()
+        self.assertEqual(self.in_fresh_context(worker_loop),
+                         ({'Tractor'}, {'Tractor', 'Planter', 'Harvester'}))
+
+
+class FullTextSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='operator', phone_number='+254700000002', role=User.Role.OPERATOR)
+        operator = OperatorProfile.objects.create(user=user, county='Nakuru')
+        planters = EquipmentCategory.objects.create(name='Planter')
+        trailers = EquipmentCategory.objects.create(name='Trailer')
+
+        def unit(name, brand, capacity, category, **extra):
+            return Equipment.objects.create(owner=operator, category=category, name=name, brand=brand,
+                                            capacity_info=capacity, daily_rate=1000, current_county='Nakuru',
+                                            serial_number=f'SN-{name}-{capacity}', **extra)
+        cls.kubota = unit('Kubota Planter', 'Kubota', '3-row planter', planters)
+        cls.deere = unit('John Deere Planter', 'John Deere', '4-row planter', planters,
+                         description="Pairs well with a Kubota tractor")
+        cls.trailer = unit('Tipping Trailer', 'TAFE', '5-ton capacity', trailers)
+        cls.rented = unit('Kubota Planter', 'Kubota', '2-row planter', planters, status=Equipment.Status.RENTED)
+
+    def pks(self, text, **filters):
+        return [unit.pk for unit in fulltext.search(text, **filters)]
+
+    def test_every_word_must_match_and_names_outrank_descriptions(self):
+        if connection.vendor == 'sqlite':
+            self.assertTrue(fulltext.index_available('default'))
+        self.assertEqual(self.pks('3-row planter Kubota'), [self.kubota.pk])
+        self.assertEqual(self.pks('kubota'), [self.kubota.pk, self.deere.pk])
+        self.assertEqual(self.pks('5-ton trailer'), [self.trailer.pk])
+        self.assertEqual(self.pks('kubo'), [self.kubota.pk, self.deere.pk])
+
+    def test_filters(self):
+        self.assertEqual(self.pks('kubota', status=Equipment.Status.RENTED), [self.rented.pk])
+        self.assertEqual(self.pks('planter', category=self.trailer.category_id), [])
+        self.assertEqual(self.pks('trailer', county='Turkana'), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        Equipment.objects.filter(pk=self.trailer.pk).update(description="Hydraulic tipper")
+        self.assertEqual(self.pks('hydraulic'), [self.trailer.pk])
+        self.trailer.delete()
+        self.assertEqual(self.pks('hydraulic'), [])
+
+    def test_view_clamps_page_size(self):
+        for page_size, expected in (('-5', 1), ('0', 1), ('', 2), ('1000', 2)):
+            with self.subTest(page_size=page_size):
+                response = self.client.get('/equipment/search/', {'q': 'planter', 'page_size': page_size})
+                self.assertEqual(len(response.json()['results']), expected)
+
+    @mock.patch.object(fulltext, 'index_available', return_value=False)
+    def test_icontains_fallback(self, index_available):
+        self.assertEqual(sorted(self.pks('kubota planter')), sorted([self.kubota.pk, self.deere.pk]))
+        self.assertEqual(self.pks('5-ton trailer'), [self.trailer.pk])
+        self.assertEqual(self.pks('kubota', status=Equipment.Status.RENTED), [self.rented.pk])
+        self.assertEqual(self.pks('trailer', county='Turkana'), [])
+        self.assertTrue(all(unit.search_rank is None for unit in fulltext.search('planter')))
+        index_available.assert_called()
+
+    @mock.patch.object(fulltext, '_indexed', set())
+    def test_a_missing_index_is_looked_for_again(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("The FTS index is SQLite only")
+        with mock.patch.object(fulltext, 'FTS_TABLE', 'core_equipment_fts_missing'):
+            self.assertFalse(fulltext.index_available('default'))
+        self.assertTrue(fulltext.index_available('default'))
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        def farmer(n, county, crop):
+            user = User.objects.create(username=f'farmer{n}', phone_number=f'+2547000001{n:02}')
+            return FarmerProfile.objects.create(user=user, county=county, primary_crop=crop)
+        farmer(1, "Murang'a", 'Maize')
+        farmer(2, 'Muranga County', 'corn')
+        farmer(3, "murang'a", 'Mahindi')
+        farmer(4, 'Mombasa', 'Beans')
+        farmer(5, 'Meru', 'Millet')
+        farmer(6, 'Meru', 'Mtama')
+        farmer(7, "Murang'a", 'Maize')
+
+    def setUp(self):
+        autocomplete.reset()
+        self.addCleanup(autocomplete.reset)
+
+    def test_spelling_variants_share_one_entry(self):
+        self.assertEqual(autocomplete.suggest('county', 'MUR'), [autocomplete.Suggestion("Murang'a", 4)])
+        self.assertEqual(autocomplete.variants('county', 'muranga'), ["Murang'a", 'Muranga County', "murang'a"])
+        self.assertEqual(autocomplete.canonical('crop', 'corn'), 'Maize')
+
+    def test_most_used_first_and_aliases_match(self):
+        self.assertEqual([s.value for s in autocomplete.suggest('county', 'm')], ["Murang'a", 'Meru', 'Mombasa'])
+        self.assertEqual([s.value for s in autocomplete.suggest('county', 'm', limit=1)], ["Murang'a"])
+        self.assertEqual([s.value for s in autocomplete.suggest('crop', 'mt')], ['Mtama'])
+        self.assertEqual([s.value for s in autocomplete.suggest('crop', 'co')], ['Maize'])
+
+    def test_index_follows_committed_writes(self):
+        self.assertEqual(autocomplete.suggest('county', 'kis'), [])
+        user = User.objects.create(username='farmer9', phone_number='+254700000199')
+        with self.captureOnCommitCallbacks(execute=True):
+            farmer = FarmerProfile.objects.create(user=user, county='Kisumu', primary_crop='Rice')
+        self.assertEqual(autocomplete.suggest('county', 'kis'), [autocomplete.Suggestion('Kisumu', 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            farmer.delete()
+        self.assertEqual(autocomplete.suggest('county', 'kis'), [])
+
+    def test_edits_move_counts_to_the_new_value(self):
+        self.assertEqual(autocomplete.suggest('county', 'mur'), [autocomplete.Suggestion("Murang'a", 4)])
+        farmer = FarmerProfile.objects.get(user__username='farmer1')
+        with self.captureOnCommitCallbacks(execute=True):
+            farmer.county = 'Kisumu'
+            farmer.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            farmer.county = 'Kisii'
+            farmer.save()
+        self.assertEqual(autocomplete.suggest('county', 'mur'), [autocomplete.Suggestion("Murang'a", 3)])
+        self.assertEqual(autocomplete.suggest('county', 'kis'), [autocomplete.Suggestion('Kisii', 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            farmer.delete()
+        self.assertEqual(autocomplete.suggest('county', 'kis'), [])
+
+    def test_readers_and_writers_share_the_lock(self):
+        built = autocomplete.index('crop')
+        stop = threading.Event()
+
+        def write():
+            while not stop.is_set():
+                built.add('Mangoes')
+                built.add('Mangoes', -1)
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for _ in range(2000):
+                self.assertEqual(autocomplete.suggest('crop', 'mai'), [autocomplete.Suggestion('Maize', 4)])
+        finally:
+            stop.set()
+            writer.join()
+
+    def test_endpoint(self):
+        response = self.client.get('/suggest/crop/', {'q': 'mai'})
+        self.assertEqual(response.json(), {'results': [{'value': 'Maize', 'count': 4}]})
+        self.assertEqual(self.client.get('/suggest/planet/').status_code, 404)
+
+
+class FacetCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='operator', phone_number='+254700000003', role=User.Role.OPERATOR)
+        operator = OperatorProfile.objects.create(user=user, county='Nakuru')
+        cls.tractors = EquipmentCategory.objects.create(name='Tractor')
+        cls.planters = EquipmentCategory.objects.create(name='Planter')
+
+        def unit(n, category, county, fuel_type='diesel', horsepower=None, **extra):
+            return Equipment.objects.create(owner=operator, category=category, name=f'Unit {n}', daily_rate=1000,
+                                            current_county=county, fuel_type=fuel_type, horsepower=horsepower,
+                                            serial_number=f'SN-F{n}', **extra)
+        cls.big = unit(1, cls.tractors, 'Nakuru', horsepower=90)
+        unit(2, cls.tractors, 'Nakuru', horsepower=40, price_includes_fuel=True)
+        unit(3, cls.tractors, 'Meru', fuel_type='petrol', horsepower=30)
+        unit(4, cls.planters, 'Nakuru', fuel_type='manual')
+        unit(5, cls.tractors, 'Nakuru', status=Equipment.Status.RENTED)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_counts_from_one_query(self):
+        with self.assertNumQueries(1):
+            total, counts = facets.counts()
+        self.assertEqual(total, 4)
+        self.assertEqual(counts['category'], {self.tractors.pk: 3, self.planters.pk: 1})
+        self.assertEqual(counts['horsepower'], {'75-120': 1, '35-75': 1, 'under-35': 1, '': 1})
+        self.assertEqual(counts['fuel_included'], {False: 3, True: 1})
+        with self.assertNumQueries(0):
+            facets.counts({'county': {'Meru'}})
+
+    def test_a_facet_ignores_its_own_selection(self):
+        total, counts = facets.counts({'county': {'Nakuru'}, 'fuel_type': {'diesel'}})
+        self.assertEqual(total, 2)
+        self.assertEqual(counts['county'], {'Nakuru': 2})
+        self.assertEqual(counts['fuel_type'], {'diesel': 2, 'manual': 1})
+        selected = facets.parse_selection({'county': ['Nakuru'], 'fuel_type': ['diesel']})
+        self.assertEqual(facets.filter_queryset(Equipment.objects.filter(status='available'), selected).count(), 2)
+        hp = facets.filter_queryset(Equipment.objects.filter(status='available'), {'horsepower': {'35-75', ''}})
+        self.assertEqual(hp.count(), 2)
+
+    def test_relevant_changes_invalidate(self):
+        facets.counts()
+        version = cache.get(facets.VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            unit = Equipment.objects.get(pk=self.big.pk)
+            unit.gps_latitude = 1
+            unit.save()
+        self.assertEqual(cache.get(facets.VERSION_KEY), version)
+        with self.captureOnCommitCallbacks(execute=True):
+            unit.current_county = 'Meru'
+            unit.save()
+        self.assertEqual(facets.counts()[1]['county'], {'Nakuru': 2, 'Meru': 2})
+
+    def test_endpoint(self):
+        response = self.client.get('/equipment/facets/', {'fuel_type': 'diesel', 'horsepower': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+        body = self.client.get('/equipment/facets/', {'category': self.planters.pk}).json()
+        self.assertEqual(body['total'], 1)
+        self.assertIn({'value': self.planters.pk, 'label': 'Planter', 'count': 1, 'selected': True},
+                      body['facets']['category'])
+
+
+class JobTestData:
+    """An operator's tractor with one booking in progress and one completed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.operator_user = User.objects.create(username='operator', phone_number='+254700000004',
+                                                role=User.Role.OPERATOR)
+        operator = OperatorProfile.objects.create(user=cls.operator_user, county='Nakuru')
+        farmer = FarmerProfile.objects.create(
+            user=User.objects.create(username='farmer', phone_number='+254700000005'), county='Nakuru')
+        cls.equipment = Equipment.objects.create(owner=operator, category=EquipmentCategory.objects.create(
+            name='Tractor'), name='Tractor', daily_rate=1000, current_county='Nakuru', serial_number='SN-T1')
+        today = timezone.localdate()
+
+        def booking(status):
+            return RentalBooking.objects.create(
+                farmer=farmer, equipment=cls.equipment, operator=operator, job_description='Ploughing',
+                land_size_acres=2, farm_location_county='Nakuru', requested_start_date=today,
+                requested_end_date=today, quoted_rate=1000, status=status)
+        cls.booking = booking(RentalBooking.Status.IN_PROGRESS)
+        cls.finished = booking(RentalBooking.Status.COMPLETED)
+
+
+class TelemetryTests(JobTestData, TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(telemetry, 'ingestor', telemetry.Ingestor(position_seconds=30))
+        self.ingestor = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def connect(self, token, frames):
+        """Run one device connection that sends ``frames`` (text, or whole events); returns what the server sent."""
+        inbox, sent = asyncio.Queue(), []
+
+        async def send(message):
+            sent.append(message)
+        for event in [{'type': 'websocket.connect'},
+                      *(frame if isinstance(frame, dict) else {'type': 'websocket.receive', 'text': frame}
+                        for frame in frames),
+                      {'type': 'websocket.disconnect', 'code': 1000}]:
+            inbox.put_nowait(event)
+        scope = {'type': 'websocket', 'path': telemetry.WEBSOCKET_PATH, 'query_string': f'token={token}'.encode()}
+        await telemetry.device_socket(scope, inbox.get, send)
+        return sent
+
+    def test_parse_fixes(self):
+        now = time.time()
+        fix, = telemetry.parse_fixes('{"lat": -0.303099, "lon": 36.080026, "speed": 12.4}', now)
+        self.assertEqual(fix, (now, -303099, 36080026, 12, None, None))
+        fix, = telemetry.parse_fixes('{"lat": -0.3, "lon": 36.08, "heading": 270, "accuracy": 8}', now)
+        self.assertEqual(live.position_payload(*fix),
+                         {'lat': -0.3, 'lon': 36.08, 't': now, 'speed': None, 'heading': 270, 'accuracy': 8})
+        self.assertEqual(len(telemetry.parse_fixes(json.dumps([{'lat': 0, 'lon': 0, 't': now - 5}] * 3), now)), 3)
+        for frame in ['{"lat": 91, "lon": 0}', '{"lon": 0}', '[1]', 'nope', f'{{"lat": 0, "lon": 0, "t": {now + 600}}}']:
+            with self.subTest(frame=frame), self.assertRaises(ValueError):
+                telemetry.parse_fixes(frame, now)
+
+    async def test_fixes_are_buffered_then_written_together(self):
+        now = time.time()
+        sent = await self.connect(telemetry.device_token(self.booking), [
+            json.dumps([{'lat': -0.3, 'lon': 36.08, 't': now - 2}, {'lat': -0.31, 'lon': 36.09, 't': now - 1}]),
+            json.dumps({'lat': -0.32, 'lon': 36.1, 't': now - 0.9}),
+            '{"lat": "north"}',
+        ])
+        self.assertEqual(sent[0], {'type': 'websocket.accept'})
+        self.assertIn('error', json.loads(sent[1]['text']))
+        self.assertEqual(await TelemetryFix.objects.acount(), 0)
+
+        await self.ingestor.stop()
+        fixes = [(f.latitude_e6, f.longitude_e6) async for f in TelemetryFix.objects.order_by('recorded_at')]
+        self.assertEqual(fixes, [(-300000, 36080000), (-310000, 36090000)])  # the third came too soon after
+        equipment = await Equipment.objects.aget(pk=self.equipment.pk)
+        self.assertEqual((str(equipment.gps_latitude), str(equipment.gps_longitude)), ('-0.310000', '36.090000'))
+        self.assertTrue(equipment.geohash)
+        self.assertEqual((await TrackAnalysis.objects.aget(booking=self.booking)).fix_count, 2)
+
+    async def test_binary_and_empty_frames(self):
+        sent = await self.connect(telemetry.device_token(self.booking), [
+            {'type': 'websocket.receive', 'text': None, 'bytes': json.dumps({'lat': -0.3, 'lon': 36.08}).encode()},
+            {'type': 'websocket.receive', 'text': None, 'bytes': None},
+            {'type': 'websocket.receive', 'bytes': b'\xff'},
+        ])
+        self.assertEqual([json.loads(m['text']).keys() for m in sent[1:]], [{'error'}, {'error'}])
+        self.assertEqual(self.ingestor.stats['received'], 1)
+
+    async def test_rejected_connections(self):
+        self.assertEqual(await self.connect('forged', []), [{'type': 'websocket.close', 'code': 4401}])
+        self.assertEqual(await self.connect(telemetry.device_token(self.finished), []),
+                         [{'type': 'websocket.close', 'code': 4403}])
+
+    def test_token_view(self):
+        url = f'/bookings/{self.booking.pk}/telemetry-token/'
+        self.client.force_login(self.operator_user)
+        token = self.client.get(url).json()['token']
+        self.assertEqual(telemetry.read_token(token), self.booking.pk)
+        self.assertEqual(self.client.get(f'/bookings/{self.finished.pk}/telemetry-token/').status_code, 409)
+        self.client.force_login(User.objects.get(username='farmer'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class TrackStorageTests(JobTestData, TestCase):
+    def setUp(self):
+        self.start = timezone.now() - timedelta(hours=3)
+
+    def record(self, points, booking=None):
+        """Store fixes for ``(seconds after start, lat_e6, lon_e6)``."""
+        TelemetryFix.objects.bulk_create([
+            TelemetryFix(booking=booking or self.booking, recorded_at=self.start + timedelta(seconds=s),
+                         latitude_e6=lat, longitude_e6=lon)
+            for s, lat, lon in points
+        ])
+        return [(tracks.to_ms(self.start + timedelta(seconds=s)), lat, lon) for s, lat, lon in points]
+
+    def test_blocks_are_read_without_copying(self):
+        points = [(1_700_000_000_000, -303099, 36080026), (1_700_000_001_500, -303000, 36080100),
+                  (1_700_000_003_000, -302950, 36079990)]
+        block = tracks.pack(points)
+        self.assertEqual(len(block), tracks.HEADER.size + 12 * len(points))
+        chunk = tracks.Chunk(block)
+        self.assertIs(chunk.t.obj, block)
+        self.assertEqual(list(chunk), points)
+        with self.assertRaises(ValueError):
+            tracks.Chunk(block[:-1])
+
+    def test_compaction_keeps_the_track_and_drops_the_rows(self):
+        expected = self.record([(s, -300000 + s, 36000000 - s) for s in range(0, 70, 10)])
+        with mock.patch.object(tracks, 'CHUNK_SIZE', 3):
+            self.assertEqual(tracks.compact(self.booking.pk, timezone.now()), 7)
+            self.assertFalse(TelemetryFix.objects.exists())
+            self.assertEqual(list(TrackChunk.objects.values_list('seq', 'fix_count')), [(0, 3), (1, 3), (2, 1)])
+            self.assertEqual(list(tracks.load(self.booking.pk)), expected)
+
+            expected += self.record([(80, -299920, 35999920)])  # tops up the short last chunk
+            late = self.record([(5, -299995, 36000005)])         # arrives after later fixes were compacted
+            pending = self.record([(9000, -299000, 35999000)])  # not settled yet
+            self.assertEqual(tracks.compact(self.booking.pk, self.start + timedelta(seconds=100)), 2)
+            self.assertEqual(list(TrackChunk.objects.values_list('seq', 'fix_count')), [(0, 3), (1, 3), (2, 3)])
+            self.assertEqual(list(tracks.load(self.booking.pk)), sorted(expected + late) + pending)
+
+    def test_measurements(self):
+        # Two passes 100 m apart along a meridian, 30 s per fix, with a 20 minute tea break between.
+        self.record([(30 * i, 900 * i, 36000000) for i in range(11)]
+                    + [(1800 + 30 * i, 9000 - 900 * i, 36000200) for i in range(11)])
+        track = tracks.load(self.booking.pk)
+        self.assertAlmostEqual(track.distance_km(), 2.02, places=2)
+        self.assertAlmostEqual(track.working_hours(), 600 / 3600)
+        self.assertAlmostEqual(track.coverage_hectares(), 2.02, delta=0.03)  # 2 x 1 km at 10 m
+        line = track.downsample(6)
+        self.assertEqual((len(line), line[0], line[-1]), (6, next(iter(track)), list(track)[-1]))
+        self.assertEqual(len(track.downsample(100)), 22)
+
+    def test_exported_file_is_memory_mapped(self):
+        expected = self.record([(s, 1000 * s, -1000 * s) for s in range(100)])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'track.agtk')
+            with mock.patch.object(tracks, 'CHUNK_SIZE', 40):
+                self.assertEqual(tracks.export(self.booking.pk, path), 3 * tracks.HEADER.size + 12 * 100)
+            with tracks.Track.open(path) as track:
+                self.assertEqual(len(track.chunks), 3)
+                self.assertEqual(list(track), expected)
+
+    def test_track_endpoint(self):
+        self.record([(30 * i, 100 * i, 36000000) for i in range(50)])
+        self.client.force_login(self.operator_user)
+        body = self.client.get(f'/bookings/{self.booking.pk}/track/', {'max_points': 10}).json()
+        self.assertEqual((body['fixes'], len(body['points'])), (50, 10))
+        self.assertEqual(body['points'][0], [0.0, 36.0, tracks.to_ms(self.start)])
+        self.assertEqual(self.client.get(f'/bookings/{self.booking.pk + 99}/track/').status_code, 404)
+
+
+class JobAnalysisTests(JobTestData, TestCase):
+    # 1 km north at 12 km/h, ten minutes parked with GPS jitter, twenty
+    # minutes switched off, then 1 km back 22 m to the east.
+    TRACK = ([(30_000 * i, 900 * i, 36000000) for i in range(11)]
+             + [(300_000 + 30_000 * i, 9000 + (-15, 15)[i % 2], 36000000) for i in range(1, 21)]
+             + [(2_100_000 + 30_000 * i, 9000 - 900 * i, 36000200) for i in range(11)])
+
+    def test_hours_and_area(self):
+        job = jobs.TrackAnalyzer().feed(self.TRACK)
+        self.assertEqual((job.engine_seconds, job.moving_seconds), (1200, 600))
+        track = tracks.Track([tracks.Chunk(tracks.pack(self.TRACK))])
+        self.assertEqual(job.engine_seconds, track.working_hours() * 3600)
+        self.assertAlmostEqual(job.distance_m, 2004, delta=1)
+        self.assertAlmostEqual(job.worked_acres, 2.02 / 0.404686, delta=0.1)  # two 1 km strips of 10 m cells
+
+        job.feed([(60_000, 0, 0)])
+        self.assertEqual((job.fix_count, job.late_fixes), (len(self.TRACK), 1))
+
+        # Creeping at 0.7 km/h is still work, not a stop.
+        creep = jobs.TrackAnalyzer().feed([(5_000 * i, 9 * i, 36000000) for i in range(121)])
+        self.assertEqual(creep.moving_seconds, creep.engine_seconds)
+
+    def test_resuming_from_saved_state_matches_one_pass(self):
+        whole = jobs.TrackAnalyzer().feed(self.TRACK)
+        for cuts in [(3, 14), (12, 13, 30), (31, 40)]:
+            with self.subTest(cuts=cuts):
+                job = jobs.TrackAnalyzer()
+                for lo, hi in zip((0, *cuts), (*cuts, len(self.TRACK))):
+                    job = jobs.TrackAnalyzer.from_analysis(job.feed(self.TRACK[lo:hi]).to_analysis(self.booking.pk))
+                self.assertEqual(job.to_state(), whole.to_state())
+                self.assertEqual((job.engine_seconds, job.moving_seconds, job.fix_count),
+                                 (whole.engine_seconds, whole.moving_seconds, whole.fix_count))
+                self.assertAlmostEqual(job.distance_m, whole.distance_m)
+
+    def test_live_analyses_fill_in_the_booking(self):
+        start = time.time() - 3600
+        batch = [(self.booking.pk, start + t / 1000, lat, lon) for t, lat, lon in self.TRACK]
+        analyses = jobs.LiveAnalyses(save_seconds=60)
+        analyses.feed(batch[:20])
+        self.assertEqual(analyses.save(), 0)
+        analyses.save(everything=True)
+        self.assertEqual(TrackAnalysis.objects.get(booking=self.booking).fix_count, 20)
+
+        resumed = jobs.LiveAnalyses(save_seconds=60)
+        resumed.feed(batch[20:])
+        resumed.save(ended={self.booking.pk})
+        self.assertEqual(resumed.analyzers, {})
+        analysis = TrackAnalysis.objects.get(booking=self.booking)
+        self.assertEqual((analysis.fix_count, analysis.engine_seconds), (len(self.TRACK), 1200))
+        self.booking.refresh_from_db()
+        self.assertEqual(str(self.booking.actual_hours), '0.33')
+        self.assertEqual(self.booking.actual_start_date, timezone.localdate(tracks.from_ms(round(start * 1000))))
+
+    def test_two_processes_analysing_one_booking_do_not_overwrite_each_other(self):
+        start = time.time() - 3600
+        batch = [(self.booking.pk, start + t / 1000, lat, lon, None, None, None) for t, lat, lon in self.TRACK]
+        first, second = jobs.LiveAnalyses(save_seconds=60), jobs.LiveAnalyses(save_seconds=60)
+        telemetry.write(batch[:20], {}, first)
+        telemetry.write(batch[20:], {}, second)
+        first.save(everything=True)
+        second.save(everything=True)
+        analysis = TrackAnalysis.objects.get(booking=self.booking)
+        self.assertEqual((analysis.fix_count, analysis.engine_seconds), (len(self.TRACK), 1200))
+        self.assertEqual(second.analyzers[self.booking.pk].fix_count, len(self.TRACK))
+
+    def test_analyze_tracks_command(self):
+        start = timezone.now() - timedelta(days=2)
+        TelemetryFix.objects.bulk_create([
+            TelemetryFix(booking=self.finished, recorded_at=start + timedelta(milliseconds=t), latitude_e6=lat,
+                         longitude_e6=lon)
+            for t, lat, lon in self.TRACK
+        ])
+        tracks.compact(self.finished.pk, start + timedelta(minutes=10))
+        out = io.StringIO()
+        call_command('analyze_tracks', workers=1, stdout=out)
+        self.assertIn('Analysed 1 tracks', out.getvalue())
+        self.finished.refresh_from_db()
+        self.assertEqual((str(self.finished.actual_hours), self.finished.actual_end_date),
+                         ('0.33', timezone.localdate(start + timedelta(milliseconds=self.TRACK[-1][0]))))
+        call_command('analyze_tracks', workers=1, stdout=out)
+        self.assertIn('Analysed 0 tracks', out.getvalue())
+
+
+class LiveTrackingTests(JobTestData, TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(live, 'broker', return_value=live.LocalBroker())
+        self.hub = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.client.force_login(User.objects.get(username='farmer'))
+        self.cookie = f'sessionid={self.client.cookies["sessionid"].value}'.encode()
+
+    def watch(self, booking_id, cookie=None):
+        """Start a subscriber connection; returns its task, inbox and the queue of messages it was sent."""
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        inbox.put_nowait({'type': 'websocket.connect'})
+        scope = {'type': 'websocket', 'path': live.WEBSOCKET_PATH, 'query_string': f'booking={booking_id}'.encode(),
+                 'headers': [(b'cookie', self.cookie if cookie is None else cookie)]}
+        task = asyncio.ensure_future(live.booking_socket(scope, inbox.get, outbox.put))
+        return task, inbox, outbox
+
+    async def test_slow_subscriber_keeps_only_the_latest_update(self):
+        subscriber = self.hub.subscribe(live.channel(1))
+        for lat in (1, 2, 3):
+            self.hub.publish(live.channel(1), live.POSITION, {'lat': lat})
+        self.hub.publish(live.channel(1), live.STATUS, {'status': 'completed'})
+        self.hub.publish(live.channel(2), live.POSITION, {'lat': 9})
+        updates = await subscriber.updates()
+        self.assertEqual({kind: json.loads(text) for kind, text in updates.items()}, {
+            live.POSITION: {'type': 'position', 'lat': 3}, live.STATUS: {'type': 'status', 'status': 'completed'}})
+        self.assertEqual(subscriber.coalesced, 2)
+        self.hub.unsubscribe(subscriber)
+        self.assertIsNone(await subscriber.updates())
+        self.assertEqual(self.hub.channels, {})
+
+    async def test_positions_and_status_reach_the_farmer(self):
+        task, inbox, outbox = self.watch(self.booking.pk)
+        self.assertEqual(await outbox.get(), {'type': 'websocket.accept'})
+        snapshot = json.loads((await outbox.get())['text'])
+        self.assertEqual((snapshot['type'], snapshot['status']), ('snapshot', RentalBooking.Status.IN_PROGRESS))
+
+        now = time.time()
+        ingestor = telemetry.Ingestor()
+        ingestor.add(self.booking.pk, self.equipment.pk, [(now - 2, -300000, 36080000, 5, 90, 8)])
+        ingestor.add(self.booking.pk, self.equipment.pk, [(now - 1, -310000, 36090000, 6, 95, 8)])
+        position = json.loads((await outbox.get())['text'])
+        self.assertEqual((position['type'], position['lat'], position['lon']), ('position', -0.31, 36.09))
+
+        def finish():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.booking.status = RentalBooking.Status.COMPLETED
+                self.booking.save()
+        await sync_to_async(finish)()
+        self.assertEqual(json.loads((await outbox.get())['text'])['status'], RentalBooking.Status.COMPLETED)
+
+        inbox.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+        await task
+        self.assertEqual(self.hub.channels, {})
+
+    async def test_rejected_subscribers(self):
+        neighbour = await User.objects.acreate(username='neighbour', phone_number='+254700000006')
+        await sync_to_async(self.client.force_login)(neighbour)
+        neighbour_cookie = f'sessionid={self.client.cookies["sessionid"].value}'.encode()
+        for booking_id, cookie, code in [('x', None, 4400), (self.booking.pk, b'', 4401),
+                                         (self.booking.pk, neighbour_cookie, 4403)]:
+            with self.subTest(code=code):
+                task, _, outbox = self.watch(booking_id, cookie)
+                await task
+                self.assertEqual(await outbox.get(), {'type': 'websocket.close', 'code': code})
+        self.assertEqual(self.hub.channels, {})
+
+
+class BookingTransitionTests(JobTestData, TestCase):
+
+    def setUp(self):
+        self.farmer_user = User.objects.get(username='farmer')
+        start = timezone.localdate() + timedelta(days=5)
+        self.pending = RentalBooking.objects.create(
+            farmer=self.booking.farmer, equipment=self.equipment, operator=self.booking.operator,
+            job_description='Planting', land_size_acres=2, farm_location_county='Nakuru',
+            requested_start_date=start, requested_end_date=start + timedelta(days=1), quoted_rate=1000)
+
+    def sms(self, user):
+        return list(Notification.objects.filter(user=user, channel=Notification.Channel.SMS)
+                    .values_list('title', flat=True))
+
+    def test_edges_and_roles(self):
+        Status = RentalBooking.Status
+        with self.assertRaises(transitions.InvalidTransition):
+            transitions.transition(self.pending, Status.COMPLETED)
+        with self.assertRaises(transitions.NotAllowed):
+            transitions.transition(self.pending, Status.CONFIRMED, by=self.farmer_user)
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, Status.PENDING)
+
+        transitions.transition(self.pending, Status.CONFIRMED, by=self.operator_user)
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, Status.CONFIRMED)
+        self.assertEqual(self.sms(self.farmer_user), ['Booking confirmed'])
+        self.assertEqual(self.sms(self.operator_user), [])
+        self.assertEqual(transitions.allowed_targets(Status.CONFIRMED, [transitions.FARMER]),
+                         [Status.CANCELLED_FARMER])
+
+    def test_stale_click_changes_nothing(self):
+        operator_page = RentalBooking.objects.get(pk=self.pending.pk)
+        farmer_page = RentalBooking.objects.get(pk=self.pending.pk)
+        transitions.transition(operator_page, RentalBooking.Status.CONFIRMED, by=self.operator_user)
+        with self.assertRaises(transitions.TransitionConflict):
+            transitions.transition(farmer_page, RentalBooking.Status.CANCELLED_FARMER, by=self.farmer_user)
+        with self.assertRaises(availability.BookingConflict):
+            availability.reserve(RentalBooking.objects.get(pk=self.pending.pk))
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, RentalBooking.Status.CONFIRMED)
+        self.assertEqual(self.sms(self.operator_user), [])
+
+    def test_reserve_refuses_taken_days(self):
+        availability.reserve(self.pending)
+        rival = RentalBooking.objects.get(pk=self.pending.pk)
+        rival.pk = None
+        rival.status = RentalBooking.Status.PENDING
+        rival.save()
+        with self.assertRaises(availability.BookingConflict):
+            availability.reserve(rival)
+        self.assertEqual(RentalBooking.objects.get(pk=rival.pk).status, RentalBooking.Status.PENDING)
+
+    def test_cancelling_refunds_what_was_paid(self):
+        PaymentStatus = RentalBooking.PaymentStatus
+        pk = self.pending.pk
+        deposit = Decimal('600.00')
+        RentalBooking.objects.filter(pk=pk).update(total_amount=2000, deposit_amount=deposit)
+        payments.apply_callbacks([payments.parse_callback(
+            {'transaction_id': 'DEP-1', 'booking': pk, 'amount': str(deposit), 'method': 'airtel_money'})])
+        self.assertEqual(RentalBooking.objects.get(pk=pk).payment_status, PaymentStatus.DEPOSIT_PAID)
+
+        transitions.transition(self.pending, RentalBooking.Status.CANCELLED_FARMER, by=self.farmer_user)
+        refund = Payment.objects.get(booking_id=pk, payment_type=Payment.Type.REFUND)
+        self.assertEqual((refund.amount, refund.method, refund.is_confirmed), (deposit, 'airtel_money', False))
+        self.assertIsNone(payments.request_refund(pk))
+
+        payments.apply_callbacks([payments.parse_callback(
+            {'transaction_id': refund.transaction_id, 'booking': pk, 'amount': str(deposit),
+             'method': 'airtel_money', 'payment_type': 'refund'})])
+        self.assertEqual(RentalBooking.objects.get(pk=pk).payment_status, PaymentStatus.REFUNDED)
+
+        # REFUNDED is final: a late payment is logged, not applied.
+        with self.assertLogs('core.payments', 'WARNING'):
+            payments.apply_callbacks([payments.parse_callback(
+                {'transaction_id': 'DEP-2', 'booking': pk, 'amount': str(deposit)})])
+        self.assertEqual(RentalBooking.objects.get(pk=pk).payment_status, PaymentStatus.REFUNDED)
+        self.assertFalse(transitions.payment_edge_allowed(PaymentStatus.REFUNDED, PaymentStatus.DEPOSIT_PAID))
+
+    def test_side_effects(self):
+        Status = RentalBooking.Status
+        operator = self.booking.operator
+        transitions.transition(self.pending, Status.CONFIRMED)
+        transitions.transition(self.pending, Status.IN_PROGRESS)
+        self.equipment.refresh_from_db()
+        self.assertEqual(self.equipment.status, Equipment.Status.RENTED)
+        self.assertEqual(RentalBooking.objects.get(pk=self.pending.pk).actual_start_date, timezone.localdate())
+
+        # The unit is still out on the other job in progress.
+        transitions.transition(self.pending, Status.COMPLETED)
+        self.equipment.refresh_from_db()
+        self.assertEqual(self.equipment.status, Equipment.Status.RENTED)
+        transitions.transition(self.booking, Status.COMPLETED)
+        self.equipment.refresh_from_db()
+        self.assertEqual(self.equipment.status, Equipment.Status.AVAILABLE)
+        operator.refresh_from_db()
+        self.assertEqual(operator.total_jobs_completed, 3)
+
+        OperatorPayout.objects.create(operator=operator, booking=self.finished, gross_amount=1000,
+                                      platform_fee_amount=100, net_amount=900, payout_reference='RUN-1')
+        finished = RentalBooking.objects.get(pk=self.finished.pk)
+        transitions.transition(finished, Status.DISPUTED, by=self.farmer_user)
+        self.assertFalse(OperatorPayout.objects.filter(booking=self.finished).exists())
+        operator.refresh_from_db()
+        self.assertEqual(operator.total_jobs_completed, 2)
+        self.assertEqual(self.sms(self.operator_user), ['Booking disputed'])
+        with self.assertRaises(transitions.NotAllowed):
+            transitions.transition(finished, Status.COMPLETED, by=self.operator_user)
+
+    def test_endpoint(self):
+        url = f'/bookings/{self.pending.pk}/status/'
+        self.assertEqual(self.client.post(url, {'status': 'confirmed'}).status_code, 401)
+        self.client.force_login(self.farmer_user)
+        self.assertEqual(self.client.post(url, {'status': 'nonsense'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'status': 'confirmed'}).status_code, 403)
+        response = self.client.post(url, {'status': 'cancelled_farmer', 'expected': 'pending', 'reason': 'Rain'})
+        self.assertEqual(response.json(), {'id': self.pending.pk, 'status': 'cancelled_farmer'})
+        self.assertEqual(RentalBooking.objects.get(pk=self.pending.pk).cancellation_reason, 'Rain')
+        response = self.client.post(url, {'status': 'cancelled_farmer', 'expected': 'pending'})
+        self.assertEqual((response.status_code, response.json()['status']), (409, 'cancelled_farmer'))
+        response = self.client.post(url, {'status': 'disputed', 'expected': 'cancelled_farmer'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_deleted_booking_is_a_conflict(self):
+        stale = RentalBooking.objects.get(pk=self.pending.pk)
+        self.pending.delete()
+        with self.assertRaises(transitions.TransitionConflict):
+            transitions.transition(stale, RentalBooking.Status.CONFIRMED)
+
+    def test_admin_moves_status_through_transitions(self):
+        admin_user = User.objects.create_superuser(username='admin', password='x', phone_number='+254700000099')
+        self.client.force_login(admin_user)
+        changelist = '/admin/core/rentalbooking/'
+        response = self.client.get(f'{changelist}{self.pending.pk}/change/')
+        self.assertNotContains(response, 'name="status"')
+
+        response = self.client.post(changelist, {
+            'action': 'mark_confirmed', '_selected_action': [self.pending.pk, self.finished.pk]}, follow=True)
+        self.assertContains(response, 'Moved 1 booking(s) to Confirmed.')
+        self.assertContains(response, f'Booking #{self.finished.pk} cannot go from completed to confirmed')
+        self.assertEqual(RentalBooking.objects.get(pk=self.pending.pk).status, RentalBooking.Status.CONFIRMED)
+        self.assertEqual(self.sms(self.farmer_user), ['Booking confirmed'])
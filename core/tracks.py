@@ -0,0 +1,329 @@
+"""
+Compact storage for GPS tracks.
+
+``TelemetryFix`` rows are cheap to append but cost some 60 bytes each plus
+index, which over a season of jobs would outgrow every other table. The
+``compact_tracks`` command moves settled fixes into ``TrackChunk`` rows
+instead: up to ``CHUNK_SIZE`` fixes of one booking per row, stored as a
+self-describing block::
+
+    header  magic "AGTK", version, fix count, first time (ms), first lat/lon (microdegrees)
+    t       int32 x count   milliseconds since the previous fix
+    lat     int32 x count   microdegrees since the previous fix
+    lon     int32 x count   microdegrees since the previous fix
+
+which is 12 bytes a fix, little-endian. Blocks can be concatenated, so a
+track exported to a file with ``export()`` is just its chunks back to back
+and ``Track.open()`` maps it without reading it. ``Chunk`` reads a block
+through ``memoryview`` casts, never copying the columns, and ``Track``
+replays the deltas lazily for distance, working hours, coverage and the
+downsampled line drawn on the map. Speed, heading and accuracy are not
+kept once fixes are compacted.
+"""
+import heapq
+import math
+import mmap
+import struct
+import sys
+from array import array
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+
+from .geo import EARTH_RADIUS_KM
+from .models import TelemetryFix, TrackChunk
+
+HEADER = struct.Struct('<4sHxxIqii')
+MAGIC = b'AGTK'
+VERSION = 1
+CHUNK_SIZE = 4096
+INT32_MAX = 2 ** 31 - 1
+# Fixes further apart than this are treated as a stop, not time worked.
+MAX_GAP_SECONDS = 5 * 60
+NATIVE_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def to_ms(moment):
+    return round(moment.timestamp() * 1000)
+
+
+def from_ms(ms):
+    return datetime.fromtimestamp(ms / 1000, dt_timezone.utc)
+
+
+def _fits(value):
+    return -INT32_MAX <= value <= INT32_MAX
+
+
+def pack(points):
+    """One block for ``points``, a non-empty sequence of ``(t_ms, lat_e6, lon_e6)`` in time order."""
+    t0, lat0, lon0 = points[0]
+    columns = (array('i'), array('i'), array('i'))
+    previous = points[0]
+    for point in points:
+        for column, value, before in zip(columns, point, previous):
+            column.append(value - before)
+        previous = point
+    if not NATIVE_LITTLE_ENDIAN:
+        for column in columns:
+            column.byteswap()
+    return b''.join([HEADER.pack(MAGIC, VERSION, len(points), t0, lat0, lon0),
+                     *(column.tobytes() for column in columns)])
+
+
+def split(points, size=None):
+    """``points`` cut into runs of at most ``size`` whose deltas fit in int32."""
+    size = size or CHUNK_SIZE
+    run = []
+    for point in points:
+        if run and (len(run) == size or not all(_fits(a - b) for a, b in zip(point, run[-1]))):
+            yield run
+            run = []
+        run.append(point)
+    if run:
+        yield run
+
+
+class Chunk:
+    """A read-only view of one block in ``buffer`` at ``offset``."""
+    __slots__ = ('count', 'start', 'nbytes', 't', 'lat', 'lon')
+
+    def __init__(self, buffer, offset=0):
+        view = memoryview(buffer)
+        magic, version, count, t0, lat0, lon0 = HEADER.unpack_from(view, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a version {VERSION} track block at offset {offset}")
+        body = offset + HEADER.size
+        self.count = count
+        self.start = (t0, lat0, lon0)
+        self.nbytes = HEADER.size + 12 * count
+        if len(view) < offset + self.nbytes:
+            raise ValueError(f"Track block at offset {offset} is truncated")
+        columns = view[body:body + 12 * count]
+        if NATIVE_LITTLE_ENDIAN:
+            columns = columns.cast('i')
+        else:
+            columns = array('i', columns.tobytes())
+            columns.byteswap()
+        self.t, self.lat, self.lon = columns[:count], columns[count:2 * count], columns[2 * count:]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        t, lat, lon = self.start
+        for dt, dlat, dlon in zip(self.t, self.lat, self.lon):
+            t += dt
+            lat += dlat
+            lon += dlon
+            yield t, lat, lon
+
+
+class Track:
+    """A booking's fixes as ``(t_ms, lat_e6, lon_e6)``, in time order, over one or more chunks."""
+
+    def __init__(self, chunks=(), source=None):
+        self.chunks = list(chunks)
+        self._source = source
+
+    @classmethod
+    def from_buffer(cls, buffer, source=None):
+        chunks, offset = [], 0
+        while offset < len(buffer):
+            chunk = Chunk(buffer, offset)
+            chunks.append(chunk)
+            offset += chunk.nbytes
+        return cls(chunks, source)
+
+    @classmethod
+    def open(cls, path):
+        """Map an ``export()``-ed track file; the chunks read straight from the page cache."""
+        with open(path, 'rb') as file:
+            if not file.seek(0, 2):
+                return cls()
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls.from_buffer(mapped, source=mapped)
+
+    def close(self):
+        if self._source is not None:
+            for chunk in self.chunks:
+                for column in (chunk.t, chunk.lat, chunk.lon):
+                    if isinstance(column, memoryview):
+                        column.release()
+            self.chunks = []
+            self._source.close()
+            self._source = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield from chunk
+
+    def pairs(self):
+        points = iter(self)
+        previous = next(points, None)
+        for point in points:
+            yield previous, point
+            previous = point
+
+    def distance_km(self):
+        total = 0.0
+        for (_, lat1, lon1), (_, lat2, lon2) in self.pairs():
+            total += _haversine_e6(lat1, lon1, lat2, lon2)
+        return total
+
+    def working_hours(self, max_gap_seconds=MAX_GAP_SECONDS):
+        """Time between consecutive fixes, leaving out gaps longer than ``max_gap_seconds``."""
+        limit = max_gap_seconds * 1000
+        worked = sum(dt for dt in (b[0] - a[0] for a, b in self.pairs()) if dt <= limit)
+        return worked / 3_600_000
+
+    def coverage_hectares(self, cell_metres=10, max_gap_seconds=MAX_GAP_SECONDS):
+        """
+        Area of the ``cell_metres`` grid squares the track passes through,
+        following the line between fixes except across stops.
+        """
+        points = iter(self)
+        first = next(points, None)
+        if first is None:
+            return 0.0
+        grid = Grid(first[1], cell_metres)
+        cells = {grid.cell(first)}
+        limit = max_gap_seconds * 1000
+        previous = first
+        for point in points:
+            if point[0] - previous[0] > limit:
+                cells.add(grid.cell(point))
+            else:
+                cells.update(grid.crossed(previous, point))
+            previous = point
+        return grid.hectares(len(cells))
+
+    def downsample(self, max_points):
+        """
+        At most ``max_points`` fixes that keep the track's shape for drawing
+        (largest-triangle-three-buckets): the first and last fixes, and from
+        each bucket between them the one that bends the line the most.
+        """
+        points = list(self)
+        if len(points) <= max_points:
+            return points
+        if max_points < 3:
+            return [points[0], points[-1]][:max(max_points, 0)]
+        size = (len(points) - 2) / (max_points - 2)
+        kept = [points[0]]
+        for bucket in range(max_points - 2):
+            lo, hi = int(bucket * size) + 1, int((bucket + 1) * size) + 1
+            following = points[hi:min(int((bucket + 2) * size) + 1, len(points) - 1)] or [points[-1]]
+            avg_lat = sum(p[1] for p in following) / len(following)
+            avg_lon = sum(p[2] for p in following) / len(following)
+            _, lat, lon = kept[-1]
+            kept.append(max(points[lo:hi], key=lambda p: abs(
+                (lat - avg_lat) * (p[2] - lon) - (lat - p[1]) * (avg_lon - lon))))
+        kept.append(points[-1])
+        return kept
+
+    def to_bytes(self):
+        return b''.join(pack(run) for run in split(self))
+
+
+class Grid:
+    """
+    Square cells of ``cell_metres`` numbered by row and column. A job spans
+    a few kilometres at most, so the longitude scale of ``lat_e6`` will do
+    for all of it.
+    """
+
+    def __init__(self, lat_e6, cell_metres=10):
+        self.cell_metres = cell_metres
+        self.lat_step = cell_metres / 111_320 * 1e6
+        self.lon_step = self.lat_step / max(math.cos(math.radians(lat_e6 / 1e6)), 1e-6)
+
+    def cell(self, point):
+        _, lat, lon = point
+        return int(lat // self.lat_step), int(lon // self.lon_step)
+
+    def crossed(self, a, b):
+        """The cells along the straight line from fix ``a`` to fix ``b``, without ``a``'s own."""
+        (t1, lat1, lon1), (t2, lat2, lon2) = a, b
+        steps = max(1, math.ceil(max(abs(lat2 - lat1) / self.lat_step, abs(lon2 - lon1) / self.lon_step)))
+        for step in range(1, steps + 1):
+            yield self.cell((t2, lat1 + (lat2 - lat1) * step / steps, lon1 + (lon2 - lon1) * step / steps))
+
+    def hectares(self, cells):
+        return cells * self.cell_metres * self.cell_metres / 10_000
+
+
+def _haversine_e6(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (math.radians(v / 1e6) for v in (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _pending(booking_id, after_ms=None, **filters):
+    fixes = TelemetryFix.objects.filter(booking_id=booking_id, **filters).order_by('recorded_at', 'pk')
+    return [(to_ms(t), lat, lon) for t, lat, lon in fixes.values_list('recorded_at', 'latitude_e6', 'longitude_e6')
+            if after_ms is None or to_ms(t) > after_ms]
+
+
+def load(booking_id):
+    """
+    The booking's whole track: its chunks, then the fixes not compacted yet.
+    Both are read in one transaction, so a ``compact()`` committing between
+    the two reads cannot drop or repeat fixes (SQLite reads from one
+    snapshot per transaction; other backends need REPEATABLE READ).
+    """
+    with transaction.atomic():
+        blobs = list(TrackChunk.objects.filter(booking_id=booking_id).order_by('seq').values_list('data', flat=True))
+        pending = _pending(booking_id)
+    chunks = [Chunk(blob) for blob in blobs]
+    if pending:
+        chunks += [Chunk(pack(run)) for run in split(sorted(pending))]
+    return Track(chunks)
+
+
+def export(booking_id, path):
+    """Write the booking's track to ``path`` for ``Track.open()``; returns the number of bytes."""
+    data = load(booking_id).to_bytes()
+    with open(path, 'wb') as file:
+        file.write(data)
+    return len(data)
+
+
+def compact(booking_id, before):
+    """
+    Move the booking's fixes recorded before ``before`` into chunks and
+    delete their rows. Fixes arriving late, older than what is already
+    compacted, are merged in order. Returns the number of fixes moved.
+    """
+    with transaction.atomic():
+        fixes = TelemetryFix.objects.filter(booking_id=booking_id, recorded_at__lt=before)
+        last_pk = fixes.order_by('-pk').values_list('pk', flat=True).first()
+        if last_pk is None:
+            return 0
+        fixes = fixes.filter(pk__lte=last_pk)
+        new = _pending(booking_id, recorded_at__lt=before, pk__lte=last_pk)
+        chunks = list(TrackChunk.objects.filter(booking_id=booking_id).order_by('seq'))
+        if chunks and new[0][0] < to_ms(chunks[-1].ended_at):
+            rewrite, seq = chunks, 0
+        else:
+            # Refill the last chunk rather than leave a short one behind every run.
+            rewrite = chunks[-1:] if chunks and chunks[-1].fix_count < CHUNK_SIZE else []
+            seq = chunks[-1].seq + 1 - len(rewrite) if chunks else 0
+        points = heapq.merge(*(Chunk(chunk.data) for chunk in rewrite), new)
+        TrackChunk.objects.filter(pk__in=[chunk.pk for chunk in rewrite]).delete()
+        TrackChunk.objects.bulk_create([
+            TrackChunk(booking_id=booking_id, seq=seq + i, started_at=from_ms(run[0][0]), ended_at=from_ms(run[-1][0]),
+                       fix_count=len(run), data=pack(run))
+            for i, run in enumerate(split(points))
+        ])
+        fixes.delete()
+    return len(new)
@@ -0,0 +1,213 @@
+"""
+Booking status changes.
+
+``transition()`` is the one way a booking's status should move. It checks
+the edge against ``EDGES`` (and, given the acting user, that their role may
+take it), then writes it with a conditional ``UPDATE ... WHERE status =
+<the status the caller saw>``. When two people act on the same booking at
+once, say the farmer cancelling while the operator confirms, exactly one
+UPDATE matches; the other raises ``TransitionConflict`` and changes nothing,
+instead of both being told they succeeded and the last write winning.
+
+Everything that follows from the change happens in the same transaction,
+so it commits or rolls back with it. ``update()`` sends no ``post_save``,
+so the hooks the save signal would run are called here directly:
+
+* occupancy bitmaps, the operator's completed-job count and the live
+  status published to watchers;
+* ``Equipment.status``: RENTED while a job is in progress, AVAILABLE after
+  (units in maintenance or inactive are left alone), with the facet counts
+  invalidated;
+* an SMS to the other party through the notification outbox;
+* a payout no run has settled yet is withdrawn when a job stops being
+  COMPLETED, so a disputed job is not paid out meanwhile;
+* cancelling a booking the farmer has paid towards queues a refund of the
+  net amount (see ``payments.request_refund()``).
+
+``payment_status`` is not moved by hand: it follows the confirmed ledger
+and ``payments.refresh_payment_status()`` is its only writer. That write is
+still checked against ``PAYMENT_EDGES``, so money arriving after a booking
+was refunded is left for staff instead of quietly flipping it back to
+paid.
+
+On SQLite, ``select_for_update()`` in ``availability.claim()`` compiles to
+nothing. Concurrent confirmations are serialised there by the database
+lock instead: with ``SQLITE_PRODUCTION_OPTIONS`` every transaction opens
+with BEGIN IMMEDIATE, so the second writer waits for the first to commit
+and then sees its booking.
+"""
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import availability, facets, live, notifications, occupancy, payments, payouts, reputation
+from .models import Equipment, Notification, RentalBooking
+
+Status = RentalBooking.Status
+
+FARMER = 'farmer'
+OPERATOR = 'operator'
+STAFF = 'staff'
+
+# (from, to): the roles that may take the edge.
+EDGES = {
+    (Status.PENDING, Status.CONFIRMED): {OPERATOR, STAFF},
+    (Status.PENDING, Status.CANCELLED_FARMER): {FARMER, STAFF},
+    (Status.PENDING, Status.CANCELLED_OPERATOR): {OPERATOR, STAFF},
+    (Status.CONFIRMED, Status.IN_PROGRESS): {OPERATOR, STAFF},
+    (Status.CONFIRMED, Status.CANCELLED_FARMER): {FARMER, STAFF},
+    (Status.CONFIRMED, Status.CANCELLED_OPERATOR): {OPERATOR, STAFF},
+    (Status.IN_PROGRESS, Status.COMPLETED): {OPERATOR, STAFF},
+    (Status.IN_PROGRESS, Status.DISPUTED): {FARMER, OPERATOR, STAFF},
+    (Status.COMPLETED, Status.DISPUTED): {FARMER, OPERATOR, STAFF},
+    (Status.DISPUTED, Status.COMPLETED): {STAFF},
+    (Status.DISPUTED, Status.CANCELLED_OPERATOR): {STAFF},
+}
+CANCELLED = (Status.CANCELLED_FARMER, Status.CANCELLED_OPERATOR)
+
+PaymentStatus = RentalBooking.PaymentStatus
+# (from, to) moves of payment_status: payments move it up, refunds and
+# corrected callback amounts move it down. REFUNDED is final.
+PAYMENT_EDGES = {
+    (PaymentStatus.UNPAID, PaymentStatus.DEPOSIT_PAID),
+    (PaymentStatus.UNPAID, PaymentStatus.FULLY_PAID),
+    (PaymentStatus.UNPAID, PaymentStatus.REFUNDED),
+    (PaymentStatus.DEPOSIT_PAID, PaymentStatus.FULLY_PAID),
+    (PaymentStatus.DEPOSIT_PAID, PaymentStatus.UNPAID),
+    (PaymentStatus.DEPOSIT_PAID, PaymentStatus.REFUNDED),
+    (PaymentStatus.FULLY_PAID, PaymentStatus.DEPOSIT_PAID),
+    (PaymentStatus.FULLY_PAID, PaymentStatus.UNPAID),
+    (PaymentStatus.FULLY_PAID, PaymentStatus.REFUNDED),
+}
+
+# Who hears about the change, and what they are told.
+MESSAGES = {
+    Status.CONFIRMED: ((FARMER,), "Booking confirmed", "{equipment} is booked for you from {start} to {end}."),
+    Status.CANCELLED_FARMER: ((OPERATOR,), "Booking cancelled", "The farmer cancelled booking #{pk} ({equipment})."),
+    Status.CANCELLED_OPERATOR: ((FARMER,), "Booking cancelled", "Booking #{pk} for {equipment} was cancelled."),
+    Status.IN_PROGRESS: ((FARMER,), "Job started", "Work on booking #{pk} with {equipment} has started."),
+    Status.COMPLETED: ((FARMER,), "Job completed", "Booking #{pk} with {equipment} is complete."),
+    Status.DISPUTED: ((FARMER, OPERATOR), "Booking disputed", "Booking #{pk} ({equipment}) is under dispute."),
+}
+
+
+class TransitionError(Exception):
+    """The booking's status was not changed."""
+
+
+class InvalidTransition(TransitionError):
+    """No edge leads from the booking's status to the one asked for."""
+
+
+class NotAllowed(TransitionError):
+    """The acting user's role may not take this edge."""
+
+
+class TransitionConflict(TransitionError):
+    """Someone else changed the booking's status first."""
+
+
+def allowed_targets(status, roles=(FARMER, OPERATOR, STAFF)):
+    return [target for (source, target), who in EDGES.items() if source == status and who & set(roles)]
+
+
+def payment_edge_allowed(source, target):
+    return (source, target) in PAYMENT_EDGES
+
+
+def roles_of(user, farmer_user_id, operator_user_id):
+    roles = set()
+    if user.is_staff:
+        roles.add(STAFF)
+    if user.pk == farmer_user_id:
+        roles.add(FARMER)
+    if user.pk == operator_user_id:
+        roles.add(OPERATOR)
+    return roles
+
+
+def transition(booking, target, by=None, reason=''):
+    """
+    Move ``booking`` from the status it was loaded with to ``target``,
+    acting as ``by`` (a user; ``None`` for the system, which may take any
+    edge). ``reason`` is kept on cancellations. Raises ``InvalidTransition``,
+    ``NotAllowed``, ``TransitionConflict``, or for a confirmation
+    ``availability.BookingConflict`` when the unit is taken.
+    """
+    source = booking.status
+    allowed = EDGES.get((source, target))
+    if allowed is None:
+        raise InvalidTransition(f"Booking #{booking.pk} cannot go from {source} to {target}")
+    today = timezone.localdate()
+    changes = {'status': target, 'updated_at': timezone.now()}
+    if target == Status.IN_PROGRESS:
+        changes['actual_start_date'] = Coalesce('actual_start_date', Value(today))
+    elif target == Status.COMPLETED:
+        changes['actual_end_date'] = Coalesce('actual_end_date', Value(today))
+    elif target in CANCELLED and reason:
+        changes['cancellation_reason'] = reason
+
+    with transaction.atomic():
+        parties = RentalBooking.objects.filter(pk=booking.pk).values_list(
+            'farmer__user_id', 'operator__user_id', 'equipment__name').first()
+        if parties is None:
+            raise TransitionConflict(f"Booking #{booking.pk} no longer exists")
+        farmer_user_id, operator_user_id, equipment_name = parties
+        if by is not None and not roles_of(by, farmer_user_id, operator_user_id) & allowed:
+            raise NotAllowed(f"User #{by.pk} may not move booking #{booking.pk} to {target}")
+        if target == Status.CONFIRMED:
+            availability.claim(booking)
+        if not RentalBooking.objects.filter(pk=booking.pk, status=source).update(**changes):
+            raise TransitionConflict(f"Booking #{booking.pk} is no longer {source}")
+
+        previous = {
+            'status': source,
+            **{f: getattr(booking, '_loaded_values', {}).get(f, getattr(booking, f))
+               for f in ('equipment_id', 'requested_start_date', 'requested_end_date')},
+        }
+        booking.status = target
+        if target == Status.IN_PROGRESS:
+            booking.actual_start_date = booking.actual_start_date or today
+        elif target == Status.COMPLETED:
+            booking.actual_end_date = booking.actual_end_date or today
+        elif 'cancellation_reason' in changes:
+            booking.cancellation_reason = reason
+
+        occupancy.booking_changed(booking, previous)
+        reputation.booking_changed(booking, previous)
+        _equipment_status(booking, source, target)
+        if source == Status.COMPLETED:
+            payouts.withdraw(booking.pk)
+        if target in CANCELLED:
+            payments.request_refund(booking.pk)
+        _notify(booking, target, {FARMER: farmer_user_id, OPERATOR: operator_user_id}, equipment_name, by)
+        live.booking_changed(booking, previous)
+    booking._loaded_values = {**getattr(booking, '_loaded_values', {}), 'status': target}
+    return booking
+
+
+def _equipment_status(booking, source, target):
+    units = Equipment.objects.filter(pk=booking.equipment_id)
+    if target == Status.IN_PROGRESS:
+        moved = units.filter(status=Equipment.Status.AVAILABLE).update(
+            status=Equipment.Status.RENTED, updated_at=timezone.now())
+    elif source == Status.IN_PROGRESS and not RentalBooking.objects.filter(
+            equipment_id=booking.equipment_id, status=Status.IN_PROGRESS).exists():
+        moved = units.filter(status=Equipment.Status.RENTED).update(
+            status=Equipment.Status.AVAILABLE, updated_at=timezone.now())
+    else:
+        moved = 0
+    if moved:
+        facets.invalidate()
+
+
+def _notify(booking, target, users, equipment_name, by):
+    recipients, title, message = MESSAGES[target]
+    text = message.format(pk=booking.pk, equipment=equipment_name, start=booking.requested_start_date,
+                          end=booking.requested_end_date)
+    notifications.enqueue_many([
+        Notification(user_id=users[role], title=title, message=text, channel=Notification.Channel.SMS,
+                     related_booking_id=booking.pk)
+        for role in recipients if by is None or users[role] != by.pk
+    ])
@@ -0,0 +1,126 @@
+"""
+Unread-notification counters for the header badge.
+
+Each user's unread count lives in ``UnreadCounter`` and is moved with a
+single ``UPDATE ... SET unread = unread + n`` whenever a notification is
+created, read or deleted, so the badge never counts ``Notification`` rows.
+``count()`` reads through the cache; writers drop the cached value once
+their transaction commits, which only reaches every worker because the
+cache is shared (see ``CACHES``).
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Notification, UnreadCounter, User
+
+CACHE_TIMEOUT = 5 * 60
+
+
+def _key(user_id):
+    return f'unread:{user_id}'
+
+
+def _forget(user_ids):
+    keys = [_key(pk) for pk in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def count(user_id):
+    """The user's unread notification count; one cache hit or one primary-key lookup."""
+    unread = cache.get(_key(user_id))
+    if unread is None:
+        unread = UnreadCounter.objects.filter(user_id=user_id).values_list('unread', flat=True).first() or 0
+        cache.set(_key(user_id), unread, CACHE_TIMEOUT)
+    return unread
+
+
+def adjust(deltas):
+    """Apply ``{user_id: change}`` to the counters."""
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    by_delta = {}
+    for user_id, delta in deltas.items():
+        by_delta.setdefault(delta, []).append(user_id)
+    now = timezone.now()
+    with transaction.atomic():
+        UnreadCounter.objects.bulk_create([UnreadCounter(user_id=pk) for pk in deltas], ignore_conflicts=True)
+        for delta, user_ids in by_delta.items():
+            UnreadCounter.objects.filter(user_id__in=user_ids).update(
+                unread=Greatest(F('unread') + delta, Value(0)), updated_at=now)
+    _forget(deltas)
+
+
+def notifications_created(notifications):
+    """Count in notifications created without signals, e.g. by ``bulk_create``."""
+    deltas = {}
+    for notification in notifications:
+        if not notification.is_read:
+            deltas[notification.user_id] = deltas.get(notification.user_id, 0) + 1
+    adjust(deltas)
+
+
+def notification_saved(notification, created, previous):
+    deltas = {}
+    if created or {'user_id', 'is_read'} <= previous.keys():
+        if not created and not previous['is_read']:
+            deltas[previous['user_id']] = -1
+        if not notification.is_read:
+            deltas[notification.user_id] = deltas.get(notification.user_id, 0) + 1
+    adjust(deltas)
+
+
+def notification_deleted(notification):
+    if not notification.is_read:
+        adjust({notification.user_id: -1})
+
+
+def mark_read(user_id, notification_ids):
+    """Mark some of a user's notifications read; returns how many changed."""
+    with transaction.atomic():
+        changed = Notification.objects.filter(user_id=user_id, pk__in=notification_ids, is_read=False).update(
+            is_read=True)
+        adjust({user_id: -changed})
+    return changed
+
+
+def mark_all_read(user_id):
+    """
+    Mark every notification of the user read; returns how many changed.
+    The counter drops by that many rather than to zero, so a notification
+    another transaction is counting in at the same moment is not lost.
+    """
+    with transaction.atomic():
+        changed = Notification.objects.filter(user_id=user_id, is_read=False).update(is_read=True)
+        adjust({user_id: -changed})
+    return changed
+
+
+def reconcile(batch_size=1000, fix=True):
+    """Recount unread notifications from source; returns ``(checked, drifted)``."""
+    checked = drifted = 0
+    last_pk = 0
+    while user_ids := list(User.objects.filter(pk__gt=last_pk).order_by('pk')
+                           .values_list('pk', flat=True)[:batch_size]):
+        last_pk = user_ids[-1]
+        truth = dict(
+            Notification.objects.filter(user_id__in=user_ids, is_read=False)
+            .order_by().values_list('user_id').annotate(n=Count('id'))
+        )
+        stored = dict(UnreadCounter.objects.filter(user_id__in=user_ids).values_list('user_id', 'unread'))
+        fixes = []
+        for user_id in user_ids:
+            if user_id not in stored and not truth.get(user_id):
+                continue
+            checked += 1
+            if stored.get(user_id) != truth.get(user_id, 0):
+                drifted += 1
+                fixes.append(UnreadCounter(user_id=user_id, unread=truth.get(user_id, 0)))
+        if fix and fixes:
+            UnreadCounter.objects.bulk_create(
+                fixes, update_conflicts=True, unique_fields=['user'], update_fields=['unread', 'updated_at'])
+            _forget([counter.user_id for counter in fixes])
+    return checked, drifted
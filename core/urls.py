@@ -0,0 +1,18 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'core'
+
+urlpatterns = [
+    path('payments/callback/', views.payment_callback, name='payment-callback'),
+    path('equipment/', views.equipment_list, name='equipment-list'),
+    path('equipment/search/', views.equipment_search, name='equipment-search'),
+    path('equipment/facets/', views.equipment_facets, name='equipment-facets'),
+    path('suggest/<str:kind>/', views.suggest, name='suggest'),
+    path('bookings/', views.booking_list, name='booking-list'),
+    path('bookings/<int:pk>/status/', views.booking_transition, name='booking-transition'),
+    path('bookings/<int:pk>/track/', views.booking_track, name='booking-track'),
+    path('bookings/<int:pk>/telemetry-token/', views.booking_telemetry_token, name='booking-telemetry-token'),
+    path('notifications/', views.notification_list, name='notification-list'),
+]
@@ -1,3 +1,261 @@
-from django.shortcuts import render
+import functools
+import hmac
+import json
 
-# Create your views here.
+from django.conf import settings
+from django.db.models import Q
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from . import autocomplete, availability, facets, fulltext, jobs, payments, telemetry, tracks, transitions
+from .models import Equipment, Notification, RentalBooking, User
+from .pagination import CursorPaginator, InvalidCursor
+
+
+@csrf_exempt
+@require_POST
+def payment_callback(request):
+    """
+    Mobile-money callback endpoint. Accepts one normalised callback or a list
+    of them and answers once they are committed, so an acknowledged payment
+    is never lost; re-deliveries are reported as duplicates. Callbacks are
+    refused unless they carry ``PAYMENT_CALLBACK_TOKEN``, which must be set.
+    """
+    token = getattr(settings, 'PAYMENT_CALLBACK_TOKEN', '')
+    if not token:
+        # Without a shared secret anyone could confirm payments, so refuse them all.
+        return JsonResponse({'error': 'Payment callbacks are not configured'}, status=403)
+    if not hmac.compare_digest(request.headers.get('X-Callback-Token', ''), token):
+        return JsonResponse({'error': 'Invalid callback token'}, status=403)
+    try:
+        body = json.loads(request.body)
+        callbacks = [payments.parse_callback(item) for item in (body if isinstance(body, list) else [body])]
+    except (ValueError, payments.InvalidCallback) as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    outcome = payments.batcher.submit(callbacks)
+    return JsonResponse(payments.summarise(outcome, callbacks))
+
+
+def _cursor_page(request, queryset, serialize, ordering=('-created_at', '-pk')):
+    """JSON page of ``queryset`` from the request's ``cursor``, with a link to the next page."""
+    paginator = CursorPaginator(queryset, ordering)
+    try:
+        page_size = int(request.GET.get('page_size') or 0) or None
+        page = paginator.page(request.GET.get('cursor'), page_size)
+    except (ValueError, InvalidCursor) as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    next_url = None
+    if page.has_next:
+        query = request.GET.copy()
+        query['cursor'] = page.next_cursor
+        next_url = f"{request.path}?{query.urlencode()}"
+    return JsonResponse({'results': [serialize(item) for item in page.items], 'next': next_url})
+
+
+def _login_required_json(view):
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+@require_GET
+def equipment_list(request):
+    """Listed equipment, newest first; filter with ``status``, ``category`` and ``county``."""
+    filters = {'status': 'status', 'category': 'category_id'}
+    try:
+        equipment = Equipment.objects.select_related('category').filter(**{
+            lookup: request.GET[param] for param, lookup in filters.items() if request.GET.get(param)
+        })
+        if request.GET.get('county'):
+            equipment = equipment.filter(current_county__in=autocomplete.variants('county', request.GET['county']))
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return _cursor_page(request, equipment, lambda e: {
+        'id': e.pk,
+        'name': e.name,
+        'category': e.category.name,
+        'brand': e.brand,
+        'status': e.status,
+        'county': e.current_county,
+        'daily_rate': str(e.daily_rate),
+        'hourly_rate': str(e.hourly_rate) if e.hourly_rate is not None else None,
+        'created_at': e.created_at.isoformat(),
+    })
+
+
+@require_GET
+def equipment_search(request):
+    """Full-text equipment search on ``q``, best match first; filter with ``category``, ``status``, ``county``."""
+    try:
+        limit = max(1, min(int(request.GET.get('page_size') or 20), 100))
+        offset = max(int(request.GET.get('offset') or 0), 0)
+        category = int(request.GET['category']) if request.GET.get('category') else None
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    results = fulltext.search(request.GET.get('q', ''), category=category,
+                              status=request.GET.get('status', Equipment.Status.AVAILABLE),
+                              county=request.GET.get('county'), limit=limit, offset=offset)
+    return JsonResponse({'results': [{
+        'id': e.pk,
+        'name': e.name,
+        'category': e.category.name,
+        'brand': e.brand,
+        'model': e.model,
+        'capacity_info': e.capacity_info,
+        'county': e.current_county,
+        'daily_rate': str(e.daily_rate),
+        'rank': e.search_rank,
+    } for e in results]})
+
+
+@require_GET
+def equipment_facets(request):
+    """
+    Unit counts per category, fuel type, county, horsepower band and price
+    inclusion for the browse page's current selection (see ``core.facets``).
+    """
+    try:
+        selected = facets.parse_selection(request.GET)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    total, counts = facets.counts(selected, request.GET.get('status', Equipment.Status.AVAILABLE))
+    labels = facets.labels()
+    return JsonResponse({'total': total, 'facets': {
+        facet: [
+            {'value': value, 'label': labels.get(facet, {}).get(value, value), 'count': count,
+             'selected': value in selected.get(facet, ())}
+            for value, count in sorted(values.items(), key=lambda item: (-item[1], str(item[0])))
+        ]
+        for facet, values in counts.items()
+    }})
+
+
+@require_GET
+def suggest(request, kind):
+    """Most used values of ``kind`` (county, village, crop, brand) starting with ``q``."""
+    if kind not in autocomplete.SOURCES:
+        return JsonResponse({'error': f"Unknown field '{kind}'"}, status=404)
+    try:
+        limit = int(request.GET.get('limit') or 10)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return JsonResponse({'results': [
+        {'value': suggestion.value, 'count': suggestion.count}
+        for suggestion in autocomplete.suggest(kind, request.GET.get('q', ''), limit)
+    ]})
+
+
+@require_GET
+@_login_required_json
+def booking_list(request):
+    """The signed-in farmer's bookings, or an operator's jobs, newest first."""
+    if request.user.role == User.Role.OPERATOR:
+        bookings = RentalBooking.objects.filter(operator__user=request.user)
+    else:
+        bookings = RentalBooking.objects.filter(farmer__user=request.user)
+    if request.GET.get('status'):
+        bookings = bookings.filter(status=request.GET['status'])
+    return _cursor_page(request, bookings.select_related('equipment'), lambda b: {
+        'id': b.pk,
+        'equipment': b.equipment.name,
+        'status': b.status,
+        'payment_status': b.payment_status,
+        'requested_start_date': b.requested_start_date.isoformat(),
+        'requested_end_date': b.requested_end_date.isoformat(),
+        'total_amount': str(b.total_amount),
+        'created_at': b.created_at.isoformat(),
+    })
+
+
+@require_POST
+@_login_required_json
+def booking_transition(request, pk):
+    """
+    Move a booking to the ``status`` posted, as the signed-in farmer,
+    operator or staff member. Post the status the page showed as
+    ``expected``: if the booking has moved on since, nothing changes and
+    the answer is 409 with the current status, so two people clicking at
+    once cannot both win. A status that cannot follow ``expected`` at all
+    is a 400.
+    """
+    bookings = RentalBooking.objects.all()
+    if not request.user.is_staff:
+        bookings = bookings.filter(Q(farmer__user=request.user) | Q(operator__user=request.user))
+    booking = get_object_or_404(bookings, pk=pk)
+    target = request.POST.get('status')
+    expected = request.POST.get('expected', booking.status)
+    if target not in RentalBooking.Status.values or expected not in RentalBooking.Status.values:
+        return JsonResponse({'error': "Unknown status"}, status=400)
+    booking.status = expected
+    try:
+        transitions.transition(booking, target, by=request.user, reason=request.POST.get('reason', ''))
+    except transitions.NotAllowed as exc:
+        return JsonResponse({'error': str(exc)}, status=403)
+    except transitions.InvalidTransition as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    except (transitions.TransitionError, availability.BookingConflict) as exc:
+        current = RentalBooking.objects.filter(pk=pk).values_list('status', flat=True).first()
+        return JsonResponse({'error': str(exc), 'status': current}, status=409)
+    return JsonResponse({'id': booking.pk, 'status': booking.status})
+
+
+@require_GET
+@_login_required_json
+def booking_telemetry_token(request, pk):
+    """Token the operator's device presents to the telemetry WebSocket for this booking."""
+    booking = get_object_or_404(RentalBooking, pk=pk, operator__user=request.user)
+    if booking.status not in (RentalBooking.Status.CONFIRMED, RentalBooking.Status.IN_PROGRESS):
+        return JsonResponse({'error': f"Booking is {booking.get_status_display().lower()}"}, status=409)
+    token = telemetry.device_token(booking)
+    return JsonResponse({'token': token, 'path': f"{telemetry.WEBSOCKET_PATH}?token={token}"})
+
+
+@require_GET
+@_login_required_json
+def booking_track(request, pk):
+    """
+    The job's GPS track, downsampled to ``max_points`` for the map, with its
+    distance, hours and coverage, and the moving hours and worked acres
+    ``jobs.TrackAnalyzer`` reads from it beside the acres booked.
+    """
+    booking = get_object_or_404(RentalBooking.objects.filter(
+        Q(farmer__user=request.user) | Q(operator__user=request.user)), pk=pk)
+    try:
+        max_points = max(2, min(int(request.GET.get('max_points') or 500), 5000))
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    track = tracks.load(booking.pk)
+    job = jobs.TrackAnalyzer().feed(track)
+    return JsonResponse({
+        'fixes': len(track),
+        'distance_km': round(track.distance_km(), 3),
+        'working_hours': round(track.working_hours(), 2),
+        'coverage_hectares': round(track.coverage_hectares(), 2),
+        'moving_hours': round(job.moving_seconds / 3600, 2),
+        'worked_acres': round(job.worked_acres, 2),
+        'land_size_acres': float(booking.land_size_acres),
+        'points': [[lat / 1e6, lon / 1e6, t] for t, lat, lon in track.downsample(max_points)],
+    })
+
+
+@require_GET
+@_login_required_json
+def notification_list(request):
+    """The signed-in user's notifications, newest first; ``unread=1`` for unread only."""
+    notifications = Notification.objects.filter(user=request.user)
+    if request.GET.get('unread') == '1':
+        notifications = notifications.filter(is_read=False)
+    return _cursor_page(request, notifications, lambda n: {
+        'id': n.pk,
+        'title': n.title,
+        'message': n.message,
+        'channel': n.channel,
+        'is_read': n.is_read,
+        'related_booking': n.related_booking_id,
+        'sent_at': n.sent_at.isoformat(),
+    }, ordering=('-sent_at', '-pk'))